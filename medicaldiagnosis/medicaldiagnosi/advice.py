@@ -0,0 +1,50 @@
+# advice.py
+# Personalized notes for the user's recorded medical conditions. A note depends only on which
+# known conditions the profile mentions and on the diagnosed disease, so every combination is
+# worked out once per knowledge base version and a diagnosis does a single table lookup.
+
+from itertools import combinations
+
+# (condition mentioned in medical_conditions, applies to disease atom (lowercase), note)
+CONDITION_RULES = (
+    ('diabetes', lambda disease: 'sugar' not in disease, "With diabetes, monitor blood sugar."),
+    ('hypertension', lambda disease: True, "With hypertension, track blood pressure."),
+    ('asthma', lambda disease: 'breath' in disease or 'wheezing' in disease, "With asthma, keep inhaler handy."),
+)
+KNOWN_CONDITIONS = tuple(condition for condition, _applies, _note in CONDITION_RULES)
+
+NO_NOTES = "\nNo specific personalized notes. Follow general advice."
+
+
+def normalize_conditions(medical_conditions):
+    """The known conditions a profile's free-text medical_conditions mentions, in rule order."""
+    if not medical_conditions or medical_conditions.lower() == 'none':
+        return ()
+    text = medical_conditions.lower()
+    return tuple(condition for condition in KNOWN_CONDITIONS if condition in text)
+
+
+def advice_text(conditions, disease):
+    disease = str(disease).lower()
+    notes = [note for condition, applies, note in CONDITION_RULES if condition in conditions and applies(disease)]
+    if notes:
+        return "\nPersonalized Notes:\n- " + "\n- ".join(notes)
+    return NO_NOTES
+
+
+class AdviceTable:
+    """Notes for every (normalized conditions, disease) pair of one knowledge base."""
+
+    def __init__(self, diseases):
+        condition_sets = [subset for size in range(len(KNOWN_CONDITIONS) + 1)
+                          for subset in combinations(KNOWN_CONDITIONS, size)]
+        self._table = {(conditions, disease): advice_text(conditions, disease)
+                       for conditions in condition_sets for disease in diseases}
+
+    def __len__(self):
+        return len(self._table)
+
+    def lookup(self, conditions, disease):
+        """conditions as returned by normalize_conditions(); diseases outside the table are worked out directly."""
+        text = self._table.get((conditions, disease))
+        return text if text is not None else advice_text(conditions, disease)
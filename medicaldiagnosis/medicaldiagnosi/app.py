@@ -1,26 +1,98 @@
 # app.py
 
+import io
 import os
 import sqlite3
-import hashlib
+import logging
+import time
 from datetime import datetime
-from pyswip import Prolog
-from fpdf import FPDF
-from fpdf.enums import XPos, YPos
-import matplotlib
-matplotlib.use('Agg') # Non-interactive backend for Matplotlib
-import matplotlib.pyplot as plt
-import matplotlib as mpl
-
-from flask import (Flask, render_template, request, redirect, url_for,
-                   session, flash, send_from_directory, make_response, g)
+from functools import wraps
+from prolog_engine import PrologEngine, KnowledgeBaseLoadError
+from kb_artifact import load_compiled_knowledge_base, fresh_qlf
+from kb_manager import KnowledgeBaseManager
+from diagnosis_cache import DiagnosisCache, SourceFingerprint, normalize_diagnosis_key
+from report_jobs import ReportJobQueue, ReportJobStore, DONE, FAILED
+from report_renderer import ReportRenderer
+from storage import ConnectionPool, migrate
+from history_export import encode_cursor, decode_cursor, iter_history, csv_lines, jsonl_lines
+from diagnosis_sessions import DiagnosisStateStore, new_state_id, load_secret_key
+from metrics import (REGISTRY, DB_QUERY_SECONDS, DIAGNOSIS_ENGINE_SECONDS, REPORT_STAGE_SECONDS,
+                     HTTP_REQUEST_SECONDS, ERRORS_TOTAL)
+from app_logging import configure_logging, get_logger, log_event
+from request_profiler import RequestProfiler
+from question_planner import QuestionPlanner
+from vocabulary import SYMPTOMS, RISK_FACTORS, Vocabulary, load_vocabulary
+from advice import AdviceTable, normalize_conditions
+from password_hashing import HASHERS, PBKDF2Hasher, ScryptHasher, PasswordHashers, KdfExecutor, KdfBusyError
+from diagnosis_api import ApiValidationError, parse_diagnosis_request, diagnosis_response, bearer_token, token_matches
+from diagnosis_stats import (ChartCache, get_diagnosis_counts, get_statistics_summary,
+                             summary_etag, purge_chart_files)
+
+from flask import (Flask, render_template, request, redirect, url_for, Response, stream_with_context,
+                   session, flash, send_from_directory, send_file, make_response, g, jsonify, has_app_context)
 
 # --- Flask App Initialization ---
+configure_logging()
+logger = get_logger('app')
 app = Flask(__name__)
-app.secret_key = os.urandom(24) # Important for session management
+# Session signing key: SECRET_KEY from the environment, else one generated once and kept in the
+# instance folder, so sessions stay valid across workers and restarts. With FLASK_ENV=production
+# the key is never generated: it must come from SECRET_KEY or an existing SECRET_KEY_FILE
+app.secret_key = os.environ.get('SECRET_KEY') or load_secret_key(
+    os.environ.get('SECRET_KEY_FILE', os.path.join(app.instance_path, 'secret_key')),
+    create=os.environ.get('FLASK_ENV') != 'production')
 app.config['REPORTS_FOLDER'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diagnosis_reports')
 app.config['PROLOG_FILE'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diagnosis.pl')
+# Built by `python kb_artifact.py`; ignored (and diagnosis.pl compiled instead) when missing or stale
+app.config['KB_ARTIFACT'] = os.environ.get('KB_ARTIFACT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diagnosis.kb'))
+# Seconds between checks of diagnosis.pl for edits; a changed file is validated and swapped in without a restart
+app.config['KB_CHECK_INTERVAL'] = float(os.environ.get('KB_CHECK_INTERVAL', 2.0))
+# Bearer token for /admin/kb (status and reload); the endpoints are disabled when unset
+app.config['KB_ADMIN_TOKEN'] = os.environ.get('KB_ADMIN_TOKEN')
+# Password hashing: 'pbkdf2_sha256' (PASSWORD_PBKDF2_ITERATIONS) or 'scrypt' (PASSWORD_SCRYPT_N); stored hashes
+# made with another algorithm or cost keep working and are replaced on the next login
+app.config['PASSWORD_HASHER'] = os.environ.get('PASSWORD_HASHER', 'pbkdf2_sha256')
+app.config['PASSWORD_PBKDF2_ITERATIONS'] = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600_000))
+app.config['PASSWORD_SCRYPT_N'] = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))
+# Password hashing runs on AUTH_KDF_THREADS threads; past AUTH_MAX_PENDING queued checks, or AUTH_PER_IP /
+# AUTH_PER_EMAIL concurrent checks for one client or account, logins get 429 instead of waiting
+app.config['AUTH_KDF_THREADS'] = int(os.environ.get('AUTH_KDF_THREADS', max(1, (os.cpu_count() or 2) // 2)))
+app.config['AUTH_MAX_PENDING'] = int(os.environ.get('AUTH_MAX_PENDING', 8))
+app.config['AUTH_PER_IP'] = int(os.environ.get('AUTH_PER_IP', 4))
+app.config['AUTH_PER_EMAIL'] = int(os.environ.get('AUTH_PER_EMAIL', 1))
 app.config['DATABASE_FILE'] = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diagnosis_history.db')
+app.config['DATABASE_MMAP_SIZE'] = int(os.environ.get('DATABASE_MMAP_SIZE', 256 * 1024 * 1024)) # bytes
+app.config['DATABASE_BUSY_TIMEOUT'] = float(os.environ.get('DATABASE_BUSY_TIMEOUT', 5.0)) # seconds
+app.config['HISTORY_PAGE_SIZE'] = int(os.environ.get('HISTORY_PAGE_SIZE', 25))
+app.config['DIAGNOSIS_STATE_TTL'] = int(os.environ.get('DIAGNOSIS_STATE_TTL', 3600)) # seconds since last update
+# 'planned': one page with only the questions that can reorder the top 3; 'adaptive': one question per page
+# until the leader is decided; 'all': every follow-up question of the top 3 (original behaviour)
+app.config['FOLLOW_UP_MODE'] = os.environ.get('FOLLOW_UP_MODE', 'planned')
+# Fraction of requests to run under cProfile (0 = off); profiles are written to PROFILE_DIR
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', os.path.join(app.instance_path, 'profiles'))
+app.config['PROFILE_ALLOW_HEADER'] = os.environ.get('PROFILE_ALLOW_HEADER', '0') in ('1', 'true', 'yes') # Honour X-Profile: 1
+# Comma-separated bearer tokens accepted by the JSON API (/api/v1/...); the API is disabled when unset
+app.config['API_TOKENS'] = [token.strip() for token in os.environ.get('API_TOKENS', '').split(',') if token.strip()]
+app.config['API_BATCH_LIMIT'] = int(os.environ.get('API_BATCH_LIMIT', 100)) # Requests per batch call
+# Bearer token required by /metrics when set; otherwise the endpoint is open (bind it to a private interface)
+app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN')
+# 'python' scores with the compiled in-process knowledge base; 'prolog' sends every lookup through pyswip
+app.config['DIAGNOSIS_ENGINE'] = os.environ.get('DIAGNOSIS_ENGINE', 'python')
+app.config['DIAGNOSIS_CACHE_SIZE'] = int(os.environ.get('DIAGNOSIS_CACHE_SIZE', 4096))
+app.config['DIAGNOSIS_CACHE_TTL'] = int(os.environ.get('DIAGNOSIS_CACHE_TTL', 600)) # seconds
+# Profile rows shared between requests of one process; a profile update drops this process's copy, other
+# workers may show the old row for up to USER_PROFILE_CACHE_TTL seconds (0 disables sharing)
+app.config['USER_PROFILE_CACHE_SIZE'] = int(os.environ.get('USER_PROFILE_CACHE_SIZE', 4096))
+app.config['USER_PROFILE_CACHE_TTL'] = int(os.environ.get('USER_PROFILE_CACHE_TTL', 30)) # seconds
+app.config['REPORT_WORKERS'] = int(os.environ.get('REPORT_WORKERS', 2))
+app.config['REPORT_MAX_ATTEMPTS'] = int(os.environ.get('REPORT_MAX_ATTEMPTS', 3))
+app.config['REPORT_STATUS_MAX_WAIT'] = float(os.environ.get('REPORT_STATUS_MAX_WAIT', 25)) # Longest /report/status long-poll, seconds
+# Seconds the results page asks /report/status to wait per poll; 0 polls every second (long-polls hold a
+# thread under WSGI, so asgi.py turns this on by default)
+app.config['REPORT_STATUS_POLL_WAIT'] = float(os.environ.get('REPORT_STATUS_POLL_WAIT', 0))
+# When off, saved reports are recorded in history without a PDF on disk and streamed straight to the browser
+app.config['REPORT_ARCHIVE'] = os.environ.get('REPORT_ARCHIVE', '1') not in ('0', 'false', 'no')
 
 # Ensure reports directory exists
 os.makedirs(app.config['REPORTS_FOLDER'], exist_ok=True)
@@ -47,77 +119,100 @@ all_risk_factors = [
 ]
 unique_risk_factors = sorted(list(set(all_risk_factors)))
 
-# Matplotlib Styling (can be set globally if needed for server-side generation)
-mpl.rcParams.update({'font.size': 10, 'axes.titlesize': 14, 'axes.labelsize': 12, 'xtick.labelsize': 10, 'ytick.labelsize': 10})
-plt.style.use('seaborn-v0_8-pastel')
-
 # Add this to app.py for current year in footer
 @app.context_processor
 def inject_now():
     return {'now': datetime.utcnow()}
 # --- Database Handling ---
+db_pool = ConnectionPool(app.config['DATABASE_FILE'], mmap_size=app.config['DATABASE_MMAP_SIZE'],
+                         busy_timeout=app.config['DATABASE_BUSY_TIMEOUT'])
+
 def get_db():
-    """Opens a new database connection if there is none yet for the current application context."""
+    """Returns the current thread's pooled database connection."""
     if 'db' not in g:
-        g.db = sqlite3.connect(app.config['DATABASE_FILE'])
-        g.db.row_factory = sqlite3.Row # Access columns by name
+        g.db = db_pool.connection()
     return g.db
 
 @app.teardown_appcontext
 def close_db(error):
-    """Closes the database again at the end of the request."""
-    db = g.pop('db', None)
-    if db is not None:
-        db.close()
+    """Releases the database connection at the end of the request; it stays open for the thread's next request."""
+    if g.pop('db', None) is not None:
+        db_pool.release()
+
+def timed_db(func):
+    """Records the call's duration in db_query_seconds{function=...}."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with DB_QUERY_SECONDS.time(function=func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
 
 def init_db():
-    """Initializes the database schema."""
+    """Brings the database schema up to date."""
     db = get_db()
-    cursor = db.cursor()
-    # User table schema
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                     name TEXT NOT NULL,
-                     email TEXT NOT NULL UNIQUE,
-                     password_hash TEXT NOT NULL,
-                     age INTEGER,
-                     weight INTEGER,
-                     medical_conditions TEXT)''')
-    # History table schema
-    cursor.execute('''CREATE TABLE IF NOT EXISTS history (
-                     id INTEGER PRIMARY KEY AUTOINCREMENT,
-                     user_id INTEGER,
-                     datetime TEXT,
-                     symptoms TEXT,
-                     diagnosis TEXT,
-                     confidence REAL,
-                     report_filename TEXT,
-                     FOREIGN KEY(user_id) REFERENCES users(id))''')
-    db.commit()
-    print("Database initialized or schema checked.")
+    migrate(db) # Includes the per-diagnosis counts kept up to date by triggers on history
+    log_event(logger, logging.INFO, 'db.ready', path=app.config['DATABASE_FILE'])
 
 # Run schema update check on startup (Flask specific way)
 with app.app_context():
     init_db()
-    # You can keep your more detailed update_schema logic here if complex migrations are needed,
-    # but for simplicity, init_db with CREATE IF NOT EXISTS is often enough for starting.
-
-# --- Password Hashing Functions (from your original code) ---
-def hash_password(password):
-    return hashlib.sha256(password.encode()).hexdigest()
 
-def verify_password(stored_hash, provided_password):
-    return stored_hash == hash_password(provided_password)
+# --- Diagnosis State ---
+# Symptoms, follow-up questions and results of the diagnosis in progress are kept server-side;
+# the session cookie only carries the opaque 'diagnosis_state_id'.
+diagnosis_states = DiagnosisStateStore(get_db, ttl_seconds=app.config['DIAGNOSIS_STATE_TTL'])
+
+def get_diagnosis_state():
+    """Returns the current user's diagnosis state dict (empty if none or expired), loaded once per request."""
+    if 'diagnosis_state' not in g:
+        g.diagnosis_state = diagnosis_states.load(session.get('diagnosis_state_id'), session.get('user_id')) or {}
+    return g.diagnosis_state
+
+def update_diagnosis_state(clear=(), **values):
+    """Sets and/or removes keys of the current diagnosis state and persists it."""
+    state = get_diagnosis_state()
+    state.update(values)
+    for key in clear:
+        state.pop(key, None)
+    if 'diagnosis_state_id' not in session:
+        session['diagnosis_state_id'] = new_state_id()
+    diagnosis_states.save(session['diagnosis_state_id'], session['user_id'], state)
+
+def start_diagnosis_state(**values):
+    """Replaces any previous diagnosis with a fresh state under a new id."""
+    diagnosis_states.delete(session.pop('diagnosis_state_id', None))
+    g.diagnosis_state = {}
+    update_diagnosis_state(**values)
+
+# --- Password Hashing ---
+if app.config['PASSWORD_HASHER'] not in HASHERS:
+    raise RuntimeError(f"PASSWORD_HASHER must be one of: {', '.join(HASHERS)}")
+password_hashers = PasswordHashers(PBKDF2Hasher(iterations=app.config['PASSWORD_PBKDF2_ITERATIONS'])
+                                   if app.config['PASSWORD_HASHER'] == 'pbkdf2_sha256'
+                                   else ScryptHasher(n=app.config['PASSWORD_SCRYPT_N']))
+kdf_executor = KdfExecutor(threads=app.config['AUTH_KDF_THREADS'], max_pending=app.config['AUTH_MAX_PENDING'],
+                           per_key={'ip': app.config['AUTH_PER_IP'], 'email': app.config['AUTH_PER_EMAIL']})
+
+def run_kdf(func, *args, email=None):
+    """Runs password hashing on the KDF executor, limited per client IP and per email; may raise KdfBusyError."""
+    return kdf_executor.run(func, *args, keys=(('ip', request.remote_addr), ('email', email)))
+
+def hash_password(password, email=None):
+    return run_kdf(password_hashers.hash, password, email=email)
+
+def verify_password(stored_hash, provided_password, email=None):
+    """(matches, replacement hash or None); a stored_hash of None still costs one full verification."""
+    return run_kdf(password_hashers.check, stored_hash, provided_password, email=email)
 
 # --- Database Functions (adapted for Flask, using get_db()) ---
-def add_user_db(name, email, password, age=None, weight=None, medical_conditions=None):
+@timed_db
+def add_user_db(name, email, hashed_pw, age=None, weight=None, medical_conditions=None):
     db = get_db()
     cursor = db.cursor()
     try:
         cursor.execute("SELECT id FROM users WHERE email=?", (email,))
         if cursor.fetchone():
             return None # Email already registered
-        hashed_pw = hash_password(password)
         cursor.execute("INSERT INTO users (name, email, password_hash, age, weight, medical_conditions) VALUES (?, ?, ?, ?, ?, ?)",
                        (name, email, hashed_pw, age, weight, medical_conditions))
         db.commit()
@@ -129,6 +224,7 @@ def add_user_db(name, email, password, age=None, weight=None, medical_conditions
         db.rollback()
         return None
 
+@timed_db
 def update_user_details_db(user_id, age, weight, medical_conditions):
     db = get_db()
     cursor = db.cursor()
@@ -137,218 +233,465 @@ def update_user_details_db(user_id, age, weight, medical_conditions):
         cursor.execute("UPDATE users SET age = ?, weight = ?, medical_conditions = ? WHERE id = ?",
                        (age, weight, conditions_to_store, user_id))
         db.commit()
+        forget_user_profile(user_id)
         return True
     except Exception:
         db.rollback()
         return False
 
-def authenticate_user_db(email, password):
+@timed_db
+def get_password_hash_db(email):
     db = get_db()
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT id, password_hash FROM users WHERE email=?", (email,))
-        result = cursor.fetchone()
-        if result:
-            user_id, stored_hash = result['id'], result['password_hash']
-            if verify_password(stored_hash, password):
-                return user_id
-        return None # Incorrect email or password
+        # The profile columns come along so a successful login needs no second read
+        cursor.execute(f"SELECT {', '.join(PROFILE_COLUMNS)}, password_hash FROM users WHERE email=?", (email,))
+        return cursor.fetchone()
     except Exception:
         return None
 
+@timed_db
+def update_password_hash_db(user_id, old_hash, new_hash):
+    db = get_db()
+    try:
+        # Only replaces the hash that was verified, in case the password changed meanwhile
+        db.execute("UPDATE users SET password_hash = ? WHERE id = ? AND password_hash = ?", (new_hash, user_id, old_hash))
+        db.commit()
+        return True
+    except Exception:
+        db.rollback()
+        return False
+
+def authenticate_user(email, password):
+    """Returns the user id for a correct email and password, else None; may raise KdfBusyError.
+
+    Hashes from a legacy algorithm or an outdated cost are upgraded after a successful check.
+    """
+    result = get_password_hash_db(email)
+    stored_hash = result['password_hash'] if result else None
+    try:
+        matches, new_hash = verify_password(stored_hash, password, email=email)
+    except ValueError as e: # Unreadable stored hash
+        log_event(logger, logging.ERROR, 'auth.bad_hash', user_id=result['id'] if result else None, error=str(e))
+        return None
+    if not matches:
+        return None # Incorrect email or password
+    if new_hash and update_password_hash_db(result['id'], stored_hash, new_hash):
+        log_event(logger, logging.INFO, 'auth.rehashed', user_id=result['id'], algorithm=password_hashers.preferred.algorithm)
+    remember_user_profile(profile_from_row(result))
+    return result['id']
+
+@timed_db
 def get_user_details_db(user_id):
     db = get_db()
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT id, name, email, age, weight, medical_conditions FROM users WHERE id=?", (user_id,))
+        cursor.execute(f"SELECT {', '.join(PROFILE_COLUMNS)} FROM users WHERE id=?", (user_id,))
         return cursor.fetchone() # Returns a Row object or None
     except Exception:
         return None
 
-def add_diagnosis_db(user_id, symptoms, diagnosis, confidence, report_filename):
+# --- User Profiles ---
+# A profile is read from the database at most once per request (g.user_profiles) and shared
+# between this process's requests for USER_PROFILE_CACHE_TTL seconds.
+PROFILE_COLUMNS = ('id', 'name', 'email', 'age', 'weight', 'medical_conditions')
+
+user_profile_cache = DiagnosisCache(max_entries=app.config['USER_PROFILE_CACHE_SIZE'],
+                                    ttl_seconds=app.config['USER_PROFILE_CACHE_TTL'])
+
+def profile_from_row(row):
+    """A read-only profile dict; known_conditions is the normalized key for the advice table."""
+    profile = {column: row[column] for column in PROFILE_COLUMNS}
+    profile['known_conditions'] = normalize_conditions(profile['medical_conditions'])
+    return profile
+
+def remember_user_profile(profile):
+    g.setdefault('user_profiles', {})[profile['id']] = profile
+    user_profile_cache.set(profile['id'], profile)
+
+def forget_user_profile(user_id):
+    user_profile_cache.discard(user_id)
+    g.get('user_profiles', {}).pop(user_id, None)
+
+def get_user_profile(user_id):
+    """The user's profile dict (None if there is no such user), reading the database only on a cache miss."""
+    profiles = g.setdefault('user_profiles', {})
+    if user_id not in profiles:
+        found, profile = user_profile_cache.get(user_id)
+        if not found:
+            row = get_user_details_db(user_id)
+            profile = profile_from_row(row) if row else None
+            if profile:
+                user_profile_cache.set(user_id, profile)
+        profiles[user_id] = profile
+    return profiles[user_id]
+
+@timed_db
+def add_diagnosis_db(user_id, symptoms_mask, diagnosis, confidence, report_filename, kb_version=None):
     db = get_db()
     cursor = db.cursor()
     try:
         current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        cursor.execute("INSERT INTO history (user_id, datetime, symptoms, diagnosis, confidence, report_filename) VALUES (?, ?, ?, ?, ?, ?)",
-                       (user_id, current_time, symptoms, diagnosis, confidence, report_filename))
+        cursor.execute("INSERT INTO history (user_id, datetime, symptoms_mask, diagnosis, confidence, report_filename, kb_version) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                       (user_id, current_time, active_kb().symptom_vocabulary.to_bytes(symptoms_mask), diagnosis, confidence,
+                        report_filename, kb_version))
         db.commit()
         return True
     except Exception:
         db.rollback()
         return False
 
-def get_user_history_db(user_id):
+HISTORY_COLUMNS = "id, datetime, symptoms, symptoms_mask, diagnosis, confidence, report_filename, kb_version"
+
+def history_symptom_labels(row):
+    """Symptoms of a history row: decoded from symptoms_mask, or split from the comma-joined text of older rows."""
+    if row['symptoms_mask'] is not None:
+        return active_kb().symptom_vocabulary.labels_of(Vocabulary.from_bytes(row['symptoms_mask']))
+    return [s for s in (row['symptoms'] or '').split(',') if s]
+
+def history_record(row):
+    """A history row as a dict with 'symptoms' as the comma-joined labels, whichever way the row stores them."""
+    record = dict(row)
+    record['symptoms'] = ','.join(history_symptom_labels(row))
+    record.pop('symptoms_mask', None)
+    return record
+
+@timed_db
+def get_user_history_page_db(user_id, before=None, after=None, limit=25, raise_errors=False):
+    """One page of a user's history, newest first, keyed on (datetime, id).
+
+    `before` returns the rows older than that position, `after` the rows newer than it.
+    A failed query gives an empty page, or is re-raised with raise_errors (exports must not
+    end as if complete).
+    """
     db = get_db()
     cursor = db.cursor()
     try:
-        cursor.execute("SELECT id, datetime, symptoms, diagnosis, confidence, report_filename FROM history WHERE user_id = ? ORDER BY datetime DESC", (user_id,))
-        return cursor.fetchall() # Returns a list of Row objects
-    except Exception:
+        if after is not None:
+            # Walk forward from the cursor, then flip back to newest-first order
+            cursor.execute(f"""SELECT {HISTORY_COLUMNS} FROM history
+                              WHERE user_id = ? AND (datetime, id) > (?, ?)
+                              ORDER BY datetime ASC, id ASC LIMIT ?""", (user_id, after[0], after[1], limit))
+            return cursor.fetchall()[::-1]
+        if before is not None:
+            cursor.execute(f"""SELECT {HISTORY_COLUMNS} FROM history
+                              WHERE user_id = ? AND (datetime, id) < (?, ?)
+                              ORDER BY datetime DESC, id DESC LIMIT ?""", (user_id, before[0], before[1], limit))
+        else:
+            cursor.execute(f"""SELECT {HISTORY_COLUMNS} FROM history WHERE user_id = ?
+                              ORDER BY datetime DESC, id DESC LIMIT ?""", (user_id, limit))
+        return cursor.fetchall()
+    except Exception as e:
+        log_event(logger, logging.ERROR, 'db.history_page_failed', user_id=user_id, error=str(e))
+        if raise_errors:
+            raise
         return []
 
-# --- PDF Generation (largely the same, but use app.config and no messagebox) ---
-# --- PDF Generation (largely the same, but use app.config and no messagebox) ---
-# --- PDF Generation (compatible with original PyFPDF API) ---
-def generate_pdf_report(filename_base, user_details_row, diagnosis_info):
-    pdf = FPDF(); pdf.add_page(); pdf.set_font("Helvetica", size=12)
-
-    # Title
-    pdf.set_font("Helvetica", 'B', 16)
-    # ln=1 moves to the beginning of the next line after this cell
-    pdf.cell(0, 10, txt="Medical Diagnosis Report", align='C', ln=1)
-    pdf.ln(5)  # Additional spacing
-
-    # Report Generated Time
-    pdf.set_font("Helvetica", size=10)
-    report_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    pdf.cell(0, 10, txt=f"Report Generated: {report_time}", align='R', ln=1)
-    pdf.ln(5)  # Additional spacing
-
-    # Patient Information Section Title
-    pdf.set_font("Helvetica", 'B', 12)
-    pdf.cell(0, 10, txt="Patient Information", ln=1)
-    pdf.set_font("Helvetica", size=12)
-
-    if user_details_row:
-        name = user_details_row['name']
-        age = user_details_row['age']
-        weight = user_details_row['weight']
-        conditions = user_details_row['medical_conditions']
-
-        pdf.cell(0, 8, txt=f"Name: {name}", ln=1)
-        pdf.cell(0, 8, txt=f"Age: {age or 'N/A'}", ln=1)
-        pdf.cell(0, 8, txt=f"Weight: {f'{weight} kg' if weight else 'N/A'}", ln=1)
-
-        conditions_display = 'None'
-        if conditions and conditions.strip().lower() == 'normal':
-            conditions_display = 'Normal (No pre-existing)'
-        elif conditions and conditions.strip().lower() != 'none': # Ensure this logic is as intended
-            conditions_display = conditions.strip()
-        # PyFPDF multi_cell: ln=1 is default, moves to next line, left margin.
-        # Removed new_x, new_y from multi_cell as they are fpdf2 specific.
-        # align='L' (left) is a common explicit choice if 'J' (justify) isn't desired. PyFPDF defaults to 'J'.
-        pdf.multi_cell(0, 8, txt=f"Reported Conditions: {conditions_display}", border=0, align='L')
-    else:
-        pdf.cell(0, 8, txt="User details not found.", ln=1)
-
-    pdf.ln(5) # This provides spacing *after* the patient details block or "not found" message.
-
-    pdf.set_font("Helvetica", 'B', 12)
-    pdf.cell(0, 10, txt="Reported Symptoms", ln=1)
-    pdf.set_font("Helvetica", size=12)
-    symptoms_list = diagnosis_info.get('symptoms', [])
-    symptoms_str = ", ".join(s.replace("_", " ").title() for s in symptoms_list) if isinstance(symptoms_list, list) else "Symptoms data invalid."
-    pdf.multi_cell(0, 8, txt=symptoms_str, align='L') # Using align='L' for consistency
-    pdf.ln(5)
-
-    pdf.set_font("Helvetica", 'B', 12)
-    pdf.cell(0, 10, txt="Diagnosis Outcome", ln=1)
-    pdf.set_font("Helvetica", size=12)
-    disease = str(diagnosis_info.get('disease', 'N/A')).replace('_', ' ').title()
-    confidence = diagnosis_info.get('confidence', 0.0)
-    test_rec = str(diagnosis_info.get('test', 'N/A')).replace('_', ' ').title()
-
-    pdf.cell(0, 8, txt=f"Possible Diagnosis: {disease}", ln=1)
-    pdf.cell(0, 8, txt=f"Confidence: {float(confidence):.2f}%", ln=1)
-    pdf.cell(0, 8, txt=f"Recommended Test: {test_rec}", ln=1)
-    pdf.ln(5)
-
-    pdf.set_font("Helvetica", 'B', 12)
-    pdf.cell(0, 10, txt="Suggested Treatment", ln=1)
-    pdf.set_font("Helvetica", size=12)
-    treatment_list = diagnosis_info.get('treatment', [])
-    treatment_items = [str(item).replace('_', ' ').title() for item in treatment_list] if isinstance(treatment_list, list) else []
-    treatment_str = "- " + "\n- ".join(treatment_items) if treatment_items else "N/A"
-    pdf.multi_cell(0, 8, txt=treatment_str, align='L')
-    pdf.ln(5)
-
-    pdf.set_font("Helvetica", 'B', 12)
-    pdf.cell(0, 10, txt="General Advice", ln=1)
-    pdf.set_font("Helvetica", size=12)
-    advice_txt_val = diagnosis_info.get('advice', 'Follow general medical advice.') # Renamed variable to avoid potential confusion
-    pdf.multi_cell(0, 8, txt=str(advice_txt_val), align='L')
-    pdf.ln(5)
-
-    pdf.set_font("Helvetica", 'B', 12)
-    pdf.cell(0, 10, txt="Personalized Advice", ln=1)
-    pdf.set_font("Helvetica", size=12)
-    personalized = diagnosis_info.get('personalized_advice', '').strip()
-    pdf.multi_cell(0, 8, txt=str(personalized), align='L')
-    pdf.ln(10)
-
-    pdf.set_font("Helvetica", 'I', 10)
-    disclaimer_text = ("Disclaimer: This system provides potential diagnoses based on symptoms and is not a substitute for professional medical advice. Always consult a qualified healthcare provider for any health concerns.")
-    pdf.multi_cell(0, 8, txt=disclaimer_text, align='L')
+# --- PDF Generation ---
+# Static layout (title, section titles, disclaimer) and per-disease text wrapping are prepared once per process
+report_renderer = ReportRenderer()
 
+def render_report(user_details_row, diagnosis_info):
+    """Returns the report PDF as bytes."""
+    with REPORT_STAGE_SECONDS.time(stage='render'):
+        return report_renderer.render(user_details_row, diagnosis_info)
+
+def generate_pdf_report(filename_base, user_details_row, diagnosis_info):
+    """Renders the report and archives it under REPORTS_FOLDER. Returns the file path, or None on failure."""
     safe_base_filename = "".join(c if c.isalnum() or c in ('_', '-') else '_' for c in os.path.basename(filename_base))
     full_path = os.path.join(app.config['REPORTS_FOLDER'], safe_base_filename)
     try:
-        pdf.output(name=full_path) # For PyFPDF, 'name' is correct. For fpdf2, it also accepts 'dest'.
+        pdf_bytes = render_report(user_details_row, diagnosis_info)
+        with REPORT_STAGE_SECONDS.time(stage='write'):
+            with open(full_path, 'wb') as f:
+                f.write(pdf_bytes)
         return full_path
     except Exception as e:
-        print(f"PDF Error: {e}") # Log error
+        ERRORS_TOTAL.inc(component='pdf')
+        log_event(logger, logging.ERROR, 'report.pdf_failed', filename=safe_base_filename, error=str(e))
         return None
-# --- Personalized Advice (can be used as is, ensure user_id is passed) ---
+
+# --- Background Report Jobs ---
+# Jobs run in the process that queued them; their state is kept in report_jobs so any worker can answer for them
+report_queue = ReportJobQueue(worker_count=app.config['REPORT_WORKERS'], max_attempts=app.config['REPORT_MAX_ATTEMPTS'],
+                              store=ReportJobStore(db_pool.connection))
+
+def run_report_job(user_id, base_pdf_filename, user_details, diagnosis_data_for_pdf):
+    """Worker-side body of a report job: writes the PDF, then records it in history. Returns the PDF path."""
+    with app.app_context():
+        pdf_filepath = generate_pdf_report(base_pdf_filename, user_details, diagnosis_data_for_pdf)
+        if not pdf_filepath:
+            return None
+        if not add_diagnosis_db(user_id, diagnosis_data_for_pdf['symptoms_mask'], diagnosis_data_for_pdf['disease'], diagnosis_data_for_pdf['confidence'], pdf_filepath,
+                                diagnosis_data_for_pdf.get('kb_version')):
+            raise RuntimeError("Report PDF saved, but failed to update history.")
+        return pdf_filepath
+
+# --- Personalized Advice ---
 def personalized_advice(user_id, diagnosis_atom_str):
-    user_details = get_user_details_db(user_id)
-    advice_list = []
-    if user_details and user_details['medical_conditions'] and user_details['medical_conditions'].lower() != 'none':
-        conditions = user_details['medical_conditions'].lower()
-        diag_lower = str(diagnosis_atom_str).lower()
-        if 'diabetes' in conditions and 'sugar' not in diag_lower: advice_list.append("With diabetes, monitor blood sugar.")
-        if 'hypertension' in conditions: advice_list.append("With hypertension, track blood pressure.")
-        if 'asthma' in conditions and ('breath' in diag_lower or 'wheezing' in diag_lower): advice_list.append("With asthma, keep inhaler handy.")
-    if advice_list: return "\nPersonalized Notes:\n- " + "\n- ".join(advice_list)
-    else: return "\nNo specific personalized notes. Follow general advice."
+    # Looked up in the knowledge base version's precomputed table (see advice.py)
+    user_details = get_user_profile(user_id)
+    return active_kb().advice_table.lookup(user_details['known_conditions'] if user_details else (), str(diagnosis_atom_str))
 
 
 # --- Helper for Prolog Interaction ---
-# --- Helper for Prolog Interaction ---
-# --- Helper for Prolog Interaction ---
+# One engine per worker process. It consults the source of the knowledge base version kb_manager has
+# published (validated, see below) and re-consults only when another version is published, so the
+# kb_version reported with each result is the one whose rules produced it. diagnosis.qlf is consulted
+# instead of the source while kb_artifact.py's recorded hashes match that version
+prolog_engine = PrologEngine(app.config['PROLOG_FILE'],
+                             compiled_file=lambda digest: fresh_qlf(app.config['PROLOG_FILE'], app.config['KB_ARTIFACT'], digest),
+                             published=lambda: active_kb())
+
 def query_prolog(query_string):
-    prolog = Prolog() # A new instance for each query is generally safer for web apps
-    prolog_file_path = app.config['PROLOG_FILE']
+    prolog_file_path = active_kb().source_path # What the engine consults (a snapshot with the Prolog engine)
 
     if not os.path.exists(prolog_file_path):
         flash("Critical Error: Prolog knowledge base file not found.", "danger")
-        print(f"CRITICAL ERROR: Prolog file not found at '{prolog_file_path}'")
+        ERRORS_TOTAL.inc(component='prolog')
+        log_event(logger, logging.CRITICAL, 'prolog.kb_missing', path=prolog_file_path)
         return None
 
-    # Convert path to use forward slashes, suitable for Prolog strings
-    prolog_consult_path = prolog_file_path.replace("\\", "/")
-    # Escape single quotes in the path for the Prolog string, just in case (though unlikely for paths)
-    prolog_consult_path_for_goal = prolog_consult_path.replace("'", "''")
+    try:
+        log_event(logger, logging.DEBUG, 'prolog.query', goal=query_string)
+        return prolog_engine.query(query_string)
+    except KnowledgeBaseLoadError as e:
+        ERRORS_TOTAL.inc(component='prolog')
+        log_event(logger, logging.ERROR, 'prolog.consult_failed', goal=query_string, error=str(e))
+        flash("Critical error: Could not load the Prolog knowledge base. Please check server logs.", "danger")
+        return None
+    except Exception as e:
+        # Error was in the main query after a successful consult
+        ERRORS_TOTAL.inc(component='prolog')
+        log_event(logger, logging.ERROR, 'prolog.query_failed', goal=query_string, error=str(e))
+        flash("Error processing your request with the knowledge base. Please check server logs.", "danger")
+        return None
 
-    consult_goal = f"consult('{prolog_consult_path_for_goal}')"
-    consult_successful = False
+# --- Knowledge Base Lookups (compiled Python engine or Prolog) ---
+# Facts are compiled at startup (or loaded from the KB_ARTIFACT build) and recompiled when diagnosis.pl
+# changes; the Python engine produces the same scores as symptom_match/5.
+# Results are keyed on the normalized request and dropped whenever diagnosis.pl's content hash changes
+diagnosis_cache = DiagnosisCache(max_entries=app.config['DIAGNOSIS_CACHE_SIZE'],
+                                 ttl_seconds=app.config['DIAGNOSIS_CACHE_TTL'],
+                                 fingerprint=SourceFingerprint(app.config['PROLOG_FILE']))
+
+def prepare_kb_version(kb):
+    """Per-version state built off the request path before a knowledge base is published.
+
+    Selections travel as bitsets over the symptom and risk factor vocabularies (state, cache keys,
+    history, engine); the bits are kept in the database and only appended, so bitsets from
+    any version decode the same in every worker.
+    """
+    with app.app_context():
+        symptom_vocabulary = load_vocabulary(get_db(), SYMPTOMS, kb.symptom_index, all_symptoms_for_vars)
+        risk_vocabulary = load_vocabulary(get_db(), RISK_FACTORS, kb.risk_index, unique_risk_factors)
+    kb.index_vocabulary(symptom_vocabulary.atoms, risk_vocabulary.atoms)
+    return {
+        'symptom_vocabulary': symptom_vocabulary,
+        'risk_vocabulary': risk_vocabulary,
+        # Plans always use the compiled knowledge base; check_parity.py keeps its rankings identical to Prolog's
+        'question_planner': QuestionPlanner(kb, top_k=3),
+        'advice_table': AdviceTable(kb.diseases),
+        # JSON API inputs: form terms as the label ('body ache') or the knowledge base atom (body_ache)
+        'api_vocabulary': (symptom_vocabulary.offered_terms, risk_vocabulary.offered_terms,
+                           frozenset(q for questions in kb.follow_up_questions.values() for q in questions)),
+    }
 
-    try:
-        print(f"Attempting Prolog consult with goal: {consult_goal}")
-        # Execute the consult as a query. list() consumes the generator.
-        # If consult fails, it should raise an exception caught below.
-        list(prolog.query(consult_goal))
-        consult_successful = True # If no exception, assume consult worked
+kb_manager = KnowledgeBaseManager(app.config['PROLOG_FILE'],
+                                  load=lambda path: load_compiled_knowledge_base(path, app.config['KB_ARTIFACT']),
+                                  prepare=prepare_kb_version, check_interval=app.config['KB_CHECK_INTERVAL'],
+                                  # The Prolog engine consults published versions from these copies
+                                  snapshot_dir=(os.path.join(app.instance_path, 'kb_versions')
+                                                if app.config['DIAGNOSIS_ENGINE'] == 'prolog' else None))
+kb_manager.load_initial()
+
+def active_kb():
+    """The knowledge base version serving this request. It is pinned on first use, so a reload
+    in the middle of a request never mixes two versions."""
+    if not has_app_context():
+        return kb_manager.current
+    if 'kb_version' not in g:
+        g.kb_version = kb_manager.current
+    return g.kb_version
+
+def decode_prolog_value(value):
+    # Pyswip can return byte strings, decode them
+    return value.decode('utf-8') if isinstance(value, bytes) else str(value)
+
+def prolog_atom_list(atoms):
+    return "[" + ",".join("'{}'".format(str(atom).replace("'", "''")) for atom in atoms) + "]"
+
+def format_prolog_request(symptom_mask, risk_mask, answers):
+    """Formats the request as Prolog list literals: (symptoms, risk factors, answers)."""
+    kbv = active_kb()
+    symptoms_prolog_list_str = prolog_atom_list(kbv.symptom_vocabulary.atoms_of(symptom_mask))
+    risk_factors_prolog_list_str = prolog_atom_list(kbv.risk_vocabulary.atoms_of(risk_mask))
+    formatted_answers_prolog = ["('{}',{})".format(q.replace("'", "''"), a) for q, a in answers]
+    answers_prolog_list_str = "[" + ",".join(formatted_answers_prolog) + "]"
+    return symptoms_prolog_list_str, risk_factors_prolog_list_str, answers_prolog_list_str
+
+def selection_masks(state):
+    """(symptom bitset, risk factor bitset) of a diagnosis state; states saved before bitsets hold label lists."""
+    if 'symptoms_mask' in state:
+        return state['symptoms_mask'], state.get('risk_factors_mask', 0)
+    kbv = active_kb()
+    return (kbv.symptom_vocabulary.encode(state.get('current_symptoms', [])),
+            kbv.risk_vocabulary.encode(state.get('current_risk_factors', [])))
+
+def diagnosis_bundle(symptom_mask, risk_mask, answers, follow_up_k=3, base_scores=None):
+    """Everything one diagnosis step needs, in a single knowledge base call.
+
+    Returns {'ranked', 'follow_up_questions', 'test', 'treatment', 'advice'} (ranked best first,
+    follow-ups for the top follow_up_k diseases, details for the leader), or None on a knowledge base error.
+    The Python engine also returns 'base_scores'; passing them back (see restore_base_scores) skips
+    re-matching the symptoms so only the answers are applied.
+    """
+    key = normalize_diagnosis_key(symptom_mask, risk_mask, answers)
+    # The version is part of the key: while a reload is pending both versions may be serving
+    return diagnosis_cache.get_or_compute(('bundle', active_kb().version, follow_up_k) + key,
+                                          lambda: _diagnosis_bundle_uncached(*key, follow_up_k, base_scores))
+
+def _diagnosis_bundle_uncached(symptom_mask, risk_mask, answers, follow_up_k, base_scores=None):
+    engine = app.config['DIAGNOSIS_ENGINE']
+    label = 'python_incremental' if engine == 'python' and base_scores is not None else engine
+    with DIAGNOSIS_ENGINE_SECONDS.time(engine=label):
+        return _score_bundle(engine, symptom_mask, risk_mask, answers, follow_up_k, base_scores)
+
+def _score_bundle(engine, symptom_mask, risk_mask, answers, follow_up_k, base_scores=None):
+    if engine == 'python':
+        kb = active_kb().kb
+        if base_scores is None:
+            base_scores = kb.mask_base_scores(symptom_mask, risk_mask)
+        bundle = kb.diagnosis_bundle((), (), answers, follow_up_k, base_scores=base_scores)
+        bundle['base_scores'] = base_scores
+        return bundle
+
+    symptoms_str, risk_factors_str, answers_str = format_prolog_request(symptom_mask, risk_mask, answers)
+    query_results = query_prolog(f"diagnosis_bundle({symptoms_str}, {risk_factors_str}, {answers_str}, {int(follow_up_k)}, "
+                                 f"Ranked, Questions, Test, Treatment, Advice).")
+    if not query_results:
+        return None
+    result = query_results[0]
+    treatment = result['Treatment'] if isinstance(result['Treatment'], list) else [result['Treatment']]
+    return {
+        'ranked': [(decode_prolog_value(d), float(c)) for d, c in result['Ranked']],
+        'follow_up_questions': [decode_prolog_value(q) for q in result['Questions']],
+        'test': decode_prolog_value(result['Test']),
+        'treatment': [decode_prolog_value(item) for item in treatment],
+        'advice': decode_prolog_value(result['Advice']),
+    }
 
-        # Now execute the actual query
-        print(f"Consult appeared successful. Executing query: {query_string}")
-        results = list(prolog.query(query_string))
-        return results
+def saved_base_scores(bundle):
+    """First-pass base scores in a JSON-safe form for the diagnosis state (None with the Prolog engine)."""
+    if not bundle or bundle.get('base_scores') is None:
+        return None
+    scores = sorted([index, score] for index, score in bundle['base_scores'].items())
+    return {'kb': active_kb().kb.source_digest, 'scores': scores}
 
-    except Exception as e:
-        # This will catch exceptions from both consult and the subsequent query
-        error_message = f"Prolog error. Consult goal: '{consult_goal}'. Query: '{query_string}'. Exception: {e}"
-        print(error_message)
-        if not consult_successful:
-            flash("Critical error: Could not load the Prolog knowledge base. Please check server logs.", "danger")
-        else: # Error was in the main query after a successful consult
-            flash("Error processing your request with the knowledge base. Please check server logs.", "danger")
+def restore_base_scores(state):
+    """Base scores saved by the first pass, or None if missing or computed against another diagnosis.pl."""
+    saved = state.get('base_scores')
+    if not saved or saved.get('kb') != active_kb().kb.source_digest or app.config['DIAGNOSIS_ENGINE'] != 'python':
+        return None
+    return {int(index): score for index, score in saved['scores']}
+
+# --- Follow-up Question Planning ---
+FOLLOW_UP_QUESTIONS = REGISTRY.counter('follow_up_questions_total', "Follow-up questions asked or dropped by the planner.", ('mode', 'outcome'))
+
+def select_follow_up_questions(symptom_mask, risk_mask, answers=(), asked=(), bundle=None, base_scores=None):
+    """Questions for the next follow-up page (empty when there is nothing worth asking)."""
+    mode = app.config['FOLLOW_UP_MODE']
+    if mode == 'all':
+        questions = list(bundle['follow_up_questions']) if bundle and not asked else []
+    else:
+        ranked = bundle['ranked'] if bundle and not answers else None # Reuse the first-pass ranking
+        if base_scores is None:
+            base_scores = (bundle or {}).get('base_scores') or active_kb().kb.mask_base_scores(symptom_mask, risk_mask)
+        plan = active_kb().question_planner.plan((), (), answers, asked, ranked=ranked, base_scores=base_scores)
+        if mode == 'adaptive':
+            next_question = plan.next_question()
+            questions = [next_question] if next_question else []
+        else:
+            questions = plan.questions
+            FOLLOW_UP_QUESTIONS.inc(len(plan.dropped), mode=mode, outcome='dropped')
+    FOLLOW_UP_QUESTIONS.inc(len(questions), mode=mode, outcome='asked')
+    return questions
+
+def first_diagnosis_pass(symptom_mask, risk_mask, base_scores=None):
+    """Initial scoring without answers plus the follow-up questions worth asking: (bundle, questions)."""
+    bundle = diagnosis_bundle(symptom_mask, risk_mask, [], base_scores=base_scores)
+    if not bundle or not bundle['ranked']:
+        return bundle, []
+    return bundle, select_follow_up_questions(symptom_mask, risk_mask, bundle=bundle)
+
+def next_follow_up_questions(symptom_mask, risk_mask, answers, asked, base_scores=None):
+    """Questions still worth asking after a round of answers; only adaptive mode asks more than one round."""
+    if app.config['FOLLOW_UP_MODE'] != 'adaptive':
+        return []
+    return select_follow_up_questions(symptom_mask, risk_mask, answers, asked, base_scores=base_scores)
+
+def build_top_match_details(bundle, user_id, symptom_mask):
+    """Builds the results-page/report details for the leading disease of a bundle (None if nothing ranked)."""
+    if not bundle['ranked']:
         return None
+    top_disease_atom, top_confidence_float = bundle['ranked'][0]
+    test_raw = bundle['test']
+    treatment_raw = list(bundle['treatment'])
+    advice_raw = bundle['advice']
+    personalized_raw = personalized_advice(user_id, top_disease_atom)
+    return {
+        'disease_display': top_disease_atom.replace('_',' ').title(),
+        'test': test_raw.replace('_',' ').title(),
+        'treatment_str': "- " + "\n- ".join([str(item).replace('_', ' ').title() for item in treatment_raw]),
+        'advice': advice_raw,
+        'personalized': personalized_raw,
+        'kb_version': active_kb().version, # The knowledge base version that produced this result
+        'raw_symptoms': active_kb().symptom_vocabulary.labels_of(symptom_mask),
+        'raw_symptoms_mask': symptom_mask,
+        'raw_disease': top_disease_atom,
+        'raw_confidence': float(top_confidence_float),
+        'raw_test': test_raw,
+        'raw_treatment': treatment_raw,
+        'raw_advice': advice_raw,
+        'raw_personalized': personalized_raw
+    }
+
+# --- Request Metrics & Profiling ---
+request_profiler = RequestProfiler(sample_rate=app.config['PROFILE_SAMPLE_RATE'], output_dir=app.config['PROFILE_DIR'],
+                                   allow_header=app.config['PROFILE_ALLOW_HEADER'])
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+    kb_manager.check_for_changes() # Reloads run in the background; this request keeps the current version
+    if request_profiler.enabled and request_profiler.should_profile(request.headers):
+        g.request_profile = request_profiler.start()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unmatched',
+                                     method=request.method, status=response.status_code)
+    profile = g.pop('request_profile', None)
+    if profile is not None:
+        path, summary = request_profiler.finish(profile, f"{request.method}_{request.endpoint}")
+        log_event(logger, logging.INFO, 'profile.captured', endpoint=request.endpoint, path=path, top=summary)
+    return response
+
+# Scrape-time gauges from the components that already keep their own counters
+REGISTRY.gauge_callback('diagnosis_cache', "Diagnosis result cache counters.",
+                        lambda: {k: v for k, v in diagnosis_cache.stats().items() if isinstance(v, (int, float))}, 'stat')
+REGISTRY.gauge_callback('user_profile_cache', "User profile cache counters.",
+                        lambda: {k: v for k, v in user_profile_cache.stats().items() if isinstance(v, (int, float))}, 'stat')
+REGISTRY.gauge_callback('report_queue', "Report job queue depth, counters and durations.",
+                        lambda: {k: v for k, v in report_queue.stats().items() if isinstance(v, (int, float))}, 'stat')
+REGISTRY.gauge_callback('db_connections_opened', "SQLite connections opened by this process.", lambda: db_pool.connections_opened)
+REGISTRY.gauge_callback('prolog_consults', "Times diagnosis.pl was consulted by this process.", lambda: prolog_engine.consult_count)
 
 # --- Flask Routes ---
 
 # Decorator for routes that require login
-from functools import wraps
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -358,6 +701,18 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+# Decorator for JSON API routes; integrations authenticate with a bearer token instead of a session
+def api_token_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        tokens = app.config['API_TOKENS']
+        if not tokens:
+            return jsonify({'error': "The diagnosis API is disabled on this server."}), 503
+        if not token_matches(bearer_token(request.headers.get('Authorization')), tokens):
+            return jsonify({'error': "Missing or invalid API token."}), 401, {'WWW-Authenticate': 'Bearer'}
+        return f(*args, **kwargs)
+    return decorated_function
+
 @app.route('/')
 def index():
     if 'user_id' in session:
@@ -390,7 +745,11 @@ def register():
             flash("Invalid email format.", "danger")
             return render_template('register.html', name=name, email=email)
 
-        user_id = add_user_db(name, email, password)
+        try:
+            user_id = add_user_db(name, email, hash_password(password, email=email))
+        except KdfBusyError:
+            flash("The server is busy, please try again in a moment.", "warning")
+            return render_template('register.html', name=name, email=email), 429, {'Retry-After': '1'}
         if user_id:
             flash(f"User '{name}' registered successfully! Please login.", "success")
             return redirect(url_for('login'))
@@ -411,10 +770,14 @@ def login():
             flash("Email and Password are required.", "danger")
             return render_template('login.html', email=email)
 
-        user_id = authenticate_user_db(email, password)
+        try:
+            user_id = authenticate_user(email, password)
+        except KdfBusyError:
+            flash("Too many sign-in attempts in progress, please try again in a moment.", "warning")
+            return render_template('login.html', email=email), 429, {'Retry-After': '1'}
         if user_id:
             session['user_id'] = user_id
-            user_details = get_user_details_db(user_id)
+            user_details = get_user_profile(user_id)
             session['user_name'] = user_details['name'] if user_details else "User"
             flash(f"Welcome back, {session['user_name']}!", "success")
 
@@ -431,6 +794,7 @@ def login():
 @app.route('/logout')
 @login_required
 def logout():
+    diagnosis_states.delete(session.pop('diagnosis_state_id', None))
     session.pop('user_id', None)
     session.pop('user_name', None)
     flash("You have been logged out.", "info")
@@ -440,7 +804,7 @@ def logout():
 @login_required
 def complete_profile():
     user_id = session['user_id']
-    user_details = get_user_details_db(user_id)
+    user_details = get_user_profile(user_id)
     if not user_details:
         flash("User not found.", "danger")
         return redirect(url_for('logout'))
@@ -473,7 +837,7 @@ def complete_profile():
 @login_required
 def edit_profile():
     user_id = session['user_id']
-    user_details = get_user_details_db(user_id)
+    user_details = get_user_profile(user_id)
     if not user_details:
         flash("User not found. Please login again.", "danger")
         return redirect(url_for('logout'))
@@ -505,100 +869,40 @@ def diagnose_form():
     # GET: Display the form with symptoms and risk factors
     # POST: Handle initial submission, get initial diagnosis & follow-up questions
     # This will be complex, we'll build it step-by-step
-    user_details = get_user_details_db(session['user_id'])
+    user_details = get_user_profile(session['user_id'])
     if user_details and (user_details['age'] is None or user_details['weight'] is None):
         flash("Please complete your profile before starting a diagnosis.", "warning")
         return redirect(url_for('complete_profile'))
 
     if request.method == 'POST':
-        selected_symptoms = request.form.getlist('symptoms') # Name of checkbox group
-        selected_risk_factors = request.form.getlist('risk_factors')
+        kbv = active_kb()
+        symptom_mask = kbv.symptom_vocabulary.encode(request.form.getlist('symptoms')) # Name of checkbox group
+        risk_mask = kbv.risk_vocabulary.encode(request.form.getlist('risk_factors'))
 
-        if not selected_symptoms:
+        if not symptom_mask:
             flash("Please select at least one symptom.", "warning")
             return render_template('diagnose.html',
                                    symptom_categories=symptom_categories,
                                    unique_risk_factors=unique_risk_factors,
                                    user_name=session.get('user_name', 'User'))
 
-        # Store selected symptoms and risks in session to carry over to follow-up
-        session['current_symptoms'] = selected_symptoms
-        session['current_risk_factors'] = selected_risk_factors
-
-        # Format for Prolog
-        symptoms_prolog_list_str = "[" + ",".join([f"'{s.replace('_', ' ')}'" for s in selected_symptoms]) + "]"
-        risk_factors_prolog_list_str = "[" + ",".join([f"'{rf}'" if ' ' in rf else rf for rf in selected_risk_factors]) + "]"
-        initial_answers_prolog_list_str = "[]" # No answers for the first pass
-
-        initial_query_str = (f"findall([D, C], symptom_match({symptoms_prolog_list_str}, "
-                             f"{risk_factors_prolog_list_str}, {initial_answers_prolog_list_str}, D, C), Results).")
-
-        query_results = query_prolog(initial_query_str)
-        initial_top_results_data = []
-        follow_up_questions_to_ask = set() # Use set to store unique questions
-
-        if query_results and query_results[0]['Results']:
-            initial_sorted = sorted(query_results[0]['Results'], key=lambda x: float(x[1]), reverse=True)
-            initial_top_results_data = initial_sorted[:3] # Consider top 3 for follow-ups
-
-            for disease_atom, _confidence in initial_top_results_data:
-                q_query_str = f"findall(Q, follow_up_question('{disease_atom}', Q), Questions)."
-                q_results = query_prolog(q_query_str)
-                if q_results and q_results[0]['Questions']:
-                    for q_text_bytes in q_results[0]['Questions']:
-                        # Pyswip can return byte strings, decode them
-                        follow_up_questions_to_ask.add(q_text_bytes.decode('utf-8') if isinstance(q_text_bytes, bytes) else str(q_text_bytes))
-        else:
+        bundle, follow_up_questions = first_diagnosis_pass(symptom_mask, risk_mask)
+
+        if not bundle or not bundle['ranked']:
             flash("Could not determine any likely diagnosis based on initial symptoms. Please consult a healthcare professional or try different symptoms.", "warning")
             return redirect(url_for('diagnose_form'))
 
-        if follow_up_questions_to_ask:
-            session['follow_up_questions'] = sorted(list(follow_up_questions_to_ask))
+        # Store the selected symptom and risk bitsets server-side to carry over to follow-up
+        if follow_up_questions:
+            # The first-pass scores are kept so refinement only applies the answer adjustments
+            start_diagnosis_state(symptoms_mask=symptom_mask, risk_factors_mask=risk_mask,
+                                  follow_up_questions=follow_up_questions, base_scores=saved_base_scores(bundle))
             return redirect(url_for('ask_followup'))
         else:
             # No follow-up questions, proceed to show results directly
-            # This means we need to prepare final_top_match_details_data here
-            session.pop('follow_up_questions', None) # Clear any old ones
-            # For now, let's redirect to a results page that can handle this scenario
-            # We'll pass the initial_top_results_data
-            session['final_results_data'] = initial_top_results_data
-            session['final_top_match_details'] = None # Will build this in results route if needed
-
-            if initial_top_results_data:
-                 # Get details for the top match
-                top_disease_atom_bytes, top_confidence_float = initial_top_results_data[0]
-                top_disease_atom = top_disease_atom_bytes.decode('utf-8') if isinstance(top_disease_atom_bytes, bytes) else str(top_disease_atom_bytes)
-
-                test_res = query_prolog(f"requires_test('{top_disease_atom}', Test).")
-                test_raw_bytes = test_res[0]['Test'] if test_res and 'Test' in test_res[0] else b"N/S"
-                test_raw = test_raw_bytes.decode('utf-8') if isinstance(test_raw_bytes, bytes) else str(test_raw_bytes)
-
-
-                treat_res = query_prolog(f"treatment('{top_disease_atom}', T).")
-                treatment_raw_list_bytes = treat_res[0]['T'] if treat_res and 'T' in treat_res[0] and isinstance(treat_res[0]['T'], list) else ([treat_res[0]['T']] if treat_res and 'T' in treat_res[0] else [b"N/S info"])
-                treatment_raw = [item.decode('utf-8') if isinstance(item, bytes) else str(item) for item in treatment_raw_list_bytes]
-
-
-                advice_res = query_prolog(f"advice('{top_disease_atom}', A).")
-                advice_raw_bytes = advice_res[0]['A'] if advice_res and 'A' in advice_res[0] else b"General advice."
-                advice_raw = advice_raw_bytes.decode('utf-8') if isinstance(advice_raw_bytes, bytes) else str(advice_raw_bytes)
-
-                personalized_raw = personalized_advice(session['user_id'], top_disease_atom)
-
-                session['final_top_match_details'] = {
-                    'disease_display': top_disease_atom.replace('_',' ').title(),
-                    'test': test_raw.replace('_',' ').title(),
-                    'treatment_str': "- " + "\n- ".join([str(item).replace('_', ' ').title() for item in treatment_raw]),
-                    'advice': advice_raw,
-                    'personalized': personalized_raw,
-                    'raw_symptoms': session.get('current_symptoms', []),
-                    'raw_disease': top_disease_atom,
-                    'raw_confidence': float(top_confidence_float),
-                    'raw_test': test_raw,
-                    'raw_treatment': treatment_raw,
-                    'raw_advice': advice_raw,
-                    'raw_personalized': personalized_raw
-                }
+            start_diagnosis_state(symptoms_mask=symptom_mask, risk_factors_mask=risk_mask,
+                                  final_results_data=list(bundle['ranked'][:3]),
+                                  final_top_match_details=build_top_match_details(bundle, session['user_id'], symptom_mask))
             return redirect(url_for('view_results'))
 
     # GET request
@@ -610,7 +914,8 @@ def diagnose_form():
 @app.route('/diagnose/followup', methods=['GET', 'POST'])
 @login_required
 def ask_followup():
-    follow_up_questions = session.get('follow_up_questions')
+    state = get_diagnosis_state()
+    follow_up_questions = state.get('follow_up_questions')
     if not follow_up_questions:
         flash("No follow-up questions to ask, or session expired.", "warning")
         return redirect(url_for('diagnose_form'))
@@ -623,72 +928,35 @@ def ask_followup():
                 collected_answers_raw.append((question_text, answer))
             # else: user chose not to answer or an invalid value was submitted
 
-        # Format answers for Prolog
-        # Ensure the question text sent back matches exactly what Prolog expects (stored in session)
-        formatted_answers_prolog = ["('{}',{})".format(q.replace("'", "''"), a) for q, a in collected_answers_raw]
-        answers_prolog_list_str = "[" + ",".join(formatted_answers_prolog) + "]"
-
-        symptoms_prolog_list_str = "[" + ",".join([f"'{s.replace('_', ' ')}'" for s in session.get('current_symptoms', [])]) + "]"
-        risk_factors_prolog_list_str = "[" + ",".join([f"'{rf}'" if ' ' in rf else rf for rf in session.get('current_risk_factors', [])]) + "]"
-
-        refined_query_str = (f"findall([D, C], symptom_match({symptoms_prolog_list_str}, "
-                             f"{risk_factors_prolog_list_str}, {answers_prolog_list_str}, D, C), Results).")
-
-        query_results = query_prolog(refined_query_str)
-        final_top_results_data = []
-        final_top_match_details_data = None
-
-        if query_results and query_results[0]['Results']:
-            refined_sorted = sorted(query_results[0]['Results'], key=lambda x: float(x[1]), reverse=True)
-            final_top_results_data = refined_sorted[:3]
-
-            if final_top_results_data:
-                top_disease_atom_bytes, top_confidence_float = final_top_results_data[0]
-                top_disease_atom = top_disease_atom_bytes.decode('utf-8') if isinstance(top_disease_atom_bytes, bytes) else str(top_disease_atom_bytes)
-
-
-                test_res = query_prolog(f"requires_test('{top_disease_atom}', Test).")
-                test_raw_bytes = test_res[0]['Test'] if test_res and 'Test' in test_res[0] else b"N/S"
-                test_raw = test_raw_bytes.decode('utf-8') if isinstance(test_raw_bytes, bytes) else str(test_raw_bytes)
-
-
-                treat_res = query_prolog(f"treatment('{top_disease_atom}', T).")
-                treatment_raw_list_bytes = treat_res[0]['T'] if treat_res and 'T' in treat_res[0] and isinstance(treat_res[0]['T'], list) else ([treat_res[0]['T']] if treat_res and 'T' in treat_res[0] else [b"N/S info"])
-                treatment_raw = [item.decode('utf-8') if isinstance(item, bytes) else str(item) for item in treatment_raw_list_bytes]
-
-                advice_res = query_prolog(f"advice('{top_disease_atom}', A).")
-                advice_raw_bytes = advice_res[0]['A'] if advice_res and 'A' in advice_res[0] else b"General advice."
-                advice_raw = advice_raw_bytes.decode('utf-8') if isinstance(advice_raw_bytes, bytes) else str(advice_raw_bytes)
+        # Question text must match exactly what Prolog expects (stored in the diagnosis state)
+        symptom_mask, risk_mask = selection_masks(state)
+        collected_answers_raw = [tuple(a) for a in state.get('follow_up_answers', [])] + collected_answers_raw
+        questions_asked = state.get('questions_asked', []) + follow_up_questions
+        base_scores = restore_base_scores(state)
+
+        # Adaptive mode asks the next most informative question, if the leader can still change
+        next_questions = next_follow_up_questions(symptom_mask, risk_mask,
+                                                  collected_answers_raw, questions_asked, base_scores=base_scores)
+        if next_questions:
+            update_diagnosis_state(follow_up_questions=next_questions, follow_up_answers=collected_answers_raw,
+                                   questions_asked=questions_asked)
+            return redirect(url_for('ask_followup'))
 
-                personalized_raw = personalized_advice(session['user_id'], top_disease_atom)
+        bundle = diagnosis_bundle(symptom_mask, risk_mask, collected_answers_raw,
+                                  follow_up_k=0, base_scores=base_scores) # No further questions after this round
 
-                final_top_match_details_data = {
-                    'disease_display': top_disease_atom.replace('_',' ').title(),
-                    'test': test_raw.replace('_',' ').title(),
-                    'treatment_str': "- " + "\n- ".join([str(item).replace('_', ' ').title() for item in treatment_raw]),
-                    'advice': advice_raw,
-                    'personalized': personalized_raw,
-                    'raw_symptoms': session.get('current_symptoms', []),
-                    'raw_disease': top_disease_atom,
-                    'raw_confidence': float(top_confidence_float),
-                    'raw_test': test_raw,
-                    'raw_treatment': treatment_raw,
-                    'raw_advice': advice_raw,
-                    'raw_personalized': personalized_raw
-                }
-        else:
+        if not bundle or not bundle['ranked']:
             flash("Could not determine a refined diagnosis after follow-up. Please consult a healthcare professional.", "warning")
-            # Optionally, you could show the initial results if no refined results are found
-            # For now, redirecting to diagnose form
             return redirect(url_for('diagnose_form'))
 
-        session['final_results_data'] = final_top_results_data
-        session['final_top_match_details'] = final_top_match_details_data
-        session['questions_asked_for_display'] = follow_up_questions # For display on results page
-        # Clear session variables used during diagnosis process
-        session.pop('follow_up_questions', None)
-        # session.pop('current_symptoms', None) # Keep for report
-        # session.pop('current_risk_factors', None) # Keep for report
+        final_top_results_data = list(bundle['ranked'][:3])
+        final_top_match_details_data = build_top_match_details(bundle, session['user_id'], symptom_mask)
+
+        # The symptom/risk factor bitsets are kept for the report; the pending questions are cleared
+        update_diagnosis_state(final_results_data=final_top_results_data,
+                               final_top_match_details=final_top_match_details_data,
+                               questions_asked_for_display=questions_asked, # For display on results page
+                               clear=('follow_up_questions', 'follow_up_answers', 'questions_asked', 'base_scores'))
 
         return redirect(url_for('view_results'))
 
@@ -697,9 +965,10 @@ def ask_followup():
 @app.route('/diagnose/results')
 @login_required
 def view_results():
-    top_results = session.get('final_results_data')
-    top_match_details = session.get('final_top_match_details')
-    follow_up_questions_asked = session.get('questions_asked_for_display')
+    state = get_diagnosis_state()
+    top_results = state.get('final_results_data')
+    top_match_details = state.get('final_top_match_details')
+    follow_up_questions_asked = state.get('questions_asked_for_display')
 
     if top_results is None and top_match_details is None: # Check if any results exist
         flash("No diagnosis results found in session. Please start a new diagnosis.", "warning")
@@ -714,10 +983,9 @@ def view_results():
             decoded_top_results.append((disease_str, conf))
 
 
-    # Clean up session data that is only for this view
-    # session.pop('final_results_data', None)
-    # session.pop('final_top_match_details', None) # Keep this for report generation
-    session.pop('questions_asked_for_display', None)
+    # Clean up state that is only for this view; results and match details are kept for report generation
+    if 'questions_asked_for_display' in state:
+        update_diagnosis_state(clear=('questions_asked_for_display',))
 
     return render_template('results.html',
                            top_results=decoded_top_results,
@@ -726,59 +994,122 @@ def view_results():
                            user_id=session['user_id'])
 
 
+def report_data_from_details(top_match_details):
+    symptom_mask = top_match_details.get('raw_symptoms_mask')
+    if symptom_mask is None: # Details saved before bitsets
+        symptom_mask = active_kb().symptom_vocabulary.encode(top_match_details['raw_symptoms'])
+    return {
+        'symptoms': top_match_details['raw_symptoms'],
+        'symptoms_mask': symptom_mask,
+        'disease': top_match_details['raw_disease'], # atom
+        'confidence': top_match_details['raw_confidence'], # float
+        'test': top_match_details['raw_test'], # atom or string
+        'treatment': top_match_details['raw_treatment'], # list of atoms/strings
+        'advice': top_match_details['raw_advice'], # string
+        'personalized_advice': top_match_details['raw_personalized'], # string
+        'kb_version': top_match_details.get('kb_version'), # None for results computed before versioning
+    }
+
+def send_report_bytes(pdf_bytes, download_name):
+    # Streams an in-memory PDF; nothing touches the reports folder
+    return send_file(io.BytesIO(pdf_bytes), mimetype='application/pdf', as_attachment=True, download_name=download_name)
+
 @app.route('/report/generate', methods=['POST']) # Changed to POST to avoid accidental generation
 @login_required
 def generate_and_save_report():
     user_id = session['user_id']
-    # Retrieve details from session, which should have been set by view_results
-    top_match_details = session.get('final_top_match_details')
+    # Retrieve details from the diagnosis state, which should have been set by the diagnosis steps
+    top_match_details = get_diagnosis_state().get('final_top_match_details')
 
     if not top_match_details:
         flash("No diagnosis data available to generate a report.", "warning")
         return redirect(url_for('view_results')) # Or wherever appropriate
 
-    user_details_row = get_user_details_db(user_id)
+    user_details_row = get_user_profile(user_id)
     if not user_details_row:
         flash("User details not found. Cannot generate report.", "danger")
         return redirect(url_for('view_results'))
 
-    diagnosis_data_for_pdf = {
-        'symptoms': top_match_details['raw_symptoms'],
-        'disease': top_match_details['raw_disease'], # atom
-        'confidence': top_match_details['raw_confidence'], # float
-        'test': top_match_details['raw_test'], # atom or string
-        'treatment': top_match_details['raw_treatment'], # list of atoms/strings
-        'advice': top_match_details['raw_advice'], # string
-        'personalized_advice': top_match_details['raw_personalized'] # string
-    }
+    diagnosis_data_for_pdf = report_data_from_details(top_match_details)
 
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     safe_disease_name = "".join(c if c.isalnum() else "_" for c in str(top_match_details['raw_disease']))
     base_pdf_filename = f"Report_{user_id}_{safe_disease_name}_{timestamp}.pdf"
 
-    pdf_filepath = generate_pdf_report(base_pdf_filename, user_details_row, diagnosis_data_for_pdf)
+    if not app.config['REPORT_ARCHIVE']:
+        # No archival copy: record the diagnosis and stream the PDF from memory
+        if not add_diagnosis_db(user_id, diagnosis_data_for_pdf['symptoms_mask'], top_match_details['raw_disease'], top_match_details['raw_confidence'], None,
+                                diagnosis_data_for_pdf['kb_version']):
+            flash("Failed to update history. Please contact support.", "danger")
+        return send_report_bytes(render_report(user_details_row, diagnosis_data_for_pdf), base_pdf_filename)
 
-    if pdf_filepath:
-        symptoms_str = ','.join(top_match_details['raw_symptoms'])
-        if add_diagnosis_db(user_id, symptoms_str, top_match_details['raw_disease'], top_match_details['raw_confidence'], pdf_filepath):
-            flash(f"Diagnosis report saved: {os.path.basename(pdf_filepath)} and added to history.", "success")
-            # Make the PDF downloadable immediately after generation
-            session['last_report_path'] = pdf_filepath # Store for download link
-        else:
-            flash("Report PDF saved, but failed to update history. Please contact support.", "danger")
-    else:
-        flash("Failed to generate PDF report.", "danger")
+    # PDF layout, the disk write and the history insert run on a report worker
+    job_id = report_queue.submit(run_report_job, user_id, base_pdf_filename, dict(user_details_row), diagnosis_data_for_pdf,
+                                 user_id=user_id)
+    session['last_report_job'] = job_id # Store for status polling and the download link
+    session.pop('last_report_path', None)
+    flash(f"Generating report {base_pdf_filename}; it will be added to your history when ready.", "info")
 
     return redirect(url_for('view_results')) # Redirect back to results page
 
+@app.route('/report/stream')
+@login_required
+def stream_report():
+    # Download the current diagnosis as a PDF rendered in memory, without archiving it or touching history
+    top_match_details = get_diagnosis_state().get('final_top_match_details')
+    if not top_match_details:
+        flash("No diagnosis data available to generate a report.", "warning")
+        return redirect(url_for('view_results'))
+    user_details_row = get_user_profile(session['user_id'])
+    if not user_details_row:
+        flash("User details not found. Cannot generate report.", "danger")
+        return redirect(url_for('view_results'))
+    safe_disease_name = "".join(c if c.isalnum() else "_" for c in str(top_match_details['raw_disease']))
+    return send_report_bytes(render_report(user_details_row, report_data_from_details(top_match_details)),
+                             f"Report_{safe_disease_name}.pdf")
+
+@app.route('/report/status/<job_id>')
+@login_required
+def report_status(job_id):
+    job = report_queue.get(job_id)
+    if not job or job.user_id != session['user_id']:
+        return jsonify({'error': 'Report job not found.'}), 404
+    # Long-poll: ?wait=N holds the response up to N seconds (capped) until the job finishes
+    wait = min(request.args.get('wait', 0, type=float) or 0, app.config['REPORT_STATUS_MAX_WAIT'])
+    if wait > 0:
+        job = report_queue.wait(job_id, wait) or job
+    return jsonify(job.to_dict())
+
+@app.route('/report/jobs/stats')
+@login_required
+def report_job_stats():
+    # Queue depth, retries and job durations of the report workers
+    return jsonify(report_queue.stats())
+
 @app.route('/report/download/last')
 @login_required
 def download_last_report():
     report_path = session.get('last_report_path')
+    job_id = session.get('last_report_job')
+    if job_id:
+        job = report_queue.get(job_id)
+        if job is None or job.user_id != session['user_id']:
+            session.pop('last_report_job', None)
+            flash("Report job not found. Please generate the report again.", "warning")
+            return redirect(url_for('view_results'))
+        if job.status == FAILED:
+            session.pop('last_report_job', None)
+            flash(f"Failed to generate PDF report: {job.error}", "danger")
+            return redirect(url_for('view_results'))
+        if job.status != DONE:
+            flash("Your report is still being generated. Please try again in a moment.", "info")
+            return redirect(url_for('view_results'))
+        report_path = job.result
     if report_path and os.path.exists(report_path):
         try:
             # Clear it after use so it's not accidentally re-downloaded without new generation
             session.pop('last_report_path', None)
+            session.pop('last_report_job', None)
             return send_from_directory(directory=os.path.dirname(report_path),
                                        path=os.path.basename(report_path), # Use path instead of filename
                                        as_attachment=True)
@@ -803,73 +1134,213 @@ def download_history_report(history_id):
                                        as_attachment=True)
         except Exception as e:
             flash(f"Error sending report: {e}", "danger")
-            return redirect(url_for('history'))
+            return redirect(url_for('history_page'))
     else:
         flash("Report not found or access denied.", "warning")
-        return redirect(url_for('history'))
+        return redirect(url_for('history_page'))
 
 
 @app.route('/history')
 @login_required
 def history_page():
     user_id = session['user_id']
-    history_data_rows = get_user_history_db(user_id)
-    # Convert Row objects to dictionaries for easier template access
-    history_data = [dict(row) for row in history_data_rows]
-    for item in history_data: # Make report filename just the basename for display
-        if item.get('report_filename'):
+    page_size = max(1, min(request.args.get('limit', app.config['HISTORY_PAGE_SIZE'], type=int) or 1, 200))
+    before = decode_cursor(request.args.get('before'))
+    after = None if before else decode_cursor(request.args.get('after'))
+    # Fetch one extra row to know whether there is another page in the direction we are moving
+    rows = get_user_history_page_db(user_id, before=before, after=after, limit=page_size + 1)
+    has_more = len(rows) > page_size
+    if after:
+        rows = rows[-page_size:] if has_more else rows
+    else:
+        rows = rows[:page_size]
+
+    history_data = []
+    for row in rows:
+        item = history_record(row)
+        if item.get('report_filename'): # Make report filename just the basename for display
             item['report_basename'] = os.path.basename(item['report_filename'])
-    return render_template('history.html', history_data=history_data)
+        history_data.append(item)
+
+    older_cursor = newer_cursor = None
+    if history_data:
+        # Older rows exist if we paged forward, or paged backward/opened the first page and saw an extra row
+        if after or has_more:
+            older_cursor = encode_cursor(history_data[-1])
+        if before or (after and has_more):
+            newer_cursor = encode_cursor(history_data[0])
+    return render_template('history.html', history_data=history_data, page_size=page_size,
+                           older_cursor=older_cursor, newer_cursor=newer_cursor)
+
+@app.route('/history/export.<fmt>')
+@login_required
+def export_history(fmt):
+    if fmt not in ('csv', 'jsonl'):
+        flash("Unsupported export format.", "warning")
+        return redirect(url_for('history_page'))
+    user_id = session['user_id']
+    # A failing batch raises, which aborts the response: clients see a truncated transfer, not a short export
+    rows = map(history_record, iter_history(lambda before, limit: get_user_history_page_db(user_id, before=before, limit=limit,
+                                                                                          raise_errors=True)))
+    lines = csv_lines(rows) if fmt == 'csv' else jsonl_lines(rows)
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    filename = f"diagnosis_history_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}"
+    # Rows are generated batch by batch while the response is sent, so memory stays flat
+    return Response(stream_with_context(lines), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+chart_cache = ChartCache()
+# Charts used to be written to static/charts on every page view; clear out the leftovers
+purge_chart_files(os.path.join(app.static_folder, 'charts'))
 
 @app.route('/statistics')
 @login_required
 def statistics_page():
-    db = get_db()
-    cursor = db.cursor()
+    # The chart is drawn in the browser from /api/statistics; the PNG export is the no-JS fallback
+    return render_template('statistics.html', api_url=url_for('statistics_api'), export_url=url_for('statistics_chart'))
+
+@app.route('/api/statistics')
+@login_required
+def statistics_api():
+    days = request.args.get('days', 30, type=int) or 30
     try:
-        cursor.execute("""SELECT diagnosis, COUNT(*) as count FROM history
-                          WHERE diagnosis IS NOT NULL AND diagnosis != ''
-                          GROUP BY diagnosis ORDER BY COUNT(*) DESC""")
-        data = cursor.fetchall()
+        summary = get_statistics_summary(get_db(), days=max(1, min(days, 366)))
     except Exception as e:
-        flash(f"Could not retrieve statistics: {e}", "danger")
-        return render_template('statistics.html', chart_url=None, error=True)
-
-    if not data:
-        return render_template('statistics.html', chart_url=None, no_data=True)
-
-    labels_bytes = [x['diagnosis'] for x in data]
-    labels = [str(label).replace('_', ' ').title() for label in labels_bytes]
-    counts = [x['count'] for x in data]
-
-    fig, ax = plt.subplots(figsize=(7, 6)) # Adjusted size for better fit
-    wedges, texts, autotexts = ax.pie(counts, labels=None, autopct='%1.1f%%', startangle=90,
-                                      pctdistance=0.85, wedgeprops=dict(width=0.4))
-    ax.set_title("Distribution of Diagnoses", fontsize=16, pad=20)
-    # Legend outside the pie for clarity
-    ax.legend(wedges, labels, title="Diagnoses", loc="center left",
-              bbox_to_anchor=(1, 0, 0.5, 1), fontsize='small')
-    plt.tight_layout(rect=[0, 0, 0.8, 1]) # Adjust layout to make space for legend
-
-    # Save chart to a static file
-    charts_dir = os.path.join(app.static_folder, 'charts')
-    os.makedirs(charts_dir, exist_ok=True)
-    chart_filename = f"diagnosis_stats_{session['user_id']}_{datetime.now().timestamp()}.png"
-    chart_path = os.path.join(charts_dir, chart_filename)
+        ERRORS_TOTAL.inc(component='statistics')
+        log_event(logger, logging.ERROR, 'statistics.read_failed', error=str(e))
+        return jsonify({'error': "Could not retrieve statistics."}), 500
+    response = jsonify(summary)
+    response.set_etag(summary_etag(summary))
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
+
+@app.route('/statistics/chart.png')
+@login_required
+def statistics_chart():
     try:
-        fig.savefig(chart_path)
-        plt.close(fig) # Close the figure to free memory
+        counts = get_diagnosis_counts(get_db())
+        if not counts:
+            return "No statistics available.", 404
+        etag, png = chart_cache.get(counts)
     except Exception as e:
-        flash(f"Error saving chart: {e}", "danger")
-        return render_template('statistics.html', chart_url=None, error=True)
-
-    chart_url = url_for('static', filename=f'charts/{chart_filename}')
-    return render_template('statistics.html', chart_url=chart_url)
+        ERRORS_TOTAL.inc(component='statistics')
+        log_event(logger, logging.ERROR, 'statistics.chart_failed', error=str(e))
+        return "Could not render chart.", 500
+    response = make_response(png)
+    response.mimetype = 'image/png'
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache' # Always revalidate; unchanged charts get a 304
+    return response.make_conditional(request)
+
+# --- JSON Diagnosis API ---
+# Same scoring and follow-up planning as the web forms; inputs must come from the form vocabularies
+# of the serving knowledge base version (see prepare_kb_version)
+
+def diagnose_api_request(req, base_scores=None):
+    """Runs one validated request through the diagnose_form/ask_followup steps; returns (bundle, follow-up questions)."""
+    kbv = active_kb()
+    symptom_mask, risk_mask = kbv.symptom_vocabulary.encode(req['symptoms']), kbv.risk_vocabulary.encode(req['risk_factors'])
+    if not req['answers']:
+        return first_diagnosis_pass(symptom_mask, risk_mask, base_scores=base_scores)
+    asked = [question for question, _answer in req['answers']]
+    questions = next_follow_up_questions(symptom_mask, risk_mask, req['answers'], asked, base_scores=base_scores)
+    bundle = diagnosis_bundle(symptom_mask, risk_mask, req['answers'], follow_up_k=0, base_scores=base_scores)
+    return bundle, questions
+
+def diagnose_api_batch(reqs):
+    """Scores validated requests together, in order: identical requests are scored once and, with the
+    Python engine, requests sharing symptoms and risk factors share one symptom-matching pass."""
+    kbv = active_kb()
+    keys = [normalize_diagnosis_key(kbv.symptom_vocabulary.encode(req['symptoms']), kbv.risk_vocabulary.encode(req['risk_factors']),
+                                    req['answers']) for req in reqs]
+    group_sizes = {}
+    for key in keys:
+        group_sizes[key[:2]] = group_sizes.get(key[:2], 0) + 1
+    base_scores, results = {}, {}
+    for req, key in zip(reqs, keys):
+        if key in results:
+            continue
+        base = None
+        if app.config['DIAGNOSIS_ENGINE'] == 'python' and group_sizes[key[:2]] > 1:
+            if key[:2] not in base_scores:
+                base_scores[key[:2]] = kbv.kb.mask_base_scores(key[0], key[1])
+            base = base_scores[key[:2]]
+        results[key] = diagnose_api_request(req, base_scores=base)
+    return [results[key] for key in keys]
+
+@app.route('/api/v1/diagnose', methods=['POST'])
+@api_token_required
+def api_diagnose():
+    try:
+        req = parse_diagnosis_request(request.get_json(silent=True), *active_kb().api_vocabulary)
+    except ApiValidationError as e:
+        return jsonify({'error': "Invalid diagnosis request.", 'details': e.errors}), 400
+    bundle, questions = diagnose_api_request(req)
+    if bundle is None:
+        return jsonify({'error': "The knowledge base could not process the request."}), 503
+    return jsonify(diagnosis_response(bundle, questions, req['top_k'], active_kb().version))
+
+@app.route('/api/v1/diagnose/batch', methods=['POST'])
+@api_token_required
+def api_diagnose_batch():
+    # {"requests": [{"id": ..., "symptoms": [...], ...}, ...]}; invalid entries get an error, the rest are scored
+    payload = request.get_json(silent=True)
+    items = payload.get('requests') if isinstance(payload, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({'error': "Body must be an object with a non-empty 'requests' list."}), 400
+    if len(items) > app.config['API_BATCH_LIMIT']:
+        return jsonify({'error': f"At most {app.config['API_BATCH_LIMIT']} requests per batch."}), 413
+
+    results, valid = [], []
+    for position, item in enumerate(items):
+        item_id = item.get('id', position) if isinstance(item, dict) else position
+        try:
+            valid.append((len(results), parse_diagnosis_request(item, *active_kb().api_vocabulary)))
+            results.append({'id': item_id})
+        except ApiValidationError as e:
+            results.append({'id': item_id, 'error': "Invalid diagnosis request.", 'details': e.errors})
+    scored = diagnose_api_batch([req for _position, req in valid])
+    for (position, req), (bundle, questions) in zip(valid, scored):
+        if bundle is None:
+            results[position]['error'] = "The knowledge base could not process the request."
+        else:
+            results[position].update(diagnosis_response(bundle, questions, req['top_k'], active_kb().version))
+    return jsonify({'results': results})
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus text exposition for this worker process
+    token = app.config['METRICS_TOKEN']
+    if token and not token_matches(bearer_token(request.headers.get('Authorization')), [token]):
+        return "Unauthorized", 401, {'WWW-Authenticate': 'Bearer'}
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/kb', methods=['GET', 'POST'])
+def kb_admin():
+    # GET: the knowledge base version this worker serves. POST: validate diagnosis.pl and swap it in now.
+    # Only this worker reloads synchronously; the others pick the change up within KB_CHECK_INTERVAL.
+    token = app.config['KB_ADMIN_TOKEN']
+    if not token:
+        return jsonify({'error': "Knowledge base administration is disabled on this server."}), 503
+    if not token_matches(bearer_token(request.headers.get('Authorization')), [token]):
+        return jsonify({'error': "Missing or invalid admin token."}), 401, {'WWW-Authenticate': 'Bearer'}
+    if request.method == 'GET':
+        return jsonify(kb_manager.status())
+    previous = kb_manager.current.version
+    version, errors = kb_manager.reload()
+    body = dict(kb_manager.status(), previous=previous, reloaded=version.version != previous)
+    return jsonify(body), 422 if errors else 200
+
+@app.route('/cache/stats')
+@login_required
+def cache_stats():
+    # Hit/miss/eviction counters of the diagnosis result cache
+    return jsonify(diagnosis_cache.stats())
 
 
 if __name__ == '__main__':
     if not os.path.exists(app.config['PROLOG_FILE']):
-        print(f"CRITICAL ERROR: Prolog file '{app.config['PROLOG_FILE']}' not found.")
-        print("The application cannot start without the Prolog knowledge base.")
+        log_event(logger, logging.CRITICAL, 'startup.kb_missing', path=app.config['PROLOG_FILE'],
+                  detail="The application cannot start without the Prolog knowledge base.")
     else:
         app.run(debug=True) # debug=True is for development
\ No newline at end of file
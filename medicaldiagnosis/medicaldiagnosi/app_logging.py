@@ -0,0 +1,82 @@
+# app_logging.py
+# Structured (one JSON object per line) logging with per-event rate limiting.
+#
+# Log calls pass a constant event name plus fields:
+#     log_event(logger, logging.WARNING, 'prolog.query_failed', goal=goal, error=str(e))
+# The event name is also the rate-limit key, so a failure repeated on every request under
+# load is written a few times per interval, followed by a count of what was suppressed.
+
+import json
+import logging
+import os
+import threading
+import time
+
+ROOT_LOGGER = 'medicaldiagnosis'
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'event': record.getMessage(),
+            'pid': record.process,
+        }
+        entry.update(getattr(record, 'fields', None) or {})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets through at most `burst` records per event per `interval` seconds."""
+
+    def __init__(self, burst=10, interval=60.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self._windows = {} # event -> [window_start, emitted, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(key)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                window = self._windows[key] = [now, 0, 0]
+                if suppressed:
+                    record.fields = dict(getattr(record, 'fields', None) or {}, suppressed_since_last=suppressed)
+            if window[1] >= self.burst:
+                window[2] += 1
+                return False
+            window[1] += 1
+            return True
+
+
+def configure_logging(level=None, burst=None, interval=None):
+    """Installs the JSON handler and rate limiter on the app's root logger (idempotent)."""
+    logger = logging.getLogger(ROOT_LOGGER)
+    if getattr(logger, '_structured', False):
+        return logger
+    handler = logging.StreamHandler()
+    handler.setFormatter(JsonFormatter())
+    handler.addFilter(RateLimitFilter(burst=int(burst or os.environ.get('LOG_RATE_LIMIT_BURST', 10)),
+                                      interval=float(interval or os.environ.get('LOG_RATE_LIMIT_INTERVAL', 60))))
+    logger.addHandler(handler)
+    logger.setLevel(level or os.environ.get('LOG_LEVEL', 'INFO').upper())
+    logger.propagate = False
+    logger._structured = True
+    return logger
+
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT_LOGGER}.{name}")
+
+
+def log_event(logger, level, event, exc_info=None, **fields):
+    if logger.isEnabledFor(level):
+        logger.log(level, event, exc_info=exc_info, extra={'fields': fields})
@@ -0,0 +1,314 @@
+# asgi.py
+# ASGI entry point: an asyncio front for the Flask app. Each request runs in a bounded thread
+# pool picked by route, so a slow PDF write or a SQLite lock only occupies a thread of its own
+# class while the event loop keeps accepting and answering everything else.
+#
+#   uvicorn asgi:application --workers 2        (any ASGI server: hypercorn, daphne, ...)
+#
+# Backpressure: a pool admits at most its threads plus ASGI_MAX_PENDING waiting requests;
+# past that the front answers 503 with Retry-After at once instead of queueing without bound.
+# Report status long-polls (/report/status/<id>?wait=N) wait on the job from the event loop,
+# holding no thread, so the results page long-polls by default in this mode. With several
+# workers a poll may reach one that did not queue the job; it then re-reads the job from the
+# shared report_jobs table every JOB_POLL_INTERVAL seconds instead of being notified.
+
+import asyncio
+import contextvars
+import io
+import json
+import logging
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode
+
+os.environ.setdefault('REPORT_STATUS_POLL_WAIT', '20')
+
+from app_logging import get_logger, log_event
+from metrics import REGISTRY
+
+logger = get_logger('asgi')
+
+ASGI_REJECTED = REGISTRY.counter('asgi_rejected_total', "Requests refused with 503 because their pool was full.", ('pool',))
+
+# Pool per route class, first prefix match wins; everything else (pages, history, DB reads) uses 'default'
+ROUTE_POOLS = (
+    ('report', ('/report/generate', '/report/stream', '/report/download', '/history/export', '/statistics/chart.png')),
+    ('diagnosis', ('/diagnose', '/api/v1/')),
+    ('auth', ('/login', '/register')), # Threads here mostly wait on the password hashing executor
+)
+REPORT_STATUS_RE = re.compile(r'^/report/status/([0-9a-f]+)$')
+MAX_LONG_POLL = 60.0
+JOB_POLL_INTERVAL = 0.5
+
+
+class BoundedPool:
+    """A thread pool that refuses work once `threads + max_pending` requests are in flight."""
+
+    def __init__(self, name, threads, max_pending):
+        self.name = name
+        self.threads = threads
+        self.max_pending = max_pending
+        self.limit = threads + max_pending
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix=f"asgi-{name}")
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def runner(self):
+        """Returns run(func, *args) -> awaitable for one request.
+
+        All of a request's calls share one contextvars context, so a streamed body
+        (stream_with_context) can be resumed on another pool thread.
+        """
+        context = contextvars.Context()
+        loop = asyncio.get_running_loop()
+        return lambda func, *args: loop.run_in_executor(self.executor, context.run, func, *args)
+
+
+def build_environ(scope, body):
+    """PEP 3333 environ for an ASGI HTTP scope whose request body has been read."""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'REMOTE_ADDR': client[0],
+        'REMOTE_PORT': str(client[1]),
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    for raw_name, raw_value in scope.get('headers', ()):
+        name = raw_name.decode('latin-1').upper().replace('-', '_')
+        value = raw_value.decode('latin-1')
+        if name in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            if name == 'CONTENT_TYPE':
+                environ[name] = value
+            continue
+        key = f"HTTP_{name}"
+        separator = '; ' if key == 'HTTP_COOKIE' else ','
+        environ[key] = f"{environ[key]}{separator}{value}" if key in environ else value
+    return environ
+
+
+def call_wsgi(wsgi_app, environ):
+    """Runs the WSGI app up to its first body chunk: (status, headers, first chunk, iterator, iterable)."""
+    started = {}
+
+    def start_response(status, headers, exc_info=None):
+        started['status'], started['headers'] = status, headers
+        return lambda data: None # write() is not used by Flask
+
+    iterable = wsgi_app(environ, start_response)
+    iterator = iter(iterable)
+    first = next(iterator, None)
+    return started['status'], started['headers'], first, iterator, iterable
+
+
+def call_wsgi_buffered(wsgi_app, environ):
+    """Like call_wsgi, but reads the whole (small) body and closes the response."""
+    status, headers, first, iterator, iterable = call_wsgi(wsgi_app, environ)
+    try:
+        body = (first or b'') + b''.join(iterator)
+    finally:
+        _close(iterable)
+    return status, headers, body, iter(()), None
+
+
+def _close(iterable):
+    close = getattr(iterable, 'close', None)
+    if close:
+        close()
+
+
+class AsgiFront:
+    """ASGI application that serves a WSGI app from bounded per-route thread pools."""
+
+    def __init__(self, wsgi_app, report_queue=None, pool_sizes=None, max_pending=64, max_body=1024 * 1024):
+        sizes = {'default': 8, 'diagnosis': 8, 'report': 2}
+        sizes.update(pool_sizes or {})
+        self.wsgi_app = wsgi_app
+        self.report_queue = report_queue
+        self.max_body = max_body
+        self.pools = {name: BoundedPool(name, threads, max_pending) for name, threads in sizes.items()}
+        REGISTRY.gauge_callback('asgi_in_flight', "Requests running or waiting per ASGI pool.",
+                                lambda: {name: pool.in_flight for name, pool in self.pools.items()}, 'pool')
+
+    def pool_for(self, path):
+        for name, prefixes in ROUTE_POOLS:
+            if path.startswith(prefixes):
+                return self.pools[name]
+        return self.pools['default']
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                for pool in self.pools.values():
+                    pool.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _read_body(self, receive):
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > self.max_body:
+                return False
+            chunks.append(chunk)
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    async def _simple_response(self, send, status, text, headers=()):
+        body = text.encode('utf-8')
+        await send({'type': 'http.response.start', 'status': status,
+                    'headers': [(b'content-type', b'text/plain; charset=utf-8'),
+                                (b'content-length', str(len(body)).encode())] + list(headers)})
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def _http(self, scope, receive, send):
+        pool = self.pool_for(scope['path'])
+        if not pool.try_acquire():
+            ASGI_REJECTED.inc(pool=pool.name)
+            await self._simple_response(send, 503, "Server busy, retry shortly.", [(b'retry-after', b'1')])
+            return
+        try:
+            body = await self._read_body(receive)
+            if body is None:
+                return # Client went away before sending the whole request
+            if body is False:
+                await self._simple_response(send, 413, "Request body too large.")
+                return
+            environ = build_environ(scope, body)
+            run = pool.runner()
+            long_poll = REPORT_STATUS_RE.match(scope['path'])
+            if long_poll and self.report_queue is not None:
+                await self._report_status(environ, long_poll.group(1), run, send)
+            else:
+                await self._respond(await run(call_wsgi, self.wsgi_app, environ), run, send)
+        finally:
+            pool.release()
+
+    async def _respond(self, result, run, send):
+        status, headers, first, iterator, iterable = result
+        try:
+            await send({'type': 'http.response.start', 'status': int(status.split(' ', 1)[0]),
+                        'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]})
+            chunk = first
+            while chunk is not None:
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                # Streamed bodies (exports, reports) are produced in the pool, one chunk at a time
+                chunk = await run(next, iterator, None)
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            await run(_close, iterable)
+
+    async def _report_status(self, environ, job_id, run, send):
+        # Ask Flask once without waiting (it checks the session and job owner), then wait for the
+        # job on the event loop and ask again, instead of holding a thread for the whole wait
+        query = parse_qsl(environ['QUERY_STRING'])
+        try:
+            wait = min(float(dict(query).get('wait', 0)), MAX_LONG_POLL)
+        except ValueError:
+            wait = 0.0
+        environ['QUERY_STRING'] = urlencode([(k, v) for k, v in query if k != 'wait'])
+        body = environ['wsgi.input'].getvalue()
+
+        result = await run(call_wsgi_buffered, self.wsgi_app, environ)
+        if wait > 0 and result[0].startswith('200') and self._job_pending(result[2]):
+            loop = asyncio.get_running_loop()
+            finished = loop.create_future()
+
+            def notify(_job):
+                try:
+                    loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(None))
+                except RuntimeError:
+                    pass # Event loop already closed
+
+            if self.report_queue.add_done_callback(job_id, notify):
+                try:
+                    await asyncio.wait_for(finished, wait)
+                except asyncio.TimeoutError:
+                    pass
+            else:
+                await self._poll_job(job_id, wait, run)
+            environ = dict(environ, **{'wsgi.input': io.BytesIO(body)})
+            result = await run(call_wsgi_buffered, self.wsgi_app, environ)
+        await self._respond(result, run, send)
+
+    async def _poll_job(self, job_id, wait, run):
+        # Queued by another worker process: re-read its shared state until it finishes
+        deadline = asyncio.get_running_loop().time() + wait
+        while True:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return
+            await asyncio.sleep(min(JOB_POLL_INTERVAL, remaining))
+            job = await run(self.report_queue.get, job_id)
+            if job is None or job.finished.is_set():
+                return
+
+    @staticmethod
+    def _job_pending(data):
+        try:
+            return json.loads(data).get('status') in ('queued', 'running')
+        except ValueError:
+            return False
+
+
+def create_asgi_app():
+    """Builds the ASGI front around the warmed-up Flask app (see wsgi.py)."""
+    from wsgi import application as flask_app
+    import app as web
+
+    front = AsgiFront(flask_app, report_queue=web.report_queue,
+                      pool_sizes={'default': int(os.environ.get('ASGI_DEFAULT_THREADS', 8)),
+                                  'diagnosis': int(os.environ.get('ASGI_DIAGNOSIS_THREADS', 8)),
+                                  'report': int(os.environ.get('ASGI_REPORT_THREADS', 2)),
+                                  'auth': int(os.environ.get('ASGI_AUTH_THREADS', 4))},
+                      max_pending=int(os.environ.get('ASGI_MAX_PENDING', 64)),
+                      max_body=int(os.environ.get('ASGI_MAX_BODY', 1024 * 1024)))
+    log_event(logger, logging.INFO, 'asgi.ready', pid=os.getpid(),
+              pools={name: pool.threads for name, pool in front.pools.items()}, max_pending=front.pools['default'].max_pending)
+    return front
+
+
+application = create_asgi_app()
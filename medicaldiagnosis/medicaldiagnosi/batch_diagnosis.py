@@ -0,0 +1,168 @@
+# batch_diagnosis.py
+# Vectorized (NumPy) scoring of many patients at once, for offline re-scoring of
+# history rows and population screening batches.
+#
+# CLI: python batch_diagnosis.py patients.csv|patients.jsonl|- [-o results.jsonl] [--top-k 3]
+#   CSV columns:  id (optional), symptoms, risk_factors  (items separated by ',' or ';')
+#   JSONL fields: id (optional), symptoms, risk_factors  (lists, or separated strings)
+# One JSON line per patient is streamed to the output as each chunk is scored.
+
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+from kb_artifact import load_compiled_knowledge_base
+from vocabulary import normalize_term
+
+DEFAULT_PROLOG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diagnosis.pl')
+DEFAULT_KB_ARTIFACT = os.environ.get('KB_ARTIFACT', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diagnosis.kb'))
+
+
+def _columns(terms, kind):
+    """Column of each term by its normalize_term() key; two terms with the same key would be merged, so they are refused."""
+    columns = {}
+    for column, term in enumerate(terms):
+        key = normalize_term(term)
+        if key in columns:
+            raise ValueError(f"{kind} {terms[columns[key]]!r} and {term!r} both normalize to {key!r}; rename one in diagnosis.pl")
+        columns[key] = column
+    return columns
+
+
+class BatchScorer:
+    """Disease x symptom weight matrix and disease x risk mask built from a compiled KnowledgeBase.
+
+    Scores match symptom_match/5 for answer-free requests up to float rounding: each
+    patient's symptoms and risk factors are treated as sets (bit-vectors).
+    """
+
+    def __init__(self, kb):
+        scored = [i for i, total in enumerate(kb.total_weights) if total > 0] # symptom_match/5 skips zero-weight diseases
+        self.diseases = [kb.diseases[i] for i in scored]
+        self.symptoms = sorted(kb.symptom_index)
+        self.risk_factors = sorted(kb.risk_index)
+        # Keyed by normalize_term() so form labels ('body ache') match their atoms (body_ache)
+        self.symptom_columns = _columns(self.symptoms, "Symptoms")
+        self.risk_columns = _columns(self.risk_factors, "Risk factors")
+        self.bonus_per_risk_factor = kb.bonus_per_risk_factor
+        self.max_risk_factor_bonus = kb.max_risk_factor_bonus
+
+        rows = {kb_index: row for row, kb_index in enumerate(scored)}
+        self.total_weights = np.array([kb.total_weights[i] for i in scored], dtype=float)
+        self.weights = np.zeros((len(self.diseases), len(self.symptoms)))
+        for symptom, hits in kb.symptom_index.items():
+            for kb_index, weight in hits:
+                if kb_index in rows:
+                    self.weights[rows[kb_index], self.symptom_columns[normalize_term(symptom)]] = weight
+        self.risk_mask = np.zeros((len(self.diseases), len(self.risk_factors)))
+        for factor, kb_indexes in kb.risk_index.items():
+            for kb_index in kb_indexes:
+                if kb_index in rows:
+                    self.risk_mask[rows[kb_index], self.risk_columns[normalize_term(factor)]] = 1.0
+
+    def encode(self, symptom_lists, risk_factor_lists):
+        """Turns N patients' symptom and risk factor lists into (N x S, N x F) bit matrices; unknown items are ignored."""
+        symptom_bits = np.zeros((len(symptom_lists), len(self.symptoms)))
+        risk_bits = np.zeros((len(risk_factor_lists), len(self.risk_factors)))
+        for i, symptoms in enumerate(symptom_lists):
+            columns = [self.symptom_columns[key] for key in map(normalize_term, symptoms) if key in self.symptom_columns]
+            symptom_bits[i, columns] = 1.0
+        for i, factors in enumerate(risk_factor_lists):
+            columns = [self.risk_columns[key] for key in map(normalize_term, factors) if key in self.risk_columns]
+            risk_bits[i, columns] = 1.0
+        return symptom_bits, risk_bits
+
+    def score(self, symptom_bits, risk_bits):
+        """Returns the N x D confidence matrix (0-100) for encoded patients."""
+        # Same operation order as symptom_match/5: (matched weight / total weight) * 100 + bonus
+        percent = ((symptom_bits @ self.weights.T) / self.total_weights) * 100
+        bonus = np.minimum((risk_bits @ self.risk_mask.T) * self.bonus_per_risk_factor, self.max_risk_factor_bonus)
+        return np.clip(percent + bonus, 0.0, 100.0)
+
+    def top_k(self, scores, k=3):
+        """Returns (indexes, scores) of the k best diseases per row; ties keep knowledge base order like the app's sort."""
+        k = min(k, scores.shape[1])
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :k]
+        return order, np.take_along_axis(scores, order, axis=1)
+
+    def diagnose(self, symptom_lists, risk_factor_lists, k=3):
+        """Scores a batch of patients and returns [[(disease, confidence), ...] per patient] best first."""
+        order, top_scores = self.top_k(self.score(*self.encode(symptom_lists, risk_factor_lists)), k)
+        return [[(self.diseases[j], float(c)) for j, c in zip(row_order, row_scores)]
+                for row_order, row_scores in zip(order, top_scores)]
+
+
+# --- CLI: stream patients from CSV/JSONL and write JSONL results ---
+def _split_items(value):
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in re.split(r"[,;]", str(value)) if item.strip()]
+
+
+def read_patients(stream, input_format):
+    """Yields (id, symptoms, risk_factors) for each patient record."""
+    if input_format == 'csv':
+        for line_no, row in enumerate(csv.DictReader(stream), start=1):
+            yield row.get('id') or line_no, _split_items(row.get('symptoms')), _split_items(row.get('risk_factors'))
+    else:
+        for line_no, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            yield record.get('id', line_no), _split_items(record.get('symptoms')), _split_items(record.get('risk_factors'))
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Score patients in bulk against the diagnosis knowledge base.")
+    parser.add_argument('input', help="CSV or JSONL file of patients, or '-' for stdin")
+    parser.add_argument('-o', '--output', default='-', help="JSONL output file (default: stdout)")
+    parser.add_argument('--format', choices=('csv', 'jsonl'), help="Input format (default: from the file extension)")
+    parser.add_argument('--top-k', type=int, default=3)
+    parser.add_argument('--chunk-size', type=int, default=4096, help="Patients scored per matrix multiply")
+    parser.add_argument('--kb', default=DEFAULT_PROLOG_FILE, help="Path to diagnosis.pl")
+    parser.add_argument('--artifact', default=DEFAULT_KB_ARTIFACT, help="Compiled knowledge base used when it matches --kb")
+    args = parser.parse_args(argv)
+
+    input_format = args.format or ('csv' if args.input.lower().endswith('.csv') else 'jsonl')
+    scorer = BatchScorer(load_compiled_knowledge_base(args.kb, args.artifact))
+
+    in_stream = sys.stdin if args.input == '-' else open(args.input, newline='', encoding='utf-8')
+    out_stream = sys.stdout if args.output == '-' else open(args.output, 'w', encoding='utf-8')
+    count = 0
+    try:
+        for chunk in _chunks(read_patients(in_stream, input_format), args.chunk_size):
+            ids, symptom_lists, risk_lists = zip(*chunk)
+            for patient_id, ranked in zip(ids, scorer.diagnose(symptom_lists, risk_lists, args.top_k)):
+                out_stream.write(json.dumps({'id': patient_id,
+                                             'results': [{'disease': d, 'confidence': round(c, 4)} for d, c in ranked]}) + "\n")
+            out_stream.flush()
+            count += len(chunk)
+    finally:
+        if in_stream is not sys.stdin:
+            in_stream.close()
+        if out_stream is not sys.stdout:
+            out_stream.close()
+    print(f"Scored {count} patients.", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+# benchmarks/bench_asgi.py
+# Concurrent-client throughput of the WSGI mode (gunicorn gthread: one thread pool runs every
+# request) against the ASGI front in asgi.py (per-route bounded pools, long-polls held on the
+# event loop), driven in-process so no server or network is involved.
+#
+# Two kinds of clients run at once for --duration seconds:
+#   - API clients posting /api/v1/diagnose with random symptoms, back to back;
+#   - report pollers that queue a slow report job (--report-seconds, standing in for a slow
+#     PDF write or a locked database) and long-poll /report/status/<id>?wait=N until it is done.
+# Under WSGI each long-poll holds a request thread; under ASGI it holds none.
+#
+# Usage: python benchmarks/bench_asgi.py [--clients 32] [--pollers 16] [--duration 5]
+#            [--threads N] [--report-seconds 1.0] [--wait 5] [--json results.json]
+#
+# The app runs from a temporary copy of this directory, so the real database is untouched.
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlencode
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_TOKEN = 'bench-token'
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(pct / 100 * len(sorted_values)))]
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.api_latencies = []
+        self.reports_done = 0
+        self.polls = 0
+        self.rejected = 0
+        self.errors = 0
+
+    def record_api(self, status, seconds):
+        with self.lock:
+            if status == 200:
+                self.api_latencies.append(seconds)
+            elif status == 503:
+                self.rejected += 1
+            else:
+                self.errors += 1
+
+    def summary(self, wall_seconds):
+        latencies = sorted(self.api_latencies)
+        return {
+            'api_requests': len(latencies),
+            'api_rps': round(len(latencies) / wall_seconds, 1),
+            'api_p50_ms': round(percentile(latencies, 50) * 1000, 2),
+            'api_p95_ms': round(percentile(latencies, 95) * 1000, 2),
+            'api_p99_ms': round(percentile(latencies, 99) * 1000, 2),
+            'reports_done': self.reports_done,
+            'status_polls': self.polls,
+            'rejected_503': self.rejected,
+            'errors': self.errors,
+        }
+
+
+def http_scope(method, path, query='', headers=()):
+    return {'type': 'http', 'http_version': '1.1', 'method': method, 'scheme': 'http', 'path': path,
+            'root_path': '', 'query_string': query.encode('latin-1'), 'server': ('bench', 80), 'client': ('127.0.0.1', 0),
+            'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers]}
+
+
+class Workload:
+    """Builds the requests both modes send: API diagnoses and report status long-polls."""
+
+    def __init__(self, web, args):
+        self.web = web
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.session_cookie, self.user_id = self._login()
+
+    def _login(self):
+        client = self.web.app.test_client()
+        client.post('/register', data={'name': 'Bench', 'email': 'bench@example.com', 'password': 'bench', 'confirm_password': 'bench'})
+        response = client.post('/login', data={'email': 'bench@example.com', 'password': 'bench'})
+        cookie = next(h.split(';', 1)[0] for h in response.headers.getlist('Set-Cookie') if h.startswith('session='))
+        with self.web.app.app_context():
+            user_id = self.web.get_db().execute("SELECT id FROM users WHERE email = 'bench@example.com'").fetchone()[0]
+        return cookie, user_id
+
+    def api_request(self):
+        symptoms = self.rng.sample(self.web.all_symptoms_for_vars, self.rng.randint(2, 5))
+        body = json.dumps({'symptoms': symptoms}).encode('utf-8')
+        headers = (('Authorization', f"Bearer {API_TOKEN}"), ('Content-Type', 'application/json'), ('Content-Length', str(len(body))))
+        return http_scope('POST', '/api/v1/diagnose', headers=headers), body
+
+    def start_report(self):
+        seconds = self.args.report_seconds
+
+        def slow_report():
+            time.sleep(seconds)
+            return 'bench.pdf'
+        return self.web.report_queue.submit(slow_report, user_id=self.user_id)
+
+    def status_request(self, job_id):
+        query = urlencode({'wait': self.args.wait})
+        return http_scope('GET', f"/report/status/{job_id}", query, headers=(('Cookie', self.session_cookie),)), b''
+
+
+# --- WSGI mode: every request goes through one fixed thread pool, like a gthread worker ---
+def run_wsgi(workload, flask_app, args, threads):
+    from asgi import build_environ, call_wsgi_buffered
+
+    results = Results()
+    pool = ThreadPoolExecutor(max_workers=threads)
+    deadline = time.perf_counter() + args.duration
+
+    def call(scope, body):
+        environ = build_environ(scope, body)
+        status, _headers, data, _iterator, _iterable = pool.submit(call_wsgi_buffered, flask_app, environ).result()
+        return int(status.split(' ', 1)[0]), data
+
+    def api_client():
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            status, _data = call(*workload.api_request())
+            results.record_api(status, time.perf_counter() - started)
+
+    def poller():
+        while time.perf_counter() < deadline:
+            job_id = workload.start_report()
+            while time.perf_counter() < deadline:
+                status, data = call(*workload.status_request(job_id))
+                with results.lock:
+                    results.polls += 1
+                if status == 200 and json.loads(data)['status'] in ('done', 'failed'):
+                    with results.lock:
+                        results.reports_done += 1
+                    break
+
+    clients = [threading.Thread(target=api_client) for _ in range(args.clients)]
+    clients += [threading.Thread(target=poller) for _ in range(args.pollers)]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    wall_seconds = time.perf_counter() - started
+    pool.shutdown(wait=True)
+    return results.summary(wall_seconds)
+
+
+# --- ASGI mode: the asgi.py front on an event loop ---
+async def asgi_call(front, scope, body):
+    messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    response = {'status': None, 'body': []}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait() # Nothing more to send; the front never reads past the body
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        else:
+            response['body'].append(message.get('body', b''))
+
+    await front(scope, receive, send)
+    return response['status'], b''.join(response['body'])
+
+
+async def run_asgi_clients(workload, front, args):
+    results = Results()
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + args.duration
+
+    async def api_client():
+        while loop.time() < deadline:
+            started = time.perf_counter()
+            status, _data = await asgi_call(front, *workload.api_request())
+            results.record_api(status, time.perf_counter() - started)
+            if status == 503:
+                await asyncio.sleep(0.01) # Back off like a client honouring Retry-After (scaled down)
+
+    async def poller():
+        while loop.time() < deadline:
+            job_id = workload.start_report()
+            while loop.time() < deadline:
+                status, data = await asgi_call(front, *workload.status_request(job_id))
+                results.polls += 1
+                if status == 200 and json.loads(data)['status'] in ('done', 'failed'):
+                    results.reports_done += 1
+                    break
+
+    started = time.perf_counter()
+    await asyncio.gather(*[api_client() for _ in range(args.clients)], *[poller() for _ in range(args.pollers)])
+    return results.summary(time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare concurrent-client throughput of the WSGI and ASGI serving modes.")
+    parser.add_argument('--clients', type=int, default=32, help="Concurrent API clients")
+    parser.add_argument('--pollers', type=int, default=16, help="Concurrent report long-pollers")
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds per mode")
+    parser.add_argument('--threads', type=int, help="WSGI request threads (default: all ASGI pool threads combined)")
+    parser.add_argument('--report-seconds', type=float, default=1.0, help="Duration of each simulated slow report job")
+    parser.add_argument('--wait', type=float, default=5.0, help="Long-poll wait per status request, seconds")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="Write the results to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_copy = os.path.join(tmp, 'app')
+        shutil.copytree(APP_DIR, app_copy, ignore=shutil.ignore_patterns('diagnosis_reports', '__pycache__', 'benchmarks', 'instance'))
+        os.chdir(app_copy)
+        sys.path.insert(0, app_copy)
+        os.environ.update({'API_TOKENS': API_TOKEN, 'REPORT_WORKERS': str(max(2, args.pollers)),
+                           'DIAGNOSIS_CACHE_SIZE': '1', # Score every request instead of measuring cache hits
+                           'PASSWORD_PBKDF2_ITERATIONS': '1000', # Password hashing is measured by bench_auth.py
+                           'LOG_LEVEL': 'WARNING'})
+        import asgi
+        import app as web
+
+        front = asgi.application
+        threads = args.threads or sum(pool.threads for pool in front.pools.values())
+        workload = Workload(web, args)
+
+        wsgi_summary = run_wsgi(workload, web.app, args, threads)
+        web.report_queue._queue.join() # Let leftover report jobs finish before the next mode
+        asgi_summary = asyncio.run(run_asgi_clients(workload, front, args))
+        web.report_queue._queue.join()
+
+    pools = ', '.join(f"{name} {pool.threads}" for name, pool in front.pools.items())
+    print(f"{args.clients} API clients + {args.pollers} report long-pollers, {args.duration:.0f} s per mode, "
+          f"reports take {args.report_seconds} s, long-poll wait {args.wait} s")
+    print(f"WSGI: {threads} request threads.  ASGI: pools {pools}, {front.pools['default'].max_pending} pending each\n")
+    columns = ('api_requests', 'api_rps', 'api_p50_ms', 'api_p95_ms', 'api_p99_ms', 'reports_done', 'status_polls', 'rejected_503', 'errors')
+    print(f"{'mode':<6}" + ''.join(f"{column:>14}" for column in columns))
+    for mode, summary in (('wsgi', wsgi_summary), ('asgi', asgi_summary)):
+        print(f"{mode:<6}" + ''.join(f"{summary[column]:>14}" for column in columns))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'wsgi_threads': threads, 'wsgi': wsgi_summary, 'asgi': asgi_summary}, f, indent=2)
+    return 1 if wsgi_summary['errors'] or asgi_summary['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
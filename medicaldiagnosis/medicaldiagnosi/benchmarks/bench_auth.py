@@ -0,0 +1,153 @@
+# benchmarks/bench_auth.py
+# Login cost under load: concurrent /login clients next to API clients posting
+# /api/v1/diagnose, at each password hashing cost given, plus a run with no logins as the
+# baseline for the diagnosis traffic. Reports login throughput and latency, logins turned away
+# with 429 by the KDF executor limits, and what the logins cost the diagnosis requests.
+#
+# Usage: python benchmarks/bench_auth.py [--iterations 100000,300000,600000] [--logins 8]
+#            [--clients 4] [--duration 5] [--json results.json]
+#
+# The app runs from a temporary copy of this directory, so the real database is untouched.
+
+import argparse
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+API_TOKEN = 'bench-token'
+PASSWORD = 'bench-password'
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(pct / 100 * len(sorted_values)))]
+
+
+class Results:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.login_latencies = []
+        self.api_latencies = []
+        self.busy = 0
+        self.errors = 0
+
+    def record(self, latencies, ok, status, seconds):
+        with self.lock:
+            if ok:
+                latencies.append(seconds)
+            elif status == 429:
+                self.busy += 1
+            else:
+                self.errors += 1
+
+    def summary(self, wall_seconds):
+        logins, api = sorted(self.login_latencies), sorted(self.api_latencies)
+        return {
+            'logins': len(logins),
+            'login_per_s': round(len(logins) / wall_seconds, 2),
+            'login_p50_ms': round(percentile(logins, 50) * 1000, 1),
+            'login_p95_ms': round(percentile(logins, 95) * 1000, 1),
+            'busy_429': self.busy,
+            'api_rps': round(len(api) / wall_seconds, 1),
+            'api_p95_ms': round(percentile(api, 95) * 1000, 2),
+            'errors': self.errors,
+        }
+
+
+def create_users(web, count, iterations):
+    """Stores `count` users whose hashes use `iterations`; returns their emails."""
+    emails = [f"auth{iterations}_{n}@example.com" for n in range(count)]
+    with web.app.app_context():
+        db = web.get_db()
+        db.executemany("INSERT INTO users (name, email, password_hash) VALUES (?, ?, ?)",
+                       [(f"Auth {n}", email, web.password_hashers.hash(PASSWORD)) for n, email in enumerate(emails)])
+        db.commit()
+    return emails
+
+
+def run(web, emails, args):
+    results = Results()
+    deadline = time.perf_counter() + args.duration
+    rng = random.Random(args.seed)
+
+    def login_client(n, email):
+        # One client address and one account per login client, as separate users would be
+        client = web.app.test_client()
+        client.environ_base['REMOTE_ADDR'] = f"10.0.{n // 250}.{n % 250 + 1}"
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = client.post('/login', data={'email': email, 'password': PASSWORD})
+            ok = response.status_code == 302 and '/login' not in response.headers.get('Location', '')
+            results.record(results.login_latencies, ok, response.status_code, time.perf_counter() - started)
+            client.get('/logout')
+            if response.status_code == 429:
+                time.sleep(0.05) # Back off like a client honouring Retry-After (scaled down)
+
+    def api_client(seed):
+        client = web.app.test_client()
+        local_rng = random.Random(seed)
+        headers = {'Authorization': f"Bearer {API_TOKEN}"}
+        while time.perf_counter() < deadline:
+            symptoms = local_rng.sample(web.all_symptoms_for_vars, local_rng.randint(2, 5))
+            started = time.perf_counter()
+            response = client.post('/api/v1/diagnose', json={'symptoms': symptoms}, headers=headers)
+            results.record(results.api_latencies, response.status_code == 200, response.status_code, time.perf_counter() - started)
+
+    clients = [threading.Thread(target=login_client, args=(n, email)) for n, email in enumerate(emails)]
+    clients += [threading.Thread(target=api_client, args=(rng.random(),)) for _ in range(args.clients)]
+    started = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    return results.summary(time.perf_counter() - started)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure login throughput and latency at several password hashing costs.")
+    parser.add_argument('--iterations', default='100000,300000,600000', help="Comma-separated PBKDF2 iteration counts to compare")
+    parser.add_argument('--logins', type=int, default=8, help="Concurrent login clients (one account each)")
+    parser.add_argument('--clients', type=int, default=4, help="Concurrent API diagnosis clients")
+    parser.add_argument('--duration', type=float, default=5.0, help="Seconds per run")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="Write the results to this file")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_copy = os.path.join(tmp, 'app')
+        shutil.copytree(APP_DIR, app_copy, ignore=shutil.ignore_patterns('diagnosis_reports', '__pycache__', 'benchmarks', 'instance'))
+        os.chdir(app_copy)
+        sys.path.insert(0, app_copy)
+        os.environ.update({'API_TOKENS': API_TOKEN, 'LOG_LEVEL': 'WARNING',
+                           'DIAGNOSIS_CACHE_SIZE': '1'}) # Score every request instead of measuring cache hits
+        import app as web
+        from password_hashing import PasswordHashers, PBKDF2Hasher
+
+        runs = {'no logins': run(web, [], args)}
+        for iterations in (int(value) for value in args.iterations.split(',')):
+            web.password_hashers = PasswordHashers(PBKDF2Hasher(iterations=iterations))
+            runs[f"pbkdf2 {iterations}"] = run(web, create_users(web, args.logins, iterations), args)
+
+    executor = web.kdf_executor
+    print(f"{args.logins} login clients + {args.clients} API clients, {args.duration:.0f} s per run; "
+          f"KDF executor: {executor.threads} threads, {executor.limit} admitted, per key {executor.per_key}\n")
+    columns = ('logins', 'login_per_s', 'login_p50_ms', 'login_p95_ms', 'busy_429', 'api_rps', 'api_p95_ms', 'errors')
+    print(f"{'run':<16}" + ''.join(f"{column:>14}" for column in columns))
+    for name, summary in runs.items():
+        print(f"{name:<16}" + ''.join(f"{summary[column]:>14}" for column in columns))
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({'args': vars(args), 'runs': runs}, f, indent=2)
+    return 1 if any(summary['errors'] for summary in runs.values()) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,274 @@
+# benchmarks/bench_flow.py
+# End-to-end latency benchmark of the diagnosis flow through the real Flask app (test client):
+#   register -> login -> complete profile -> (diagnose -> follow-up -> results -> report)* -> history -> statistics
+# Synthetic users pick symptoms from symptom_categories and risk factors from unique_risk_factors.
+#
+# Reports per-endpoint throughput and p50/p95/p99 latency, and where the time went
+# (diagnosis engine, SQLite, FPDF, matplotlib). For release gating, save a baseline once and
+# compare later runs against it; the exit code is 1 when any endpoint's p95 regresses.
+#
+# Usage: python benchmarks/bench_flow.py [--users 50] [--diagnoses 3] [--seed 1]
+#            [--json results.json] [--save-baseline baseline.json | --baseline baseline.json [--tolerance 0.25] [--slack-ms 2]]
+#
+# The app runs from a temporary copy of this directory, so the real database is untouched.
+
+import argparse
+import functools
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# --- Time accounting ---
+class Breakdown:
+    """Thread-safe accumulated seconds and call counts per component."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+
+    def add(self, component, seconds):
+        with self._lock:
+            self.seconds[component] += seconds
+            self.calls[component] += 1
+
+    def timed(self, component, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                self.add(component, time.perf_counter() - started)
+        return wrapper
+
+
+BREAKDOWN = Breakdown()
+
+
+class TimedCursor(sqlite3.Cursor):
+    def execute(self, *args):
+        return BREAKDOWN.timed('sqlite', super().execute)(*args)
+
+    def executemany(self, *args):
+        return BREAKDOWN.timed('sqlite', super().executemany)(*args)
+
+    def executescript(self, *args):
+        return BREAKDOWN.timed('sqlite', super().executescript)(*args)
+
+    def fetchone(self):
+        return BREAKDOWN.timed('sqlite', super().fetchone)()
+
+    def fetchmany(self, *args):
+        return BREAKDOWN.timed('sqlite', super().fetchmany)(*args)
+
+    def fetchall(self):
+        return BREAKDOWN.timed('sqlite', super().fetchall)()
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, *args):
+        return self.cursor().execute(*args)
+
+    def commit(self):
+        return BREAKDOWN.timed('sqlite', super().commit)()
+
+    def rollback(self):
+        return BREAKDOWN.timed('sqlite', super().rollback)()
+
+
+def load_instrumented_app(app_copy):
+    """Imports the app from app_copy with timing hooks around the components we break time down by."""
+    os.chdir(app_copy)
+    sys.path.insert(0, app_copy)
+    sqlite3.connect = functools.partial(sqlite3.connect, factory=TimedConnection)
+    import app as web
+    import diagnosis_stats
+
+    web.app.config['TESTING'] = True
+    web.db_pool.close() # Reopen the import-time connection with the timed factory
+    web._diagnosis_bundle_uncached = BREAKDOWN.timed('engine', web._diagnosis_bundle_uncached)
+    web.report_renderer.render = BREAKDOWN.timed('fpdf', web.report_renderer.render)
+    diagnosis_stats.render_distribution_chart = BREAKDOWN.timed('matplotlib', diagnosis_stats.render_distribution_chart)
+    return web
+
+
+# --- Synthetic traffic ---
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+class FlowRunner:
+    def __init__(self, web, rng):
+        self.web = web
+        self.rng = rng
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.recording = True
+
+    def call(self, label, method, url, expect=(200, 302), **kwargs):
+        started = time.perf_counter()
+        response = self.client.open(url, method=method, **kwargs)
+        response.get_data() # Drain streamed bodies inside the timing
+        elapsed = time.perf_counter() - started
+        if self.recording:
+            self.latencies[label].append(elapsed)
+            if response.status_code not in expect:
+                self.errors[label] += 1
+        return response
+
+    def follow_up_questions(self):
+        with self.client.session_transaction() as cookie_session:
+            state_id = cookie_session.get('diagnosis_state_id')
+            user_id = cookie_session.get('user_id')
+        with self.web.app.app_context():
+            state = self.web.diagnosis_states.load(state_id, user_id) or {}
+        return state.get('follow_up_questions') or []
+
+    def run_user(self, n, diagnoses):
+        self.client = self.web.app.test_client()
+        email = f"bench{n}_{self.rng.randrange(1 << 30)}@example.com"
+        self.call('POST /register', 'POST', '/register',
+                  data=dict(name=f"Bench User {n}", email=email, password='bench-pass', confirm_password='bench-pass'))
+        self.call('POST /login', 'POST', '/login', data=dict(email=email, password='bench-pass'))
+        conditions = self.rng.choice(['none', 'normal', 'asthma', 'diabetes, hypertension'])
+        self.call('POST /profile/complete', 'POST', '/profile/complete',
+                  data=dict(age=str(self.rng.randint(18, 90)), weight=str(self.rng.randint(45, 120)), medical_conditions=conditions))
+        for _ in range(diagnoses):
+            symptoms = self.rng.sample(self.web.all_symptoms_for_vars, self.rng.randint(1, 5))
+            risk_factors = self.rng.sample(self.web.unique_risk_factors, self.rng.randint(0, 2))
+            response = self.call('POST /diagnose', 'POST', '/diagnose', data={'symptoms': symptoms, 'risk_factors': risk_factors})
+            # Adaptive follow-up mode asks one question per page, so keep answering until the results
+            while response.status_code == 302 and response.location.endswith('/diagnose/followup'):
+                questions = self.follow_up_questions()
+                response = self.call('POST /diagnose/followup', 'POST', '/diagnose/followup',
+                                     data={q: self.rng.choice(['yes', 'no']) for q in questions})
+            self.call('GET /diagnose/results', 'GET', '/diagnose/results')
+            self.call('POST /report/generate', 'POST', '/report/generate')
+        self.call('GET /history', 'GET', '/history')
+        self.call('GET /statistics', 'GET', '/statistics')
+        self.call('GET /api/statistics', 'GET', '/api/statistics')
+        self.call('GET /statistics/chart.png', 'GET', '/statistics/chart.png', expect=(200, 404))
+
+
+def summarize(latencies, wall_seconds):
+    summary = {}
+    for label, values in latencies.items():
+        values = sorted(values)
+        summary[label] = {
+            'count': len(values),
+            'rps': round(len(values) / wall_seconds, 2) if wall_seconds else 0.0,
+            'mean_ms': round(1000 * sum(values) / len(values), 3),
+            'p50_ms': round(1000 * percentile(values, 50), 3),
+            'p95_ms': round(1000 * percentile(values, 95), 3),
+            'p99_ms': round(1000 * percentile(values, 99), 3),
+        }
+    return summary
+
+
+def compare_to_baseline(summary, baseline, tolerance, slack_ms=1.0):
+    """Returns [(endpoint, baseline_p95, current_p95)] for endpoints slower than baseline * (1 + tolerance) + slack."""
+    regressions = []
+    for label, stats in summary.items():
+        base = baseline.get('endpoints', {}).get(label)
+        if base and stats['p95_ms'] > base['p95_ms'] * (1 + tolerance) + slack_ms:
+            regressions.append((label, base['p95_ms'], stats['p95_ms']))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the full diagnosis flow through the Flask app.")
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--diagnoses', type=int, default=3, help="Diagnoses per user")
+    parser.add_argument('--warmup-users', type=int, default=3, help="Users run before measuring")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--json', help="Write the results to this file")
+    parser.add_argument('--save-baseline', help="Write the results as a baseline for later runs")
+    parser.add_argument('--baseline', help="Fail (exit 1) if any endpoint's p95 regresses against this baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed p95 slowdown as a fraction (default 0.25)")
+    parser.add_argument('--slack-ms', type=float, default=2.0, help="Absolute p95 slowdown always allowed, for sub-millisecond endpoints")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_copy = os.path.join(tmp, 'app')
+        shutil.copytree(APP_DIR, app_copy, ignore=shutil.ignore_patterns('diagnosis_reports', '__pycache__', 'benchmarks', 'instance'))
+        web = load_instrumented_app(app_copy)
+        runner = FlowRunner(web, random.Random(args.seed))
+
+        runner.recording = False
+        for n in range(args.warmup_users):
+            runner.run_user(-1 - n, args.diagnoses)
+        web.report_queue._queue.join()
+        BREAKDOWN.seconds.clear()
+        BREAKDOWN.calls.clear()
+
+        runner.recording = True
+        started = time.perf_counter()
+        for n in range(args.users):
+            runner.run_user(n, args.diagnoses)
+        wall_seconds = time.perf_counter() - started
+        web.report_queue._queue.join() # Reports are rendered by background workers; let them finish
+        drained_seconds = time.perf_counter() - started
+        report_stats = web.report_queue.stats()
+
+    summary = summarize(runner.latencies, wall_seconds)
+    request_seconds = sum(sum(values) for values in runner.latencies.values())
+    print(f"{args.users} users x {args.diagnoses} diagnoses, {sum(s['count'] for s in summary.values())} requests "
+          f"in {wall_seconds:.2f} s (report queue drained after {drained_seconds:.2f} s)\n")
+    print(f"{'endpoint':<28}{'count':>7}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}")
+    for label, stats in summary.items():
+        print(f"{label:<28}{stats['count']:>7}{stats['rps']:>9.1f}{stats['p50_ms']:>9.2f}"
+              f"{stats['p95_ms']:>9.2f}{stats['p99_ms']:>9.2f}{runner.errors[label]:>8}")
+
+    print(f"\nTime breakdown (request time {request_seconds:.3f} s; FPDF runs on report workers, outside requests):")
+    names = {'engine': "Diagnosis engine (knowledge base/Prolog)", 'sqlite': "SQLite", 'fpdf': "FPDF", 'matplotlib': "matplotlib"}
+    for component in ('engine', 'sqlite', 'fpdf', 'matplotlib'):
+        seconds = BREAKDOWN.seconds.get(component, 0.0)
+        share = f"{100 * seconds / request_seconds:5.1f}%" if request_seconds and component != 'fpdf' else "     -"
+        print(f"  {names[component]:<42}{seconds:9.3f} s {share}  ({BREAKDOWN.calls.get(component, 0)} calls)")
+    print(f"  Report jobs (incl. warm-up): {report_stats['succeeded']} done, {report_stats['failed']} failed, "
+          f"avg {report_stats['avg_duration_seconds']} s, p95 {report_stats['p95_duration_seconds']} s")
+
+    results = {
+        'users': args.users, 'diagnoses_per_user': args.diagnoses, 'seed': args.seed,
+        'wall_seconds': round(wall_seconds, 3),
+        'endpoints': summary,
+        'errors': dict(runner.errors),
+        'breakdown_seconds': {k: round(v, 4) for k, v in BREAKDOWN.seconds.items()},
+        'report_jobs': report_stats,
+    }
+    for path in filter(None, (args.json, args.save_baseline)):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    status = 1 if any(runner.errors.values()) else 0
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            regressions = compare_to_baseline(summary, json.load(f), args.tolerance, args.slack_ms)
+        for label, base_p95, p95 in regressions:
+            print(f"REGRESSION {label}: p95 {base_p95:.2f} ms -> {p95:.2f} ms")
+        if regressions:
+            status = 1
+        else:
+            print(f"\nNo p95 regressions beyond {args.tolerance:.0%} of {args.baseline}.")
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+# benchmarks/bench_kb_load.py
+# Worker cold start of the knowledge base: compiling diagnosis.pl from source against loading
+# the diagnosis.kb artifact built by kb_artifact.py, each in a fresh interpreter. With
+# SWI-Prolog and pyswip installed it also compares consulting diagnosis.pl with diagnosis.qlf.
+#
+# Usage: python benchmarks/bench_kb_load.py [--runs N] [--app]
+#   --app also times the whole `import app` with and without the artifact.
+#
+# Each run uses a throwaway copy of the app directory so the real database is untouched.
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, os, resource, sys, time
+mode = sys.argv[1]
+if mode in ('source', 'artifact'):
+    # Both loaders' modules are imported first: a worker has them loaded anyway
+    from kb_artifact import load_artifact
+    from knowledge_base import load_knowledge_base, read_source
+started = time.perf_counter()
+if mode == 'source':
+    load_knowledge_base('diagnosis.pl')
+elif mode == 'artifact':
+    load_artifact('diagnosis.kb', read_source('diagnosis.pl')[1])
+elif mode in ('prolog-source', 'prolog-qlf'):
+    from pyswip import Prolog
+    prolog = Prolog()
+    started = time.perf_counter() # Time the consult, not the embedded engine start
+    list(prolog.query("consult('diagnosis.pl')" if mode == 'prolog-source' else "consult('diagnosis.qlf')"))
+else:
+    os.environ['KB_ARTIFACT'] = 'diagnosis.kb' if mode == 'app-artifact' else 'missing.kb'
+    import app
+elapsed = time.perf_counter() - started
+print(json.dumps({'seconds': elapsed, 'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+LABELS = {
+    'source': "parse diagnosis.pl",
+    'artifact': "load diagnosis.kb",
+    'prolog-source': "consult diagnosis.pl",
+    'prolog-qlf': "consult diagnosis.qlf",
+    'app-source': "import app (source)",
+    'app-artifact': "import app (artifact)",
+}
+
+
+def pyswip_available():
+    try:
+        import pyswip # noqa: F401
+    except Exception: # ImportError, or pyswip failing to locate libswipl
+        return False
+    return True
+
+
+def run_probe(app_copy, mode):
+    out = subprocess.run([sys.executable, '-W', 'ignore', '-c', PROBE, mode], cwd=app_copy,
+                         capture_output=True, text=True, check=True,
+                         env=dict(os.environ, LOG_LEVEL='WARNING'))
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare knowledge base cold start from source and from the compiled artifact.")
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--app', action='store_true', help="Also time `import app` with and without the artifact")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_copy = os.path.join(tmp, 'app')
+        shutil.copytree(APP_DIR, app_copy, ignore=shutil.ignore_patterns('diagnosis_reports', '__pycache__', 'benchmarks',
+                                                                          'instance', 'diagnosis.kb', 'diagnosis.qlf'))
+        build = [sys.executable, 'kb_artifact.py']
+        modes = ['source', 'artifact']
+        if shutil.which('swipl') and pyswip_available():
+            build.append('--qlf')
+            modes += ['prolog-source', 'prolog-qlf']
+        else:
+            print("pyswip/SWI-Prolog not installed: skipping the .qlf comparison")
+        subprocess.run(build, cwd=app_copy, check=True, capture_output=True)
+        if args.app:
+            modes += ['app-source', 'app-artifact']
+
+        run_probe(app_copy, 'source') # Warm the OS file cache and compile bytecode once
+        for mode in modes:
+            results = [run_probe(app_copy, mode) for _ in range(args.runs)]
+            seconds = statistics.median(r['seconds'] for r in results)
+            rss = statistics.median(r['max_rss_mb'] for r in results)
+            print(f"{LABELS[mode]:<24} {seconds * 1000:9.2f} ms   peak RSS {rss:7.1f} MB")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,74 @@
+# benchmarks/bench_questions.py
+# Follow-up questions asked per diagnosis under each FOLLOW_UP_MODE, for random symptom sets
+# from the diagnosis form and simulated yes/no answers.
+#
+# Usage: python benchmarks/bench_questions.py [--cases 2000] [--seed 7]
+
+import argparse
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from knowledge_base import load_knowledge_base
+from question_planner import QuestionPlanner
+
+KB_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'diagnosis.pl')
+
+
+def leader(kb, symptoms, answers):
+    ranked = kb.diagnosis_bundle(symptoms, [], answers, 0)['ranked']
+    return ranked[0][0] if ranked else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare follow-up question counts across planner modes.")
+    parser.add_argument('--cases', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=7)
+    args = parser.parse_args(argv)
+
+    kb = load_knowledge_base(KB_FILE)
+    planner = QuestionPlanner(kb, top_k=3)
+    rng = random.Random(args.seed)
+    symptoms_pool = sorted(kb.symptom_index)
+    totals = {mode: {'questions': 0, 'pages': 0, 'same_leader': 0} for mode in ('all', 'planned', 'adaptive')}
+
+    for _ in range(args.cases):
+        symptoms = rng.sample(symptoms_pool, rng.randint(1, 4))
+        truth = {} # The simulated patient answers each question the same way in every mode
+        answer = lambda q: truth.setdefault(q, rng.choice(('yes', 'no')))
+
+        all_questions = kb.diagnosis_bundle(symptoms, [], [], 3)['follow_up_questions']
+        all_answers = [(q, answer(q)) for q in all_questions]
+        reference = leader(kb, symptoms, all_answers)
+        totals['all']['questions'] += len(all_questions)
+        totals['all']['pages'] += 1 if all_questions else 0
+        totals['all']['same_leader'] += 1
+
+        planned = planner.plan(symptoms, []).questions
+        totals['planned']['questions'] += len(planned)
+        totals['planned']['pages'] += 1 if planned else 0
+        totals['planned']['same_leader'] += leader(kb, symptoms, [(q, answer(q)) for q in planned]) == reference
+
+        answers, asked = [], []
+        while True:
+            question = planner.plan(symptoms, [], answers, asked).next_question()
+            if question is None:
+                break
+            asked.append(question)
+            answers.append((question, answer(question)))
+        totals['adaptive']['questions'] += len(asked)
+        totals['adaptive']['pages'] += len(asked)
+        totals['adaptive']['same_leader'] += leader(kb, symptoms, answers) == reference
+
+    print(f"{args.cases} random symptom sets\n")
+    print(f"{'mode':<10}{'questions/diagnosis':>21}{'follow-up pages':>17}{'same leader as all':>20}")
+    for mode, total in totals.items():
+        print(f"{mode:<10}{total['questions'] / args.cases:>21.2f}{total['pages'] / args.cases:>17.2f}"
+              f"{100 * total['same_leader'] / args.cases:>19.1f}%")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# benchmarks/bench_reports.py
+# Reports per second: the original generate_pdf_report() layout (built from scratch and
+# written to disk) versus ReportRenderer, in memory and with on-disk archival.
+#
+# Usage: python benchmarks/bench_reports.py [--reports N]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+import warnings
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fpdf import FPDF
+from report_renderer import ReportRenderer
+
+USER = {'name': "Benchmark Patient", 'age': 42, 'weight': 70, 'medical_conditions': "asthma, hypertension"}
+DIAGNOSIS = {
+    'symptoms': ["fever", "cough", "shortness of breath", "fatigue"],
+    'disease': "covid19",
+    'confidence': 87.5,
+    'test': "pcr_test",
+    'treatment': ['isolation', 'rest', 'hydration', 'antipyretics (e.g., paracetamol)', 'monitor oxygen levels', 'seek medical help if breathing worsens'],
+    'advice': "Isolate yourself to prevent spread, rest, stay hydrated, and use paracetamol for fever. Monitor symptoms, especially breathing, and seek medical attention if they worsen or if you have risk factors for severe disease.",
+    'personalized_advice': "\nPersonalized Notes:\n- With hypertension, track blood pressure.\n- With asthma, keep inhaler handy.",
+}
+
+
+def legacy_generate_pdf_report(full_path, user_details_row, diagnosis_info):
+    """The pre-renderer generate_pdf_report() layout, kept here as the baseline."""
+    pdf = FPDF(); pdf.add_page(); pdf.set_font("Helvetica", size=12)
+    pdf.set_font("Helvetica", 'B', 16)
+    pdf.cell(0, 10, txt="Medical Diagnosis Report", align='C', ln=1)
+    pdf.ln(5)
+    pdf.set_font("Helvetica", size=10)
+    pdf.cell(0, 10, txt=f"Report Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}", align='R', ln=1)
+    pdf.ln(5)
+    pdf.set_font("Helvetica", 'B', 12)
+    pdf.cell(0, 10, txt="Patient Information", ln=1)
+    pdf.set_font("Helvetica", size=12)
+    pdf.cell(0, 8, txt=f"Name: {user_details_row['name']}", ln=1)
+    pdf.cell(0, 8, txt=f"Age: {user_details_row['age'] or 'N/A'}", ln=1)
+    pdf.cell(0, 8, txt=f"Weight: {user_details_row['weight']} kg", ln=1)
+    pdf.multi_cell(0, 8, txt=f"Reported Conditions: {user_details_row['medical_conditions'].strip()}", border=0, align='L')
+    pdf.ln(5)
+    pdf.set_font("Helvetica", 'B', 12)
+    pdf.cell(0, 10, txt="Reported Symptoms", ln=1)
+    pdf.set_font("Helvetica", size=12)
+    pdf.multi_cell(0, 8, txt=", ".join(s.replace("_", " ").title() for s in diagnosis_info['symptoms']), align='L')
+    pdf.ln(5)
+    pdf.set_font("Helvetica", 'B', 12)
+    pdf.cell(0, 10, txt="Diagnosis Outcome", ln=1)
+    pdf.set_font("Helvetica", size=12)
+    pdf.cell(0, 8, txt=f"Possible Diagnosis: {diagnosis_info['disease'].replace('_', ' ').title()}", ln=1)
+    pdf.cell(0, 8, txt=f"Confidence: {float(diagnosis_info['confidence']):.2f}%", ln=1)
+    pdf.cell(0, 8, txt=f"Recommended Test: {diagnosis_info['test'].replace('_', ' ').title()}", ln=1)
+    pdf.ln(5)
+    pdf.set_font("Helvetica", 'B', 12)
+    pdf.cell(0, 10, txt="Suggested Treatment", ln=1)
+    pdf.set_font("Helvetica", size=12)
+    pdf.multi_cell(0, 8, txt="- " + "\n- ".join(str(i).replace('_', ' ').title() for i in diagnosis_info['treatment']), align='L')
+    pdf.ln(5)
+    pdf.set_font("Helvetica", 'B', 12)
+    pdf.cell(0, 10, txt="General Advice", ln=1)
+    pdf.set_font("Helvetica", size=12)
+    pdf.multi_cell(0, 8, txt=diagnosis_info['advice'], align='L')
+    pdf.ln(5)
+    pdf.set_font("Helvetica", 'B', 12)
+    pdf.cell(0, 10, txt="Personalized Advice", ln=1)
+    pdf.set_font("Helvetica", size=12)
+    pdf.multi_cell(0, 8, txt=diagnosis_info['personalized_advice'].strip(), align='L')
+    pdf.ln(10)
+    pdf.set_font("Helvetica", 'I', 10)
+    pdf.multi_cell(0, 8, txt=("Disclaimer: This system provides potential diagnoses based on symptoms and is not a substitute for professional medical advice. Always consult a qualified healthcare provider for any health concerns."), align='L')
+    pdf.output(name=full_path)
+    return full_path
+
+
+def measure(label, func, reports):
+    func(0) # Warm-up (fills the renderer's wrap cache, imports fonts)
+    start = time.perf_counter()
+    for i in range(reports):
+        func(i)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<34} {reports / elapsed:8.1f} reports/s  ({elapsed / reports * 1000:.2f} ms/report)")
+    return reports / elapsed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare PDF report throughput.")
+    parser.add_argument('--reports', type=int, default=300)
+    args = parser.parse_args(argv)
+
+    warnings.simplefilter('ignore') # The legacy layout uses fpdf's deprecated txt=/ln= arguments
+    renderer = ReportRenderer()
+    with tempfile.TemporaryDirectory() as out_dir:
+        def archive(i):
+            with open(os.path.join(out_dir, f"renderer_{i}.pdf"), 'wb') as f:
+                f.write(renderer.render(USER, DIAGNOSIS))
+
+        baseline = measure("legacy generate_pdf_report (disk)", lambda i: legacy_generate_pdf_report(os.path.join(out_dir, f"legacy_{i}.pdf"), USER, DIAGNOSIS), args.reports)
+        in_memory = measure("ReportRenderer.render (memory)", lambda i: renderer.render(USER, DIAGNOSIS), args.reports)
+        archived = measure("ReportRenderer + archive (disk)", archive, args.reports)
+    print(f"Speed-up: {in_memory / baseline:.2f}x in memory, {archived / baseline:.2f}x with archival")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# benchmarks/bench_startup.py
+# Worker cold start: wall time and peak RSS of `import app` in a fresh interpreter, with
+# matplotlib left to the PNG export (current) and with it imported and styled up front
+# (how app.py used to start).
+#
+# Usage: python benchmarks/bench_startup.py [--runs N]
+#
+# Each run imports a throwaway copy of the app directory so the real database is untouched.
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r"""
+import json, resource, sys, time
+started = time.perf_counter()
+if sys.argv[1] == 'eager':
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    plt.style.use('seaborn-v0_8-pastel')
+import app
+elapsed = time.perf_counter() - started
+print(json.dumps({'seconds': elapsed,
+                  'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'matplotlib_loaded': 'matplotlib' in sys.modules}))
+"""
+
+
+def run_probe(app_copy, mode):
+    out = subprocess.run([sys.executable, '-W', 'ignore', '-c', PROBE, mode], cwd=app_copy,
+                         capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure app import time and memory with and without matplotlib.")
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app_copy = os.path.join(tmp, 'app')
+        shutil.copytree(APP_DIR, app_copy, ignore=shutil.ignore_patterns('reports', '__pycache__', 'benchmarks'))
+        run_probe(app_copy, 'lazy') # Warm the OS file cache and compile bytecode once
+        for mode, label in (('eager', "matplotlib at startup"), ('lazy', "matplotlib on demand")):
+            results = [run_probe(app_copy, mode) for _ in range(args.runs)]
+            seconds = statistics.median(r['seconds'] for r in results)
+            rss = statistics.median(r['max_rss_mb'] for r in results)
+            print(f"{label:<24} import {seconds * 1000:8.1f} ms   peak RSS {rss:7.1f} MB   "
+                  f"matplotlib loaded: {results[0]['matplotlib_loaded']}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# check_parity.py
+# Verifies that the compiled Python engine (knowledge_base.py) returns exactly the same
+# symptom_match/5 scores as SWI-Prolog for every input the diagnosis forms can submit.
+#
+# Usage: python check_parity.py [--samples N] [--seed S]
+# Requires SWI-Prolog + pyswip. Exits with status 1 on the first batch of mismatches.
+
+import argparse
+import itertools
+import random
+import sys
+
+from app import app, all_symptoms_for_vars, unique_risk_factors, kb_manager, decode_prolog_value
+from prolog_engine import PrologEngine
+
+kb_version = kb_manager.current
+compiled_kb = kb_version.kb
+symptom_vocabulary, risk_vocabulary = kb_version.symptom_vocabulary, kb_version.risk_vocabulary
+
+
+def prolog_lists(symptoms, risk_factors, answers):
+    symptoms_str = "[" + ",".join("'{}'".format(s.replace("'", "''")) for s in symptoms) + "]"
+    risks_str = "[" + ",".join("'{}'".format(rf.replace("'", "''")) for rf in risk_factors) + "]"
+    answers_str = "[" + ",".join("('{}',{})".format(q.replace("'", "''"), a) for q, a in answers) + "]"
+    return symptoms_str, risks_str, answers_str
+
+
+def prolog_symptom_match(engine, symptoms, risk_factors, answers):
+    symptoms_str, risks_str, answers_str = prolog_lists(symptoms, risk_factors, answers)
+    results = engine.query(f"findall([D, C], symptom_match({symptoms_str}, {risks_str}, {answers_str}, D, C), Results).")
+    return [(decode_prolog_value(d), float(c)) for d, c in results[0]['Results']]
+
+
+def prolog_bundle(engine, symptoms, risk_factors, answers, follow_up_k=3):
+    symptoms_str, risks_str, answers_str = prolog_lists(symptoms, risk_factors, answers)
+    result = engine.query(f"diagnosis_bundle({symptoms_str}, {risks_str}, {answers_str}, {follow_up_k}, "
+                          f"Ranked, Questions, Test, Treatment, Advice).")[0]
+    return {
+        'ranked': [(decode_prolog_value(d), float(c)) for d, c in result['Ranked']],
+        'follow_up_questions': [decode_prolog_value(q) for q in result['Questions']],
+        'test': decode_prolog_value(result['Test']),
+        'treatment': [decode_prolog_value(item) for item in result['Treatment']],
+        'advice': decode_prolog_value(result['Advice']),
+    }
+
+
+def parity_cases(samples, seed):
+    """Every single symptom and symptom pair, every risk factor (alone and paired), every answer, plus random forms."""
+    form_symptoms = symptom_vocabulary.atoms_of(symptom_vocabulary.encode(all_symptoms_for_vars))
+    kb_symptoms = sorted(compiled_kb.symptom_index)
+    symptoms = sorted(set(form_symptoms) | set(kb_symptoms))
+    questions = sorted({q for qs in compiled_kb.follow_up_questions.values() for q in qs})
+    answers = [(q, a) for q in questions for a in ('yes', 'no')]
+
+    for s in symptoms:
+        yield [s], [], []
+    for pair in itertools.combinations(symptoms, 2):
+        yield list(pair), [], []
+    for rf in unique_risk_factors:
+        yield [form_symptoms[0]], [rf], []
+    for pair in itertools.combinations(unique_risk_factors, 2):
+        yield [form_symptoms[0]], list(pair), []
+    for answer in answers:
+        yield [form_symptoms[0]], [], [answer]
+
+    rng = random.Random(seed)
+    for _ in range(samples):
+        chosen_symptoms = rng.sample(symptoms, rng.randint(1, 8))
+        chosen_risks = rng.sample(unique_risk_factors, rng.randint(0, 5))
+        chosen_answers = [(q, rng.choice(('yes', 'no'))) for q in rng.sample(questions, rng.randint(0, 6))]
+        yield chosen_symptoms, chosen_risks, chosen_answers
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the Python scoring engine against symptom_match/5.")
+    parser.add_argument('--samples', type=int, default=2000, help="Random full-form combinations to check")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    engine = PrologEngine(app.config['PROLOG_FILE'])
+    checked, mismatches = 0, []
+    for symptoms, risks, answers in parity_cases(args.samples, args.seed):
+        expected = prolog_symptom_match(engine, symptoms, risks, answers)
+        actual = compiled_kb.symptom_match(symptoms, risks, answers)
+        checked += 1
+        if expected != actual:
+            mismatches.append((symptoms, risks, answers, expected, actual))
+            continue
+        # The bitset path the app uses scores the selected atoms in bit order
+        symptom_mask, risk_mask = symptom_vocabulary.encode(symptoms), risk_vocabulary.encode(risks)
+        expected = compiled_kb.symptom_match(symptom_vocabulary.atoms_of(symptom_mask), risk_vocabulary.atoms_of(risk_mask), answers)
+        actual = compiled_kb.rescore(compiled_kb.mask_base_scores(symptom_mask, risk_mask), answers)
+        if expected != actual:
+            mismatches.append((symptoms, risks, answers, expected, actual))
+            continue
+        # diagnosis_bundle/9 must agree too: ranking, follow-up questions and the leader's details
+        expected = prolog_bundle(engine, symptoms, risks, answers)
+        actual = compiled_kb.diagnosis_bundle(symptoms, risks, answers, 3)
+        if expected != actual:
+            mismatches.append((symptoms, risks, answers, expected, actual))
+
+    for symptoms, risks, answers, expected, actual in mismatches[:20]:
+        print(f"MISMATCH symptoms={symptoms} risks={risks} answers={answers}")
+        print(f"  prolog: {expected}")
+        print(f"  python: {actual}")
+    print(f"Checked {checked} combinations, {len(mismatches)} mismatches.")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
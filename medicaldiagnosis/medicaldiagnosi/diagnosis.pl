@@ -226,6 +226,36 @@ symptom_match(UserSymptoms, UserRiskFactors, AnswerList, Disease, FinalScore) :-
     FinalScore is max(0.0, min(RawAdjustedScore, 100.0)). % Cap score between 0 and 100.
     % No cut here to allow findall to find all matching diseases.
 
+% --------------------------------------------------
+% Diagnosis Bundle (one round trip per web request)
+% diagnosis_bundle(Symptoms, RiskFactors, Answers, K, Ranked, Questions, Test, Treatment, Advice).
+% Ranked: [[DiseaseAtom, Score], ...] best first; ties keep disease/2 order.
+% Questions: sorted, de-duplicated follow-up questions for the top K diseases.
+% Test, Treatment, Advice: details for the top-ranked disease, or fallbacks if nothing was ranked.
+% --------------------------------------------------
+diagnosis_bundle(Symptoms, RiskFactors, Answers, K, Ranked, Questions, Test, Treatment, Advice) :-
+    findall(Score-Disease, symptom_match(Symptoms, RiskFactors, Answers, Disease, Score), Pairs),
+    sort(1, @>=, Pairs, Sorted),                         % Stable: equal scores keep findall order.
+    findall([D, S], member(S-D, Sorted), Ranked),
+    top_k_diseases(Sorted, K, TopK),
+    findall(Q, (member(D, TopK), follow_up_question(D, Q)), AllQuestions),
+    sort(AllQuestions, Questions),                       % Sorts and removes duplicates.
+    top_match_details(Sorted, Test, Treatment, Advice).
+
+top_k_diseases(Sorted, K, TopK) :-
+    length(Sorted, N),
+    Take is min(K, N),
+    length(Prefix, Take),
+    append(Prefix, _, Sorted),
+    findall(D, member(_-D, Prefix), TopK).
+
+top_match_details([_-Top | _], Test, Treatment, Advice) :-
+    !,
+    ( requires_test(Top, T) -> Test = T ; Test = 'N/S' ),
+    ( treatment(Top, Tr) -> Treatment = Tr ; Treatment = ['N/S info'] ),
+    ( advice(Top, A) -> Advice = A ; Advice = 'General advice.' ).
+top_match_details([], 'N/S', ['N/S info'], 'General advice.').
+
 % ------------------------
 % Treatment Suggestions
 % treatment(DiseaseAtom, ListOfTreatmentAtomsOrStrings).
@@ -0,0 +1,110 @@
+# diagnosis_api.py
+# Request validation and response shaping for the JSON diagnosis API (/api/v1/...).
+#
+# A diagnosis request is a JSON object:
+#     {"symptoms": ["fever", "cough"], "risk_factors": ["smoking"],
+#      "answers": [{"question": "Is the cough dry?", "answer": "yes"}], "top_k": 3}
+# Only "symptoms" is required. "answers" may also be an object mapping question -> answer.
+# Batch requests wrap a list of these in {"requests": [...]}, each optionally with an "id".
+
+import hmac
+
+ANSWER_VALUES = ('yes', 'no')
+MAX_TOP_K = 50
+
+
+class ApiValidationError(ValueError):
+    """Raised for a malformed API request; `errors` lists every problem found."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def token_matches(provided, tokens):
+    """Constant-time check of a bearer token against the configured ones."""
+    if not provided:
+        return False
+    provided = provided.encode('utf-8')
+    return any(hmac.compare_digest(provided, token.encode('utf-8')) for token in tokens)
+
+
+def bearer_token(authorization):
+    scheme, _, token = (authorization or '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' else None
+
+
+def _string_list(payload, field, errors):
+    value = payload.get(field, [])
+    if not isinstance(value, list) or not all(isinstance(item, str) for item in value):
+        errors.append(f"'{field}' must be a list of strings.")
+        return []
+    return list(dict.fromkeys(value)) # Drop duplicates, keep the caller's order
+
+
+def _answer_pairs(payload, errors):
+    value = payload.get('answers', [])
+    if isinstance(value, dict):
+        value = [{'question': question, 'answer': answer} for question, answer in value.items()]
+    if not isinstance(value, list):
+        errors.append("'answers' must be a list of {question, answer} objects or an object of question: answer.")
+        return []
+    pairs = []
+    for item in value:
+        if not isinstance(item, dict) or not isinstance(item.get('question'), str):
+            errors.append("Each answer needs a 'question' string and an 'answer'.")
+            continue
+        pairs.append((item['question'], item.get('answer')))
+    return pairs
+
+
+def parse_diagnosis_request(payload, known_symptoms, known_risk_factors, known_questions):
+    """Validates one request against the form vocabularies; returns {'symptoms', 'risk_factors', 'answers', 'top_k'}.
+
+    Raises ApiValidationError listing every unknown symptom, risk factor, question or answer.
+    """
+    if not isinstance(payload, dict):
+        raise ApiValidationError(["Request body must be a JSON object."])
+    errors = []
+    symptoms = _string_list(payload, 'symptoms', errors)
+    risk_factors = _string_list(payload, 'risk_factors', errors)
+    answers = _answer_pairs(payload, errors)
+
+    if isinstance(payload.get('symptoms', []), list) and not symptoms:
+        errors.append("At least one symptom is required.")
+    unknown = [s for s in symptoms if s not in known_symptoms]
+    if unknown:
+        errors.append(f"Unknown symptoms: {', '.join(unknown)}.")
+    unknown = [rf for rf in risk_factors if rf not in known_risk_factors]
+    if unknown:
+        errors.append(f"Unknown risk factors: {', '.join(unknown)}.")
+    seen = set()
+    for question, answer in answers:
+        if question not in known_questions:
+            errors.append(f"Unknown follow-up question: {question!r}.")
+        elif answer not in ANSWER_VALUES:
+            errors.append(f"Answer to {question!r} must be 'yes' or 'no'.")
+        elif question in seen:
+            errors.append(f"Question {question!r} is answered more than once.")
+        seen.add(question)
+
+    top_k = payload.get('top_k', 3)
+    if not isinstance(top_k, int) or isinstance(top_k, bool) or not 1 <= top_k <= MAX_TOP_K:
+        errors.append(f"'top_k' must be an integer from 1 to {MAX_TOP_K}.")
+    if errors:
+        raise ApiValidationError(errors)
+    return {'symptoms': symptoms, 'risk_factors': risk_factors, 'answers': answers, 'top_k': top_k}
+
+
+def diagnosis_response(bundle, follow_up_questions, top_k, kb_version=None):
+    """JSON body for one scored request: the ranked diseases plus the leader's details."""
+    ranked = bundle['ranked'] if bundle else []
+    return {
+        'kb_version': kb_version,
+        'ranked': [{'disease': disease, 'confidence': round(float(confidence), 4)} for disease, confidence in ranked[:top_k]],
+        'follow_up_questions': list(follow_up_questions),
+        'complete': not follow_up_questions, # False while there are questions worth answering
+        'test': bundle['test'] if ranked else None,
+        'treatment': list(bundle['treatment']) if ranked else [],
+        'advice': bundle['advice'] if ranked else None,
+    }
@@ -0,0 +1,126 @@
+# diagnosis_cache.py
+# Bounded LRU/TTL cache for knowledge base query results, invalidated whenever
+# diagnosis.pl changes on disk.
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class SourceFingerprint:
+    """Tracks (mtime, size, sha256) of a file; the content hash is only recomputed when the stat changes."""
+
+    def __init__(self, path):
+        self.path = path
+        self._stat = None
+        self._digest = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        st = os.stat(self.path)
+        stat_key = (st.st_mtime_ns, st.st_size)
+        with self._lock:
+            if stat_key != self._stat:
+                with open(self.path, 'rb') as f:
+                    self._digest = hashlib.sha256(f.read()).hexdigest()
+                self._stat = stat_key
+            return self._digest
+
+
+def normalize_diagnosis_key(symptom_mask, risk_mask, answers):
+    """Order-independent cache key for one diagnosis request (symptoms and risk factors as vocabulary bitsets)."""
+    return (int(symptom_mask), int(risk_mask),
+            tuple(sorted(set((str(q), str(a)) for q, a in answers))))
+
+
+class DiagnosisCache:
+    """Thread-safe LRU cache with per-entry TTL and hit/miss/eviction counters.
+
+    Every lookup compares the knowledge base fingerprint with the one the entries were
+    computed against; if diagnosis.pl's content changed, the whole cache is dropped.
+    """
+
+    def __init__(self, max_entries=4096, ttl_seconds=600, fingerprint=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.fingerprint = fingerprint
+        self._entries = OrderedDict() # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self._kb_digest = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def _check_fingerprint(self):
+        if self.fingerprint is None:
+            return
+        digest = self.fingerprint.current()
+        if digest != self._kb_digest:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self._kb_digest = digest
+
+    def get(self, key):
+        """Returns (True, value) on a hit, (False, None) on a miss."""
+        with self._lock:
+            self._check_fingerprint()
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at >= time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+                del self._entries[key]
+                self.expirations += 1
+            self.misses += 1
+            return False, None
+
+    def set(self, key, value):
+        with self._lock:
+            self._check_fingerprint()
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        """Returns the cached value for key, computing and storing it on a miss. None results are not cached."""
+        found, value = self.get(key)
+        if found:
+            return value
+        value = compute()
+        if value is not None:
+            self.set(key, value)
+        return value
+
+    def discard(self, key):
+        """Drops one entry (e.g. after the data it was computed from changed)."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl_seconds,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+                'kb_sha256': self._kb_digest,
+            }
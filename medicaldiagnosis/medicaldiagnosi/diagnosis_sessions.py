@@ -0,0 +1,99 @@
+# diagnosis_sessions.py
+# Server-side storage for in-progress diagnosis state (selected symptoms, follow-up
+# questions, results and report details). Only an opaque id travels in the session cookie;
+# the state itself lives in the shared SQLite database, so every worker process sees it.
+
+import json
+import os
+import secrets
+import threading
+import time
+
+
+def new_state_id():
+    return secrets.token_urlsafe(24)
+
+
+class DiagnosisStateStore:
+    """Per-user diagnosis state rows with a sliding TTL and periodic expiry sweeps.
+
+    `connect` returns the database connection to use (the app passes get_db, so the
+    store shares the request's pooled connection).
+    """
+
+    def __init__(self, connect, ttl_seconds=3600, sweep_interval=300):
+        self.connect = connect
+        self.ttl_seconds = ttl_seconds
+        self.sweep_interval = sweep_interval
+        self._last_sweep = 0.0
+        self._lock = threading.Lock()
+        self.swept = 0
+
+    def load(self, state_id, user_id):
+        """Returns the stored state dict, or None if it is unknown, expired or belongs to another user."""
+        if not state_id:
+            return None
+        row = self.connect().execute(
+            "SELECT data FROM diagnosis_sessions WHERE id = ? AND user_id = ? AND expires_at > ?",
+            (state_id, user_id, time.time())).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, state_id, user_id, state):
+        db = self.connect()
+        db.execute("""INSERT INTO diagnosis_sessions (id, user_id, data, expires_at) VALUES (?, ?, ?, ?)
+                      ON CONFLICT(id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at
+                      WHERE diagnosis_sessions.user_id = excluded.user_id""",
+                   (state_id, user_id, json.dumps(state), time.time() + self.ttl_seconds))
+        db.commit()
+        self.maybe_sweep()
+
+    def delete(self, state_id):
+        if not state_id:
+            return
+        db = self.connect()
+        db.execute("DELETE FROM diagnosis_sessions WHERE id = ?", (state_id,))
+        db.commit()
+
+    def sweep(self):
+        """Deletes expired states; returns how many were removed."""
+        db = self.connect()
+        removed = db.execute("DELETE FROM diagnosis_sessions WHERE expires_at <= ?", (time.time(),)).rowcount
+        db.commit()
+        with self._lock:
+            self.swept += removed
+        return removed
+
+    def maybe_sweep(self):
+        # At most one sweep per interval per process; other workers sweep on their own schedule
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_sweep < self.sweep_interval:
+                return 0
+            self._last_sweep = now
+        return self.sweep()
+
+
+def load_secret_key(path, create=True):
+    """Reads the session signing key from path, creating it (mode 0600) on first use.
+
+    O_EXCL makes creation race-free, so workers starting together all end up with the
+    key written by whichever of them got there first. With create=False a missing file
+    is an error instead.
+    """
+    if not create and not os.path.exists(path):
+        raise RuntimeError(f"Secret key file '{path}' does not exist; set SECRET_KEY or provision the file.")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for _ in range(50): # Another worker may still be writing it
+            with open(path, 'rb') as f:
+                key = f.read()
+            if key:
+                return key
+            time.sleep(0.01)
+        raise RuntimeError(f"Secret key file '{path}' is empty.")
+    key = secrets.token_bytes(32)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
@@ -0,0 +1,129 @@
+# diagnosis_stats.py
+# Diagnosis statistics: summary tables maintained by SQLite triggers as history rows are
+# written (created and backfilled by migration 7 in storage.py), read by /api/statistics and
+# charted in the browser. The PNG export is the only
+# user of matplotlib, which is imported on first use so it stays out of worker startup.
+
+import glob
+import hashlib
+import io
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from app_logging import get_logger, log_event
+from metrics import CHART_RENDER_SECONDS
+
+logger = get_logger('statistics')
+
+def get_diagnosis_counts(db):
+    """Returns [(diagnosis, count)] from the summary table, most frequent first."""
+    cursor = db.cursor()
+    cursor.execute("SELECT diagnosis, count FROM diagnosis_counts WHERE count > 0 ORDER BY count DESC, diagnosis")
+    return [(row[0], row[1]) for row in cursor.fetchall()]
+
+
+def get_statistics_summary(db, days=30):
+    """Distribution, average confidence per diagnosis and daily diagnosis counts for the last `days` days."""
+    cursor = db.cursor()
+    cursor.execute("""SELECT diagnosis, count, confidence_total FROM diagnosis_counts
+                      WHERE count > 0 ORDER BY count DESC, diagnosis""")
+    distribution = [{'diagnosis': row[0],
+                     'label': str(row[0]).replace('_', ' ').title(),
+                     'count': row[1],
+                     'avg_confidence': round(row[2] / row[1], 2)} for row in cursor.fetchall()]
+    since = (datetime.now() - timedelta(days=days - 1)).strftime("%Y-%m-%d")
+    cursor.execute("SELECT day, count FROM diagnosis_daily_counts WHERE day >= ? AND count > 0 ORDER BY day", (since,))
+    daily = [{'day': row[0], 'count': row[1]} for row in cursor.fetchall()]
+    total = sum(item['count'] for item in distribution)
+    overall_confidence = sum(item['avg_confidence'] * item['count'] for item in distribution) / total if total else None
+    return {
+        'total': total,
+        'avg_confidence': round(overall_confidence, 2) if overall_confidence is not None else None,
+        'distribution': distribution,
+        'days': days,
+        'daily': daily,
+    }
+
+
+def summary_etag(summary):
+    return hashlib.sha1(repr(summary).encode('utf-8')).hexdigest()
+
+
+# --- Optional server-side PNG export (matplotlib is imported lazily) ---
+_matplotlib_lock = threading.Lock()
+_figure_class = None
+
+
+def _load_matplotlib():
+    """Imports and styles matplotlib on first use and returns its Figure class."""
+    global _figure_class
+    with _matplotlib_lock:
+        if _figure_class is None:
+            import matplotlib
+            matplotlib.use('Agg') # Non-interactive backend for Matplotlib
+            import matplotlib.style
+            from matplotlib.figure import Figure
+            matplotlib.rcParams.update({'font.size': 10, 'axes.titlesize': 14, 'axes.labelsize': 12, 'xtick.labelsize': 10, 'ytick.labelsize': 10})
+            matplotlib.style.use('seaborn-v0_8-pastel')
+            _figure_class = Figure
+        return _figure_class
+
+
+def render_distribution_chart(counts):
+    """Draws the diagnosis distribution donut chart and returns it as PNG bytes."""
+    Figure = _load_matplotlib()
+    labels = [str(label).replace('_', ' ').title() for label, _count in counts]
+    values = [count for _label, count in counts]
+
+    with CHART_RENDER_SECONDS.time():
+        # Figure (not pyplot) keeps no global state, so rendering is safe from any worker thread
+        fig = Figure(figsize=(7, 6)) # Adjusted size for better fit
+        ax = fig.subplots()
+        wedges, texts, autotexts = ax.pie(values, labels=None, autopct='%1.1f%%', startangle=90,
+                                          pctdistance=0.85, wedgeprops=dict(width=0.4))
+        ax.set_title("Distribution of Diagnoses", fontsize=16, pad=20)
+        # Legend outside the pie for clarity
+        ax.legend(wedges, labels, title="Diagnoses", loc="center left",
+                  bbox_to_anchor=(1, 0, 0.5, 1), fontsize='small')
+        fig.tight_layout(rect=[0, 0, 0.8, 1]) # Adjust layout to make space for legend
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png')
+        return buffer.getvalue()
+
+
+class ChartCache:
+    """Keeps the last rendered chart in memory, keyed by a hash of the counts it was drawn from."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._etag = None
+        self._png = None
+        self.renders = 0
+
+    @staticmethod
+    def etag_for(counts):
+        return hashlib.sha1(repr(counts).encode('utf-8')).hexdigest()
+
+    def get(self, counts):
+        """Returns (etag, png_bytes), re-rendering only if the counts changed since the last call."""
+        etag = self.etag_for(counts)
+        with self._lock:
+            if etag != self._etag:
+                self._png = render_distribution_chart(counts)
+                self._etag = etag
+                self.renders += 1
+            return self._etag, self._png
+
+
+def purge_chart_files(charts_dir):
+    """Deletes per-request chart PNGs written by earlier versions of the statistics page."""
+    removed = 0
+    for path in glob.glob(os.path.join(charts_dir, 'diagnosis_stats_*.png')):
+        try:
+            os.remove(path)
+            removed += 1
+        except OSError as e:
+            log_event(logger, logging.WARNING, 'statistics.chart_purge_failed', path=path, error=str(e))
+    return removed
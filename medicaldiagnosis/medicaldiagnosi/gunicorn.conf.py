@@ -0,0 +1,42 @@
+# gunicorn.conf.py
+# Usage: gunicorn -c gunicorn.conf.py wsgi:application
+#
+# Tunables (environment): WEB_BIND, WEB_WORKERS, WEB_THREADS, WEB_TIMEOUT, WEB_PRELOAD.
+# Each worker is a process with WEB_THREADS request threads; SQLite connections, the report
+# workers and the Prolog engine are created per process/thread on first use after the fork.
+# A report job runs in the worker that queued it, but its state is kept in the report_jobs
+# table and its PDF in diagnosis_reports/, so status polls and downloads may reach any worker
+# (all workers must run on one host, sharing that directory and the database file).
+
+import multiprocessing
+import os
+
+bind = os.environ.get('WEB_BIND', '127.0.0.1:8000')
+workers = int(os.environ.get('WEB_WORKERS', min(multiprocessing.cpu_count() * 2 + 1, 8)))
+threads = int(os.environ.get('WEB_THREADS', 4))
+worker_class = 'gthread'
+timeout = int(os.environ.get('WEB_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Build and warm the app once in the master; workers inherit it copy-on-write
+preload_app = os.environ.get('WEB_PRELOAD', '1') not in ('0', 'false', 'no')
+
+# Recycle workers now and then so slow leaks cannot build up; jitter avoids restarting all at once
+max_requests = int(os.environ.get('WEB_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+
+def when_ready(server):
+    server.log.info(f"Serving with {workers} workers x {threads} threads (preload={'on' if preload_app else 'off'})")
+
+
+def post_fork(server, worker):
+    server.log.info(f"Worker {worker.pid} forked")
+    # SWI-Prolog is not fork-safe, so the master never consults diagnosis.pl; each worker does it here
+    if preload_app and os.environ.get('DIAGNOSIS_ENGINE', 'python') == 'prolog':
+        import wsgi
+        if wsgi.warm_up_enabled():
+            seconds = wsgi.warm_up_prolog()
+            if seconds is not None:
+                server.log.info(f"Worker {worker.pid} consulted diagnosis.pl in {seconds * 1000:.1f} ms")
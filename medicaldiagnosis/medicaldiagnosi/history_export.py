@@ -0,0 +1,74 @@
+# history_export.py
+# Keyset pagination cursors and streaming CSV/JSONL serialization for diagnosis history.
+#
+# History is ordered newest first by (datetime, id). A page cursor is the (datetime, id) of
+# the row at the page boundary, so fetching the next page is an index range scan no matter
+# how deep into the history it is, unlike LIMIT/OFFSET.
+
+import base64
+import csv
+import io
+import json
+import os
+
+EXPORT_COLUMNS = ('id', 'datetime', 'symptoms', 'diagnosis', 'confidence', 'report_filename', 'kb_version')
+
+
+def encode_cursor(row):
+    """Opaque, URL-safe cursor for the (datetime, id) position of a history row."""
+    raw = json.dumps([row['datetime'], row['id']], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Returns (datetime, id) for a cursor, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        stamp, row_id = json.loads(raw.decode('utf-8'))
+        return str(stamp), int(row_id)
+    except (ValueError, TypeError, UnicodeDecodeError):
+        return None
+
+
+def iter_history(fetch_page, batch_size=500):
+    """Yields every history row, newest first, by walking fetch_page(before, limit) batch by batch.
+
+    Each batch is its own short query, so no cursor stays open between yields and memory
+    use is bounded by batch_size regardless of how many rows are exported.
+    """
+    before = None
+    while True:
+        rows = fetch_page(before, batch_size)
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        before = (rows[-1]['datetime'], rows[-1]['id'])
+
+
+def export_row(row):
+    record = {column: row[column] for column in EXPORT_COLUMNS}
+    if record['report_filename']:
+        record['report_filename'] = os.path.basename(record['report_filename']) # Never expose server paths
+    return record
+
+
+def csv_lines(rows):
+    """Yields a CSV header and one encoded line per row."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        record = export_row(row)
+        writer.writerow([record[column] for column in EXPORT_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def jsonl_lines(rows):
+    for row in rows:
+        yield json.dumps(export_row(row)) + "\n"
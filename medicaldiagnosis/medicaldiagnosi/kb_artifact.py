@@ -0,0 +1,171 @@
+# kb_artifact.py
+# Ahead-of-time compiled knowledge base. `python kb_artifact.py` compiles diagnosis.pl's facts
+# once into diagnosis.kb, so workers load them in well under a millisecond instead of parsing
+# the Prolog source on every start:
+#
+#   python kb_artifact.py [--prolog diagnosis.pl] [--output diagnosis.kb] [--qlf]
+#
+# diagnosis.kb is a fixed header followed by the KnowledgeBase.tables() marshalled. Loading is
+# one file read and a marshal.loads(), which builds the tables in the worker's own heap (with
+# WEB_PRELOAD the master loads them once and workers share them copy-on-write). The header holds
+# the sha256 of the diagnosis.pl it was built from; an artifact whose source hash, format or
+# Python version no longer matches is rejected and the source is compiled instead.
+#
+# --qlf also runs SWI-Prolog's qcompile/1 to write diagnosis.qlf, and records its hash in the
+# header; the Prolog engine consults it only while both hashes still match (see fresh_qlf).
+
+import argparse
+import hashlib
+import logging
+import marshal
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import time
+
+from app_logging import get_logger, log_event
+from knowledge_base import KnowledgeBase, load_knowledge_base, read_source
+
+logger = get_logger('kb_artifact')
+
+MAGIC = b'MDKB'
+FORMAT_VERSION = 1
+# magic, format version, marshal version, interpreter tag, source sha256, payload sha256, qlf sha256, payload length
+HEADER = struct.Struct('<4sHH16s32s32s32sQ')
+NO_QLF = bytes(32)
+
+
+class ArtifactError(Exception):
+    """Raised when a compiled knowledge base artifact is missing, corrupt or stale."""
+
+
+def _interpreter_tag():
+    # marshal output is only guaranteed to load in the interpreter version that wrote it
+    return (sys.implementation.cache_tag or '').encode('ascii')[:16].ljust(16, b'\0')
+
+
+def _file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).digest()
+
+
+def default_qlf_path(prolog_file_path):
+    return os.path.splitext(prolog_file_path)[0] + '.qlf'
+
+
+def compile_qlf(prolog_file_path):
+    """Runs qcompile/1 on diagnosis.pl with the swipl binary; returns the .qlf path."""
+    swipl = shutil.which('swipl')
+    if not swipl:
+        raise ArtifactError("swipl is not on PATH; cannot build the .qlf file")
+    source_path = os.path.abspath(prolog_file_path).replace("\\", "/").replace("'", "''")
+    subprocess.run([swipl, '-q', '-g', f"qcompile('{source_path}')", '-t', 'halt'], check=True)
+    return default_qlf_path(prolog_file_path)
+
+
+def build_artifact(prolog_file_path, output_path, qlf_path=None):
+    """Compiles diagnosis.pl into output_path (written atomically); returns the KnowledgeBase."""
+    kb = load_knowledge_base(prolog_file_path)
+    payload = marshal.dumps(kb.tables())
+    header = HEADER.pack(MAGIC, FORMAT_VERSION, marshal.version, _interpreter_tag(), bytes.fromhex(kb.source_digest),
+                         hashlib.sha256(payload).digest(), _file_sha256(qlf_path) if qlf_path else NO_QLF, len(payload))
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(header)
+        f.write(payload)
+    os.replace(temp_path, output_path) # Running workers never see a half-written file
+    return kb
+
+
+def read_header(artifact_path):
+    """Returns the artifact header as a dict, or raises ArtifactError."""
+    try:
+        with open(artifact_path, 'rb') as f:
+            raw = f.read(HEADER.size)
+    except OSError as e:
+        raise ArtifactError(f"Cannot read '{artifact_path}': {e}") from e
+    if len(raw) < HEADER.size:
+        raise ArtifactError(f"'{artifact_path}' is truncated")
+    magic, version, marshal_version, tag, source_sha, payload_sha, qlf_sha, length = HEADER.unpack(raw)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ArtifactError(f"'{artifact_path}' is not a format {FORMAT_VERSION} knowledge base artifact")
+    if marshal_version != marshal.version or tag != _interpreter_tag():
+        raise ArtifactError(f"'{artifact_path}' was built by another Python version")
+    return {'source_sha256': source_sha.hex(), 'payload_sha256': payload_sha, 'qlf_sha256': qlf_sha, 'payload_length': length}
+
+
+def load_artifact(artifact_path, source_digest):
+    """KnowledgeBase from an artifact built from the diagnosis.pl whose sha256 is source_digest."""
+    header = read_header(artifact_path)
+    if header['source_sha256'] != source_digest:
+        raise ArtifactError(f"'{artifact_path}' was built from a different diagnosis.pl")
+    try:
+        with open(artifact_path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        raise ArtifactError(f"Cannot read '{artifact_path}': {e}") from e
+    if len(data) != HEADER.size + header['payload_length']:
+        raise ArtifactError(f"'{artifact_path}' has the wrong length")
+    payload = memoryview(data)[HEADER.size:]
+    if hashlib.sha256(payload).digest() != header['payload_sha256']:
+        raise ArtifactError(f"'{artifact_path}' is corrupt (payload hash mismatch)")
+    kb = KnowledgeBase.from_tables(marshal.loads(payload))
+    kb.source_digest = source_digest
+    return kb
+
+
+def load_compiled_knowledge_base(prolog_file_path, artifact_path):
+    """The KnowledgeBase from artifact_path when it matches diagnosis.pl, else compiled from the source."""
+    started = time.perf_counter()
+    _source, digest = read_source(prolog_file_path)
+    try:
+        kb = load_artifact(artifact_path, digest)
+        origin = 'artifact'
+    except ArtifactError as e:
+        if os.path.exists(artifact_path):
+            log_event(logger, logging.WARNING, 'kb.artifact_rejected', path=artifact_path, error=str(e))
+        kb = load_knowledge_base(prolog_file_path)
+        origin = 'source'
+    log_event(logger, logging.INFO, 'kb.loaded', origin=origin, pid=os.getpid(),
+              seconds=round(time.perf_counter() - started, 6))
+    return kb
+
+
+def fresh_qlf(prolog_file_path, artifact_path, source_digest=None):
+    """Path of the .qlf recorded in the artifact if it and diagnosis.pl are unchanged since the build, else None.
+
+    With source_digest, the .qlf must have been built from that version of diagnosis.pl instead.
+    """
+    qlf_path = default_qlf_path(prolog_file_path)
+    try:
+        header = read_header(artifact_path)
+        if header['qlf_sha256'] == NO_QLF or not os.path.exists(qlf_path):
+            return None
+        if header['source_sha256'] != (source_digest or read_source(prolog_file_path)[1]) or _file_sha256(qlf_path) != header['qlf_sha256']:
+            return None
+    except (ArtifactError, OSError):
+        return None
+    return qlf_path
+
+
+def main(argv=None):
+    here = os.path.dirname(os.path.abspath(__file__))
+    parser = argparse.ArgumentParser(description="Compile diagnosis.pl into a knowledge base artifact for fast worker start-up.")
+    parser.add_argument('--prolog', default=os.path.join(here, 'diagnosis.pl'), help="Knowledge base source")
+    parser.add_argument('--output', default=os.environ.get('KB_ARTIFACT', os.path.join(here, 'diagnosis.kb')))
+    parser.add_argument('--qlf', action='store_true', help="Also build diagnosis.qlf with SWI-Prolog's qcompile/1")
+    args = parser.parse_args(argv)
+
+    qlf_path = compile_qlf(args.prolog) if args.qlf else None
+    kb = build_artifact(args.prolog, args.output, qlf_path)
+    print(f"Wrote {args.output} ({os.path.getsize(args.output)} bytes, {len(kb.diseases)} diseases, "
+          f"source sha256 {kb.source_digest[:12]})")
+    if qlf_path:
+        print(f"Wrote {qlf_path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
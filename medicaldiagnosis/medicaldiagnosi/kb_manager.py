@@ -0,0 +1,186 @@
+# kb_manager.py
+# Hot reloading of the compiled knowledge base. Edits to diagnosis.pl are noticed within
+# check_interval seconds of a request, then compiled, validated and prepared (vocabularies,
+# planner) on a background thread. Only a version that passes validation is published, by
+# swapping one reference: requests that already hold the old version finish on it, and a
+# broken diagnosis.pl leaves the running version in place.
+#
+# Each process (gunicorn worker) reloads on its own; threads do not survive fork(), so the
+# background reload is started by whichever process notices the change.
+#
+# With snapshot_dir, each version is compiled from a copy of diagnosis.pl named by its content
+# hash (KnowledgeBaseVersion.source_path), so the Prolog engine can consult exactly the rules
+# that were validated and published, whatever has been written to diagnosis.pl since.
+
+import hashlib
+import logging
+import os
+import threading
+import time
+
+from app_logging import get_logger, log_event
+from diagnosis_cache import SourceFingerprint
+from metrics import REGISTRY
+
+logger = get_logger('kb_manager')
+
+KB_RELOADS = REGISTRY.counter('kb_reloads_total', "Knowledge base reload attempts by outcome.", ('result',))
+
+ANSWER_VALUES = ('yes', 'no')
+
+
+class KnowledgeBaseValidationError(Exception):
+    """Raised when a diagnosis.pl fails validation; `errors` lists every problem found."""
+
+    def __init__(self, errors):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def validate_knowledge_base(kb):
+    """Returns the problems that keep a compiled diagnosis.pl from being served (empty if none)."""
+    errors = []
+    if kb.marker != 'loaded_successfully':
+        errors.append("test_consult_marker(loaded_successfully) does not hold.")
+    if not any(total > 0 for total in kb.total_weights):
+        errors.append("No disease/2 fact has symptoms with a positive weight.")
+    known = set(kb.diseases)
+    for disease in kb.follow_up_questions:
+        if disease not in known:
+            errors.append(f"follow_up_question/2 refers to unknown disease {disease!r}.")
+    for (question, answer), impacts in kb.answer_impacts.items():
+        if answer not in ANSWER_VALUES:
+            errors.append(f"answer_impact/4 for {question!r} uses answer {answer!r}; expected yes or no.")
+        for disease in impacts:
+            if disease not in known:
+                errors.append(f"answer_impact/4 for {question!r} refers to unknown disease {disease!r}.")
+    return errors
+
+
+class KnowledgeBaseVersion:
+    """One published knowledge base and everything derived from it; never changed after publishing."""
+
+    def __init__(self, kb, derived, source_path):
+        self.kb = kb
+        self.source_path = source_path # The file this version was compiled from
+        self.version = kb.source_digest[:12] # Same in every worker that loaded the same diagnosis.pl
+        self.loaded_at = time.time()
+        for name, value in derived.items():
+            setattr(self, name, value)
+
+
+class KnowledgeBaseManager:
+    """Publishes validated knowledge base versions; `current` is swapped atomically on reload.
+
+    load(prolog_file_path) compiles a KnowledgeBase; prepare(kb) returns the attributes to
+    attach to its KnowledgeBaseVersion (vocabularies, question planner, ...). With snapshot_dir,
+    versions are compiled from content-addressed copies of diagnosis.pl kept in that directory.
+    """
+
+    def __init__(self, prolog_file_path, load, prepare, check_interval=2.0, snapshot_dir=None):
+        self.prolog_file_path = prolog_file_path
+        self.check_interval = check_interval
+        self.snapshot_dir = snapshot_dir
+        self._load = load
+        self._prepare = prepare
+        self._fingerprint = SourceFingerprint(prolog_file_path)
+        self._current = None
+        self._reload_lock = threading.Lock() # One build at a time per process
+        self._next_check = 0.0
+        self._rejected_digest = None # Don't rebuild a diagnosis.pl that already failed validation
+        self.last_error = None
+
+    @property
+    def current(self):
+        return self._current
+
+    def _snapshot(self):
+        """The file to compile: diagnosis.pl, or with snapshot_dir a copy of it named by its sha256."""
+        if not self.snapshot_dir:
+            return self.prolog_file_path
+        with open(self.prolog_file_path, 'rb') as f:
+            data = f.read()
+        path = os.path.join(self.snapshot_dir, f"diagnosis-{hashlib.sha256(data).hexdigest()[:16]}.pl")
+        if not os.path.exists(path):
+            os.makedirs(self.snapshot_dir, exist_ok=True)
+            temp_path = f"{path}.{os.getpid()}.tmp" # Workers may write the same snapshot at once
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        return path
+
+    def _build(self, source_path):
+        kb = self._load(source_path)
+        errors = validate_knowledge_base(kb)
+        if errors:
+            raise KnowledgeBaseValidationError(errors)
+        return KnowledgeBaseVersion(kb, self._prepare(kb), source_path)
+
+    def load_initial(self):
+        """Builds and publishes the first version; an invalid diagnosis.pl is logged but still served,
+        since there is nothing older to fall back to."""
+        source_path = self._snapshot()
+        try:
+            self._current = self._build(source_path)
+        except KnowledgeBaseValidationError as e:
+            log_event(logger, logging.CRITICAL, 'kb.validation_failed', errors=e.errors)
+            kb = self._load(source_path)
+            self._current = KnowledgeBaseVersion(kb, self._prepare(kb), source_path)
+        log_event(logger, logging.INFO, 'kb.published', version=self._current.version, pid=os.getpid())
+        return self._current
+
+    def reload(self):
+        """Rebuilds from diagnosis.pl now and publishes it if valid: (published version, errors).
+
+        Returns the running version unchanged when diagnosis.pl has not changed.
+        """
+        with self._reload_lock:
+            current = self._current
+            try:
+                if current is not None and self._fingerprint.current() == current.kb.source_digest:
+                    KB_RELOADS.inc(result='unchanged')
+                    return current, []
+                started = time.perf_counter()
+                version = self._build(self._snapshot())
+            except KnowledgeBaseValidationError as e:
+                self._rejected_digest, self.last_error = self._fingerprint_digest(), e.errors
+                KB_RELOADS.inc(result='invalid')
+                log_event(logger, logging.ERROR, 'kb.reload_rejected', errors=e.errors,
+                          serving=current.version if current else None)
+                return current, e.errors
+            except Exception as e: # Parse errors, unreadable file: keep serving the old version
+                self._rejected_digest, self.last_error = self._fingerprint_digest(), [str(e)]
+                KB_RELOADS.inc(result='failed')
+                log_event(logger, logging.ERROR, 'kb.reload_failed', error=str(e),
+                          serving=current.version if current else None)
+                return current, [str(e)]
+            self._current = version # The swap: later requests see the new version, running ones keep theirs
+            self._rejected_digest, self.last_error = None, None
+            KB_RELOADS.inc(result='published')
+            log_event(logger, logging.INFO, 'kb.published', version=version.version, pid=os.getpid(),
+                      previous=current.version if current else None, seconds=round(time.perf_counter() - started, 4))
+            return version, []
+
+    def _fingerprint_digest(self):
+        try:
+            return self._fingerprint.current()
+        except OSError:
+            return None
+
+    def check_for_changes(self):
+        """Cheap per-request check: at most every check_interval seconds, stat diagnosis.pl and
+        start a background reload if its content changed. Never blocks the caller on a build."""
+        now = time.monotonic()
+        if now < self._next_check or self._reload_lock.locked():
+            return
+        self._next_check = now + self.check_interval
+        digest = self._fingerprint_digest()
+        if digest is None or digest == self._current.kb.source_digest or digest == self._rejected_digest:
+            return
+        threading.Thread(target=self.reload, name='kb-reload', daemon=True).start()
+
+    def status(self):
+        current = self._current
+        return {'version': current.version, 'source_sha256': current.kb.source_digest,
+                'loaded_at': current.loaded_at, 'diseases': len(current.kb.diseases),
+                'reloading': self._reload_lock.locked(), 'last_error': self.last_error}
@@ -0,0 +1,390 @@
+# knowledge_base.py
+# In-process compiled copy of the diagnosis.pl facts, with a native Python scorer
+# that mirrors symptom_match/5 without going through pyswip.
+
+import hashlib
+import re
+
+# Predicates we compile; every other clause in diagnosis.pl (the scoring rules) is skipped.
+COMPILED_PREDICATES = {
+    'test_consult_marker', 'bonus_per_risk_factor', 'max_risk_factor_bonus',
+    'disease', 'risk_factor', 'requires_test', 'severe', 'moderate', 'mild',
+    'follow_up_question', 'answer_impact', 'treatment', 'advice',
+}
+SEVERITY_LEVELS = ('severe', 'moderate', 'mild') # Severity predicates used by the generic advice/2 rules
+
+
+class KnowledgeBaseParseError(Exception):
+    """Raised when diagnosis.pl contains a fact the compiler cannot read."""
+
+
+class Var:
+    """A Prolog variable appearing in a clause head."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return f"Var({self.name})"
+
+
+# --- Minimal Prolog term reader (facts only: atoms, numbers, lists, tuples, compounds) ---
+_TOKEN_RE = re.compile(r"""
+    (?P<ws>\s+)
+  | (?P<comment>%[^\n]*)
+  | (?P<quoted>'(?:[^']|'')*')
+  | (?P<number>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)
+  | (?P<var>[A-Z_][A-Za-z0-9_]*)
+  | (?P<atom>[a-z][A-Za-z0-9_]*)
+  | (?P<neck>:-)
+  | (?P<end>\.(?=\s|$|%))
+  | (?P<punct>[()\[\],|!])
+  | (?P<other>\S)
+""", re.VERBOSE)
+
+
+def _tokenize(source):
+    tokens = []
+    for m in _TOKEN_RE.finditer(source):
+        kind = m.lastgroup
+        if kind in ('ws', 'comment'):
+            continue
+        tokens.append((kind, m.group(), m.start()))
+    return tokens
+
+
+def _split_clauses(tokens):
+    clause = []
+    for token in tokens:
+        if token[0] == 'end':
+            if clause:
+                yield clause
+            clause = []
+        else:
+            clause.append(token)
+    if clause:
+        raise KnowledgeBaseParseError(f"Unterminated clause starting at offset {clause[0][2]}")
+
+
+class _TermReader:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None, None)
+
+    def take(self, expected=None):
+        token = self.peek()
+        if token[0] is None or (expected is not None and token[1] != expected):
+            raise KnowledgeBaseParseError(f"Expected {expected!r}, got {token[1]!r} at offset {token[2]}")
+        self.pos += 1
+        return token
+
+    def term(self):
+        kind, text, offset = self.take()
+        if kind == 'quoted':
+            return text[1:-1].replace("''", "'")
+        if kind == 'number':
+            return float(text) if any(c in text for c in '.eE') else int(text)
+        if kind == 'var':
+            return Var(text)
+        if kind == 'atom':
+            if self.peek()[1] == '(': # Compound term name(Args...)
+                return (text, tuple(self.sequence('(', ')')))
+            return text
+        if text == '!':
+            return '!'
+        if text == '[':
+            self.pos -= 1
+            return list(self.sequence('[', ']'))
+        if text == '(':
+            self.pos -= 1
+            items = self.sequence('(', ')')
+            return items[0] if len(items) == 1 else tuple(items)
+        raise KnowledgeBaseParseError(f"Unexpected token {text!r} at offset {offset}")
+
+    def sequence(self, open_char, close_char):
+        self.take(open_char)
+        items = []
+        if self.peek()[1] == close_char:
+            self.take(close_char)
+            return items
+        while True:
+            items.append(self.term())
+            if self.peek()[1] == ',':
+                self.take(',')
+                continue
+            self.take(close_char)
+            return items
+
+
+def parse_clauses(source):
+    """Yields (name, args, body_goals) for every compiled predicate clause in a Prolog source string."""
+    for clause in _split_clauses(_tokenize(source)):
+        if clause[0][0] != 'atom' or clause[0][1] not in COMPILED_PREDICATES:
+            continue
+        reader = _TermReader(clause)
+        head = reader.term()
+        name, args = head if isinstance(head, tuple) else (head, ())
+        body = []
+        if reader.peek()[0] == 'neck':
+            reader.take()
+            body.append(reader.term())
+            while reader.peek()[1] == ',':
+                reader.take(',')
+                body.append(reader.term())
+        if reader.peek()[0] is not None:
+            raise KnowledgeBaseParseError(f"Unsupported syntax in {name}/{len(args)} at offset {reader.peek()[2]}")
+        yield name, args, body
+
+
+# --- Compiled knowledge base ---
+class KnowledgeBase:
+    """Facts of diagnosis.pl compiled into indexes for fast in-process scoring."""
+
+    def __init__(self, clauses):
+        self.marker = None
+        self.bonus_per_risk_factor = 0
+        self.max_risk_factor_bonus = 0
+        self.diseases = [] # findall order of disease/2, used for tie-breaking like the Prolog path
+        self.disease_symptoms = []
+        self.total_weights = []
+        self.risk_factors = {}
+        self.tests = {}
+        self.severity = {level: set() for level in SEVERITY_LEVELS}
+        self.follow_up_questions = {}
+        self.answer_impacts = {}
+        self.treatments = {}
+        self.advice = {}
+        self.severity_advice = [] # [(level, text)] in clause order of the generic advice/2 rules
+        self.default_advice = None
+        self.source_digest = None # sha256 of diagnosis.pl when loaded from a file
+        self.symptom_bit_index = [] # Filled by index_vocabulary()
+        self.risk_bit_index = []
+
+        for name, args, body in clauses:
+            getattr(self, f"_add_{name}")(args, body)
+
+        # Inverted indexes: symptom -> [(disease_index, weight)], risk factor -> [disease_index]
+        self.symptom_index = {}
+        for index, symptoms in enumerate(self.disease_symptoms):
+            seen = set()
+            for symptom, weight in symptoms:
+                if symptom not in seen: # member/2 stops at the first matching pair
+                    seen.add(symptom)
+                    self.symptom_index.setdefault(symptom, []).append((index, weight))
+        self.risk_index = {}
+        self.disease_positions = {}
+        for index, disease in enumerate(self.diseases):
+            self.disease_positions.setdefault(disease, []).append(index)
+            for factor in self.risk_factors.get(disease, ()):
+                self.risk_index.setdefault(factor, []).append(index)
+        self.risk_index = {factor: sorted(set(indexes)) for factor, indexes in self.risk_index.items()}
+
+    def tables(self):
+        """The compiled facts and indexes as plain containers, for kb_artifact.py; vocabulary indexes stay per process."""
+        return {name: value for name, value in vars(self).items() if name not in ('symptom_bit_index', 'risk_bit_index')}
+
+    @classmethod
+    def from_tables(cls, tables):
+        """Rebuilds a KnowledgeBase from tables() without parsing diagnosis.pl."""
+        kb = cls(())
+        vars(kb).update(tables)
+        return kb
+
+    def _add_test_consult_marker(self, args, body):
+        self.marker = args[0]
+
+    def _add_bonus_per_risk_factor(self, args, body):
+        self.bonus_per_risk_factor = args[0]
+
+    def _add_max_risk_factor_bonus(self, args, body):
+        self.max_risk_factor_bonus = args[0]
+
+    def _add_disease(self, args, body):
+        name, symptoms = args
+        self.diseases.append(name)
+        self.disease_symptoms.append([tuple(pair) for pair in symptoms])
+        total = 0
+        for _symptom, weight in reversed(symptoms): # Same summation order as total_weight/2
+            total = weight + total
+        self.total_weights.append(total)
+
+    def _add_risk_factor(self, args, body):
+        self.risk_factors.setdefault(args[0], frozenset(args[1])) # risk_factor_bonus/3 cuts after the first clause
+
+    def _add_requires_test(self, args, body):
+        self.tests.setdefault(args[0], args[1])
+
+    def _add_severity(self, level, args):
+        self.severity[level].add(args[0])
+
+    def _add_severe(self, args, body):
+        self._add_severity('severe', args)
+
+    def _add_moderate(self, args, body):
+        self._add_severity('moderate', args)
+
+    def _add_mild(self, args, body):
+        self._add_severity('mild', args)
+
+    def _add_follow_up_question(self, args, body):
+        self.follow_up_questions.setdefault(args[0], []).append(args[1])
+
+    def _add_answer_impact(self, args, body):
+        disease, question, answer, adjustment = args
+        self.answer_impacts.setdefault((question, answer), {}).setdefault(disease, adjustment)
+
+    def _add_treatment(self, args, body):
+        self.treatments.setdefault(args[0], list(args[1]))
+
+    def _add_advice(self, args, body):
+        disease, text = args
+        if not isinstance(disease, Var):
+            self.advice.setdefault(disease, text)
+            return
+        goals = [goal for goal in body if isinstance(goal, tuple)]
+        if not goals:
+            if self.default_advice is None:
+                self.default_advice = text
+        elif goals[0][0] in SEVERITY_LEVELS:
+            self.severity_advice.append((goals[0][0], text))
+        else:
+            raise KnowledgeBaseParseError(f"Unsupported advice/2 rule body: {body!r}")
+
+    # --- Queries mirroring diagnosis.pl ---
+    def base_scores(self, symptoms, risk_factors):
+        """The answer-independent part of symptom_match/5: {disease_index: symptom percent + risk bonus}.
+
+        Only diseases sharing a symptom or risk factor with the request appear; pass the result
+        to rescore() to apply answers without matching the symptoms again.
+        """
+        matched = {}
+        for symptom in reversed(symptoms): # symptom_score/3 sums right-to-left; keep float rounding identical
+            for index, weight in self.symptom_index.get(symptom, ()):
+                matched[index] = weight + matched.get(index, 0)
+
+        risk_counts = {}
+        for factor in risk_factors: # intersection/3 keeps duplicates from the user's list
+            for index in self.risk_index.get(factor, ()):
+                risk_counts[index] = risk_counts.get(index, 0) + 1
+        return self._base_from_counts(matched, risk_counts)
+
+    def index_vocabulary(self, symptom_atoms, risk_atoms):
+        """Per-bit posting lists for scoring bitset selections; atoms are in bit order (see vocabulary.py)."""
+        self.symptom_bit_index = [self.symptom_index.get(atom, ()) for atom in symptom_atoms]
+        self.risk_bit_index = [self.risk_index.get(atom, ()) for atom in risk_atoms]
+
+    def mask_base_scores(self, symptom_mask, risk_mask):
+        """base_scores() for bitset selections, i.e. for the selected atoms listed in bit order."""
+        matched = {}
+        while symptom_mask: # Highest bit first: the same right-to-left sum as base_scores()
+            bit = symptom_mask.bit_length() - 1
+            symptom_mask ^= 1 << bit
+            for index, weight in self.symptom_bit_index[bit] if bit < len(self.symptom_bit_index) else ():
+                matched[index] = weight + matched.get(index, 0)
+
+        risk_counts = {}
+        while risk_mask:
+            bit = risk_mask.bit_length() - 1
+            risk_mask ^= 1 << bit
+            for index in self.risk_bit_index[bit] if bit < len(self.risk_bit_index) else ():
+                risk_counts[index] = risk_counts.get(index, 0) + 1
+        return self._base_from_counts(matched, risk_counts)
+
+    def _base_from_counts(self, matched, risk_counts):
+        base = {}
+        for index in set(matched) | set(risk_counts):
+            if self.total_weights[index] <= 0:
+                continue # Never scored by symptom_match/5
+            bonus = min(risk_counts.get(index, 0) * self.bonus_per_risk_factor, self.max_risk_factor_bonus)
+            # (Percent + Bonus) + Adjustment in Prolog, so adding the adjustment later rounds identically
+            base[index] = (matched.get(index, 0) / self.total_weights[index]) * 100 + bonus
+        return base
+
+    def rescore(self, base_scores, answers):
+        """symptom_match/5 results from base_scores() plus the answer_impact/4 adjustments of `answers`."""
+        impacts = [self.answer_impacts.get((question, answer), {}) for question, answer in answers]
+        candidates = set(base_scores)
+        for impact in impacts:
+            for disease in impact:
+                candidates.update(self.disease_positions.get(disease, ()))
+
+        scores = {}
+        for index in candidates:
+            disease = self.diseases[index]
+            adjustment = 0
+            for impact in reversed(impacts):
+                adjustment = impact.get(disease, 0) + adjustment
+            scores[index] = max(0.0, min(base_scores.get(index, 0.0) + adjustment, 100.0))
+
+        return [(disease, scores.get(index, 0.0))
+                for index, disease in enumerate(self.diseases) if self.total_weights[index] > 0]
+
+    def symptom_match(self, symptoms, risk_factors, answers):
+        """Returns [(disease, score)] for every disease, in the order findall/3 over symptom_match/5 would.
+
+        Only diseases sharing a symptom or risk factor with the request, or affected by one of
+        the answers, are scored; all others score 0.0 exactly as they would in Prolog.
+        """
+        return self.rescore(self.base_scores(symptoms, risk_factors), answers)
+
+    def follow_ups_for(self, disease):
+        """All follow_up_question/2 answers for a disease, in clause order."""
+        return list(self.follow_up_questions.get(disease, ()))
+
+    def test_for(self, disease):
+        """First requires_test/2 solution, or None."""
+        return self.tests.get(disease)
+
+    def treatment_for(self, disease):
+        """First treatment/2 solution, or None."""
+        return self.treatments.get(disease)
+
+    def advice_for(self, disease):
+        """First advice/2 solution: specific advice, then severity-based, then the generic fallback."""
+        if disease in self.advice:
+            return self.advice[disease]
+        for level, text in self.severity_advice:
+            if disease in self.severity[level]:
+                return text
+        return self.default_advice
+
+    def diagnosis_bundle(self, symptoms, risk_factors, answers, follow_up_k, base_scores=None):
+        """Python counterpart of diagnosis_bundle/9.
+
+        Returns the ranked (disease, score) list best first, the sorted unique follow-up questions
+        for the top follow_up_k diseases, and the test, treatment and advice of the leader.
+        Pass base_scores() from an earlier pass over the same symptoms to only apply the answers.
+        """
+        if base_scores is None:
+            base_scores = self.base_scores(symptoms, risk_factors)
+        ranked = sorted(self.rescore(base_scores, answers), key=lambda x: x[1], reverse=True)
+        questions = sorted({q for disease, _score in ranked[:follow_up_k] for q in self.follow_ups_for(disease)})
+        test, treatment, advice = None, None, None
+        if ranked:
+            top = ranked[0][0]
+            test, treatment, advice = self.test_for(top), self.treatment_for(top), self.advice_for(top)
+        return {
+            'ranked': ranked,
+            'follow_up_questions': questions,
+            'test': test if test is not None else 'N/S',
+            'treatment': treatment if treatment is not None else ['N/S info'],
+            'advice': advice if advice is not None else 'General advice.',
+        }
+
+
+def read_source(prolog_file_path):
+    """Returns (source text, sha256 hex digest of the file's bytes)."""
+    with open(prolog_file_path, 'rb') as f:
+        data = f.read()
+    return data.decode('utf-8'), hashlib.sha256(data).hexdigest()
+
+
+def load_knowledge_base(prolog_file_path):
+    """Reads and compiles diagnosis.pl into a KnowledgeBase."""
+    source, digest = read_source(prolog_file_path)
+    kb = KnowledgeBase(parse_clauses(source))
+    kb.source_digest = digest
+    return kb
@@ -0,0 +1,158 @@
+# metrics.py
+# In-process counters and histograms rendered in the Prometheus text exposition format.
+#
+# Each worker process keeps its own registry; scrape every worker (or run one per host)
+# and aggregate in Prometheus. Recording a sample is a dict lookup plus a few additions
+# under a lock, cheap enough for every request.
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Latency buckets in seconds, from sub-millisecond KB lookups to multi-second report renders
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _label_text(label_names, label_values):
+    if not label_names:
+        return ''
+    pairs = []
+    for name, value in zip(label_names, label_values):
+        escaped = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{escaped}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+class Counter:
+    """Monotonic counter, optionally split by label values."""
+
+    kind = 'counter'
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f"{self.name}{_label_text(self.label_names, key)} {value}" for key, value in items]
+
+
+class Histogram:
+    """Cumulative-bucket histogram with sum and count, optionally split by label values."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {} # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, list(series)) for key, series in self._series.items())
+        lines = []
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_label_text(self.label_names + ('le',), key + (le,))} {cumulative}")
+            labels = _label_text(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Named metrics plus gauge callbacks evaluated at scrape time."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._gauges = [] # (name, help, label_name, callback returning a value or {label_value: value})
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing # Module reloads and repeated imports share the first instance
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def gauge_callback(self, name, help_text, callback, label_name=None):
+        with self._lock:
+            self._gauges = [g for g in self._gauges if g[0] != name] + [(name, help_text, label_name, callback)]
+
+    def render(self):
+        """Returns every metric in the Prometheus text format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+            gauges = list(self._gauges)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help_text}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        for name, help_text, label_name, callback in gauges:
+            try:
+                value = callback()
+            except Exception:
+                continue # A failing collector must not break the whole scrape
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            if isinstance(value, dict):
+                for label_value, item in sorted(value.items()):
+                    lines.append(f"{name}{_label_text((label_name,), (label_value,))} {item}")
+            elif value is not None:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Shared stage timers; modules import these instead of registering their own copies
+PROLOG_CONSULT_SECONDS = REGISTRY.histogram('prolog_consult_seconds', "Time spent consulting diagnosis.pl.")
+PROLOG_QUERY_SECONDS = REGISTRY.histogram('prolog_query_seconds', "Time per Prolog query, by goal.", ('goal',))
+DIAGNOSIS_ENGINE_SECONDS = REGISTRY.histogram('diagnosis_engine_seconds', "Time to score one diagnosis bundle (cache misses only).", ('engine',))
+DB_QUERY_SECONDS = REGISTRY.histogram('db_query_seconds', "Time per database helper call.", ('function',))
+REPORT_STAGE_SECONDS = REGISTRY.histogram('report_stage_seconds', "PDF report time by stage.", ('stage',))
+CHART_RENDER_SECONDS = REGISTRY.histogram('chart_render_seconds', "Time to render the statistics chart PNG.")
+HTTP_REQUEST_SECONDS = REGISTRY.histogram('http_request_duration_seconds', "Request latency by endpoint.", ('endpoint', 'method', 'status'))
+ERRORS_TOTAL = REGISTRY.counter('errors_total', "Handled errors by component.", ('component',))
@@ -0,0 +1,212 @@
+# password_hashing.py
+# Salted, tunable password hashing with pluggable algorithms, and a bounded executor that
+# keeps key-derivation work from taking over the server during login storms.
+#
+# Stored hashes carry their algorithm and parameters ("pbkdf2_sha256$600000$<salt>$<hash>"),
+# so the cost can be raised later: hashes made with an older algorithm or cost (including
+# the unsalted SHA-256 hex digests of the first user table) verify as before and are
+# replaced on the user's next successful login.
+
+import base64
+import hashlib
+import hmac
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import REGISTRY
+
+KDF_SECONDS = REGISTRY.histogram('auth_kdf_seconds', "Password hash/verify time in the KDF executor.", ('algorithm',))
+KDF_REJECTED = REGISTRY.counter('auth_kdf_rejected_total', "Password checks refused because a concurrency limit was reached.", ('limit',))
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _unb64(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+class PBKDF2Hasher:
+    """PBKDF2-HMAC-SHA256; hashlib runs it without holding the GIL."""
+
+    algorithm = 'pbkdf2_sha256'
+
+    def __init__(self, iterations=600_000, salt_bytes=16):
+        self.iterations = iterations
+        self.salt_bytes = salt_bytes
+
+    def encode(self, password):
+        salt = os.urandom(self.salt_bytes)
+        digest = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, self.iterations)
+        return f"{self.algorithm}${self.iterations}${_b64(salt)}${_b64(digest)}"
+
+    def verify(self, password, encoded):
+        _algorithm, iterations, salt, digest = encoded.split('$')
+        expected = _unb64(digest)
+        actual = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), _unb64(salt), int(iterations), len(expected))
+        return hmac.compare_digest(actual, expected)
+
+    def needs_update(self, encoded):
+        return int(encoded.split('$')[1]) != self.iterations
+
+
+class ScryptHasher:
+    """scrypt (memory-hard); parameters n, r, p are stored with each hash."""
+
+    algorithm = 'scrypt'
+
+    def __init__(self, n=2 ** 14, r=8, p=1, salt_bytes=16):
+        self.n, self.r, self.p = n, r, p
+        self.salt_bytes = salt_bytes
+
+    def _derive(self, password, salt, n, r, p, length=32):
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=n, r=r, p=p, maxmem=256 * n * r + 1024 * 1024, dklen=length)
+
+    def encode(self, password):
+        salt = os.urandom(self.salt_bytes)
+        digest = self._derive(password, salt, self.n, self.r, self.p)
+        return f"{self.algorithm}${self.n}${self.r}${self.p}${_b64(salt)}${_b64(digest)}"
+
+    def verify(self, password, encoded):
+        _algorithm, n, r, p, salt, digest = encoded.split('$')
+        expected = _unb64(digest)
+        return hmac.compare_digest(self._derive(password, _unb64(salt), int(n), int(r), int(p), len(expected)), expected)
+
+    def needs_update(self, encoded):
+        return tuple(int(v) for v in encoded.split('$')[1:4]) != (self.n, self.r, self.p)
+
+
+class LegacySHA256Hasher:
+    """The original unsalted sha256 hex digests; verify only, always rehashed on login."""
+
+    algorithm = 'sha256'
+
+    @staticmethod
+    def matches(encoded):
+        return len(encoded) == 64 and all(c in '0123456789abcdef' for c in encoded.lower())
+
+    def encode(self, password):
+        raise ValueError("legacy sha256 hashes are verify-only")
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(hashlib.sha256(password.encode('utf-8')).hexdigest(), encoded.lower())
+
+    def needs_update(self, encoded):
+        return True
+
+
+HASHERS = {hasher.algorithm: hasher for hasher in (PBKDF2Hasher, ScryptHasher)}
+
+
+class PasswordHashers:
+    """New passwords use `preferred`; stored hashes are verified with whichever hasher made them."""
+
+    def __init__(self, preferred):
+        self.preferred = preferred
+        self._legacy = LegacySHA256Hasher()
+        self._dummy_hash = None # Verified against when the email is unknown, so both cases cost the same
+
+    def hasher_for(self, encoded):
+        if self._legacy.matches(encoded):
+            return self._legacy
+        algorithm = encoded.split('$', 1)[0]
+        if algorithm == self.preferred.algorithm:
+            return self.preferred
+        if algorithm in HASHERS:
+            return HASHERS[algorithm]() # Default parameters; verify() reads the stored ones
+        raise ValueError(f"Unknown password hash algorithm {algorithm!r}")
+
+    def hash(self, password):
+        with KDF_SECONDS.time(algorithm=self.preferred.algorithm):
+            return self.preferred.encode(password)
+
+    def check(self, encoded, password):
+        """Verifies password against a stored hash: (matches, replacement hash or None).
+
+        encoded=None (unknown user) still does one full verification and returns (False, None).
+        The replacement is set, always made by `preferred`, when the hash was not made by it:
+        a legacy sha256 digest, another algorithm, or outdated parameters.
+        """
+        if encoded is None:
+            if self._dummy_hash is None:
+                self._dummy_hash = self.preferred.encode(os.urandom(16).hex())
+            with KDF_SECONDS.time(algorithm=self.preferred.algorithm):
+                self.preferred.verify(password, self._dummy_hash)
+            return False, None
+        hasher = self.hasher_for(encoded)
+        with KDF_SECONDS.time(algorithm=hasher.algorithm):
+            if not hasher.verify(password, encoded):
+                return False, None
+        if hasher is not self.preferred or self.preferred.needs_update(encoded):
+            return True, self.hash(password)
+        return True, None
+
+
+class KdfBusyError(Exception):
+    """Raised when a password check is refused by a concurrency limit; `limit` names which one."""
+
+    def __init__(self, limit):
+        super().__init__(f"Too many password checks in progress ({limit})")
+        self.limit = limit
+
+
+class KdfExecutor:
+    """Runs password hashing on a few dedicated threads.
+
+    At most `threads + max_pending` checks are admitted at once, and at most `per_key` of them
+    for any one key (client IP, email); past a limit the caller gets KdfBusyError immediately
+    instead of queueing, so a login storm is turned away cheaply and CPU stays available for
+    everything else.
+    """
+
+    def __init__(self, threads=2, max_pending=16, per_key=None):
+        self.threads = threads
+        self.limit = threads + max_pending
+        self.per_key = per_key or {} # key kind -> concurrent checks allowed, e.g. {'ip': 4, 'email': 1}
+        self.in_flight = 0
+        self._keys = {}
+        self._lock = threading.Lock()
+        self._executor = None
+        self._executor_pid = None
+
+    def _acquire(self, keys):
+        with self._lock:
+            if self.in_flight >= self.limit:
+                raise KdfBusyError('total')
+            for kind, value in keys:
+                if self._keys.get((kind, value), 0) >= self.per_key.get(kind, self.limit):
+                    raise KdfBusyError(kind)
+            self.in_flight += 1
+            for key in keys:
+                self._keys[key] = self._keys.get(key, 0) + 1
+
+    def _release(self, keys):
+        with self._lock:
+            self.in_flight -= 1
+            for key in keys:
+                if self._keys[key] <= 1:
+                    del self._keys[key]
+                else:
+                    self._keys[key] -= 1
+
+    def _pool(self):
+        # Threads do not survive fork(), so the pool is (re)created in whichever process uses it
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='kdf')
+            self._executor_pid = os.getpid()
+        return self._executor
+
+    def run(self, func, *args, keys=()):
+        """func(*args) on a KDF thread, waiting for the result; raises KdfBusyError if a limit is reached."""
+        keys = [(kind, value) for kind, value in keys if value]
+        try:
+            self._acquire(keys)
+        except KdfBusyError as e:
+            KDF_REJECTED.inc(limit=e.limit)
+            raise
+        try:
+            return self._pool().submit(func, *args).result()
+        finally:
+            self._release(keys)
@@ -0,0 +1,106 @@
+# prolog_engine.py
+# Long-lived Prolog engine: consults diagnosis.pl once per worker process and
+# serves every query from that loaded state.
+
+import logging
+import os
+import re
+import threading
+import time
+
+from app_logging import get_logger, log_event
+from metrics import PROLOG_CONSULT_SECONDS, PROLOG_QUERY_SECONDS
+
+logger = get_logger('prolog')
+GOAL_NAME = re.compile(r"\s*([a-z][A-Za-z0-9_]*)")
+
+
+class KnowledgeBaseLoadError(Exception):
+    """Raised when the Prolog knowledge base cannot be consulted."""
+
+
+class PrologEngine:
+    """Process-wide wrapper around the (non-reentrant) SWI-Prolog engine.
+
+    All consults and queries are serialized through a single lock: pyswip shares one
+    embedded SWI-Prolog instance per process and a query must be fully consumed before
+    the next one is opened.
+
+    With `published` (a callable returning the KnowledgeBaseVersion being served), the engine
+    consults that version's source_path whenever the published version changes, so it only
+    ever runs rules that passed validation. Without it, diagnosis.pl is re-consulted when its
+    mtime/size changes on disk. Either way it is re-consulted in a freshly forked worker.
+    """
+
+    def __init__(self, prolog_file_path, compiled_file=None, published=None):
+        self.prolog_file_path = prolog_file_path
+        self.compiled_file = compiled_file # Callable(source sha256 or None) returning a matching .qlf to consult instead, or None
+        self.published = published
+        self._lock = threading.RLock()
+        self._prolog = None
+        self._loaded_signature = None # Published version digest, or (mtime_ns, size) of the consulted file
+        self._loaded_pid = None
+        self.consult_count = 0
+
+    def _file_signature(self):
+        st = os.stat(self.prolog_file_path) # Raises FileNotFoundError if the KB is gone
+        return (st.st_mtime_ns, st.st_size)
+
+    @staticmethod
+    def _atom(path):
+        # Forward slashes and escaped quotes keep the path a valid Prolog atom
+        return "'{}'".format(path.replace("\\", "/").replace("'", "''"))
+
+    def _consult_goal(self, path):
+        if os.path.abspath(path) == os.path.abspath(self.prolog_file_path):
+            return f"consult({self._atom(path)})"
+        # A version snapshot is loaded under diagnosis.pl's name, so each load replaces the previous clauses
+        return (f"setup_call_cleanup(open({self._atom(path)}, read, S), "
+                f"load_files({self._atom(os.path.abspath(self.prolog_file_path))}, [stream(S)]), close(S))")
+
+    def _consult(self, signature, source_path, source_digest=None):
+        compiled_path = self.compiled_file(source_digest) if self.compiled_file else None
+        consult_goal = self._consult_goal(compiled_path or source_path)
+        log_event(logger, logging.INFO, 'prolog.consult', goal=consult_goal, pid=os.getpid())
+        started = time.perf_counter()
+        try:
+            if self._prolog is None:
+                from pyswip import Prolog # Imported lazily: SWI-Prolog is only needed when this engine is used
+                self._prolog = Prolog()
+            # Re-consulting the same file replaces its clauses, so this also serves as a reload
+            try:
+                list(self._prolog.query(consult_goal))
+            except Exception as e:
+                if not compiled_path:
+                    raise
+                # A .qlf from another SWI-Prolog version is refused; the source always loads
+                log_event(logger, logging.WARNING, 'prolog.qlf_rejected', path=compiled_path, error=str(e))
+                list(self._prolog.query(self._consult_goal(source_path)))
+        except Exception as e:
+            self._loaded_signature = None
+            raise KnowledgeBaseLoadError(f"Could not consult '{source_path}': {e}") from e
+        PROLOG_CONSULT_SECONDS.observe(time.perf_counter() - started)
+        self._loaded_signature = signature
+        self._loaded_pid = os.getpid()
+        self.consult_count += 1
+
+    def ensure_loaded(self):
+        """Consults the knowledge base if it is not loaded yet or has changed (published version or file on disk)."""
+        with self._lock:
+            if self.published is not None:
+                version = self.published()
+                digest = version.kb.source_digest
+                if digest != self._loaded_signature or self._loaded_pid != os.getpid():
+                    self._consult(digest, version.source_path, digest)
+                return
+            signature = self._file_signature()
+            if signature != self._loaded_signature or self._loaded_pid != os.getpid():
+                self._consult(signature, self.prolog_file_path)
+
+    def query(self, query_string):
+        """Runs a goal against the loaded knowledge base and returns all solutions as a list."""
+        match = GOAL_NAME.match(query_string)
+        with self._lock:
+            self.ensure_loaded() # Consult time is recorded separately from the query itself
+            with PROLOG_QUERY_SECONDS.time(goal=match.group(1) if match else 'other'):
+                return list(self._prolog.query(query_string))
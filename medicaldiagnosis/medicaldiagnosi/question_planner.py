@@ -0,0 +1,109 @@
+# question_planner.py
+# Chooses which follow-up questions are worth asking.
+#
+# Only answer_impact/4 facts move scores, so a question whose answers cannot reorder the
+# top-k diseases cannot change what the results page shows. The planner scores every
+# candidate question by re-ranking under each possible answer and ranks the questions by
+# the expected change to the top-k ordering (answers assumed equally likely). While the
+# leader could still be overtaken by some combination of answers, questions that only
+# matter in combination are kept too, so the final leader matches asking everything.
+
+ANSWERS = ('yes', 'no')
+
+
+def _top_k_order(ranked, k):
+    return [disease for disease, _score in ranked[:k]]
+
+
+def ordering_change(before, after):
+    """Distance between two top-k orderings: a leader change counts double, plus each
+    disease that moved, entered or left the list."""
+    distance = 2 if before[:1] != after[:1] else 0
+    for position, disease in enumerate(before):
+        if position >= len(after) or after[position] != disease:
+            distance += 1
+    return distance
+
+
+class QuestionPlan:
+    """Candidate questions ranked by expected effect; `dropped` ones cannot change the top-k ordering or the leader."""
+
+    def __init__(self, questions, dropped, effects, leader_decided):
+        self.questions = questions
+        self.dropped = dropped
+        self.effects = effects # question -> expected ordering change
+        self.leader_decided = leader_decided
+
+    def next_question(self):
+        return self.questions[0] if self.questions and not self.leader_decided else None
+
+
+class QuestionPlanner:
+    def __init__(self, kb, top_k=3):
+        self.kb = kb
+        self.top_k = top_k
+
+    def _rank(self, base_scores, answers):
+        # Same sort as diagnosis_bundle: stable, so ties keep knowledge base order
+        return sorted(self.kb.rescore(base_scores, answers), key=lambda x: x[1], reverse=True)
+
+    def candidate_questions(self, ranked, asked=()):
+        """Follow-up questions of the current top-k diseases that have not been asked yet, sorted."""
+        asked = set(asked)
+        return sorted({q for disease in _top_k_order(ranked, self.top_k) for q in self.kb.follow_ups_for(disease)} - asked)
+
+    def _adjustments(self, question, answer):
+        return self.kb.answer_impacts.get((question, answer), {})
+
+    def leader_decided(self, ranked, questions):
+        """True if no combination of answers to `questions` can overtake the current leader.
+
+        Uses unclipped score swings, which can only overestimate how far a challenger can
+        close the gap, so a True result is safe.
+        """
+        if len(ranked) < 2:
+            return True
+        leader, leader_score = ranked[0]
+        for challenger, challenger_score in ranked[1:]:
+            gap = leader_score - challenger_score
+            swing = 0
+            for question in questions:
+                swing += max(0, max(self._adjustments(question, a).get(challenger, 0) - self._adjustments(question, a).get(leader, 0)
+                                    for a in ANSWERS))
+            # A tie keeps the leader only if it sorts first; treat any reachable tie as undecided
+            if swing >= gap and swing > 0:
+                return False
+        return True
+
+    def plan(self, symptoms, risk_factors, answers=(), asked=(), ranked=None, base_scores=None):
+        """Ranks the unasked follow-up questions of the current top-k by expected top-k ordering change.
+
+        Symptoms are matched once (or not at all when base_scores is given); each hypothetical
+        answer only re-applies answer adjustments.
+        """
+        answers = list(answers)
+        if base_scores is None:
+            base_scores = self.kb.base_scores(symptoms, risk_factors)
+        if ranked is None:
+            ranked = self._rank(base_scores, answers)
+        current = _top_k_order(ranked, self.top_k)
+        effects = {}
+        for question in self.candidate_questions(ranked, asked):
+            if not any(self._adjustments(question, a) for a in ANSWERS):
+                effects[question] = 0.0 # No answer_impact facts: nothing to re-score
+                continue
+            expected = 0.0
+            for answer in ANSWERS:
+                if self._adjustments(question, answer):
+                    after = _top_k_order(self._rank(base_scores, answers + [(question, answer)]), self.top_k)
+                    expected += ordering_change(current, after) / len(ANSWERS)
+            effects[question] = expected
+        useful = sorted((q for q, effect in effects.items() if effect > 0), key=lambda q: (-effects[q], q))
+        decided = self.leader_decided(ranked, list(effects))
+        if not decided:
+            # Questions that cannot move the top-k alone may still flip the leader together with
+            # others; keep any that re-score something, after the ones that matter alone
+            useful += sorted(q for q, effect in effects.items()
+                             if effect <= 0 and any(self._adjustments(q, a) for a in ANSWERS))
+        dropped = sorted(q for q in effects if q not in useful)
+        return QuestionPlan(useful, dropped, effects, decided)
@@ -0,0 +1,281 @@
+# report_jobs.py
+# Background report generation: a local job queue drained by a small pool of worker
+# threads, so PDF layout/writes and the history insert happen off the request path.
+#
+# A job runs in the process that queued it, but its state is also written to the
+# report_jobs table (ReportJobStore), so status polls and downloads answered by any other
+# worker process see the same job.
+
+import itertools
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+
+from app_logging import get_logger, log_event
+
+logger = get_logger('report_jobs')
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+class ReportJob:
+    """One report generation request and its progress."""
+
+    def __init__(self, job_id, user_id, func, args):
+        self.id = job_id
+        self.user_id = user_id
+        self.func = func
+        self.args = args
+        self.status = QUEUED
+        self.attempts = 0
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.finished = threading.Event() # Set once the job is DONE or FAILED
+        self.callbacks = []
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.error,
+            'filename': os.path.basename(self.result) if self.status == DONE and self.result else None,
+            'queued_seconds': round((self.started_at or time.time()) - self.created_at, 3),
+            'duration_seconds': round(self.finished_at - self.started_at, 3) if self.finished_at and self.started_at else None,
+        }
+
+    @classmethod
+    def from_row(cls, row):
+        """A read-only copy of a job loaded from the report_jobs table."""
+        job = cls(row['id'], row['user_id'], None, ())
+        job.status, job.attempts, job.error, job.result = row['status'], row['attempts'], row['error'], row['result_path']
+        job.created_at, job.started_at, job.finished_at = row['created_at'], row['started_at'], row['finished_at']
+        if job.status in (DONE, FAILED):
+            job.finished.set()
+        return job
+
+
+class ReportJobStore:
+    """Job state in the report_jobs table, shared by every worker process.
+
+    connection() returns the calling thread's sqlite3 connection. A job still queued or
+    running after stale_after seconds is reported as failed: the process running it is gone
+    (a restart or a recycled worker), so it would otherwise never finish.
+    """
+
+    def __init__(self, connection, stale_after=600, keep_seconds=7 * 24 * 3600, prune_interval=3600):
+        self.connection = connection
+        self.stale_after = stale_after
+        self.keep_seconds = keep_seconds
+        self.prune_interval = prune_interval
+        self._last_prune = 0.0
+
+    def save(self, job):
+        db = self.connection()
+        try:
+            db.execute("""INSERT OR REPLACE INTO report_jobs (id, user_id, status, attempts, error, result_path,
+                                                                created_at, started_at, finished_at, updated_at)
+                          VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                       (job.id, job.user_id, job.status, job.attempts, job.error, job.result,
+                        job.created_at, job.started_at, job.finished_at, time.time()))
+            db.commit()
+        except sqlite3.Error as e:
+            db.rollback()
+            log_event(logger, logging.ERROR, 'report_job.save_failed', job_id=job.id, error=str(e))
+
+    def load(self, job_id):
+        try:
+            row = self.connection().execute("SELECT * FROM report_jobs WHERE id = ?", (job_id,)).fetchone()
+        except sqlite3.Error as e:
+            log_event(logger, logging.ERROR, 'report_job.load_failed', job_id=job_id, error=str(e))
+            return None
+        if row is None:
+            return None
+        job = ReportJob.from_row(row)
+        if job.status in (QUEUED, RUNNING) and time.time() - row['updated_at'] > self.stale_after:
+            job.status, job.error = FAILED, "The report worker stopped before the job finished."
+            job.finished.set()
+        return job
+
+    def prune(self):
+        """Deletes finished jobs older than keep_seconds."""
+        db = self.connection()
+        try:
+            db.execute("DELETE FROM report_jobs WHERE finished_at IS NOT NULL AND finished_at < ?", (time.time() - self.keep_seconds,))
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+
+    def maybe_prune(self):
+        # At most once per interval per process
+        now = time.monotonic()
+        if now - self._last_prune >= self.prune_interval:
+            self._last_prune = now
+            self.prune()
+
+
+class ReportJobQueue:
+    """In-process job queue with retrying worker threads and basic queue/duration metrics.
+
+    A job function returns the report path on success; returning a falsy value or raising
+    counts as a failed attempt and the job is retried up to max_attempts times.
+    """
+
+    def __init__(self, worker_count=2, max_attempts=3, retry_delay=1.0, max_tracked_jobs=1000, store=None):
+        self.worker_count = worker_count
+        self.store = store # ReportJobStore; None keeps jobs visible to this process only
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_tracked_jobs = max_tracked_jobs
+        self._queue = queue.Queue()
+        self._jobs = OrderedDict() # job_id -> ReportJob, oldest first
+        self._lock = threading.Lock()
+        self._workers = []
+        self._workers_pid = None
+        self._durations = deque(maxlen=500) # Seconds per successful job, most recent last
+        self._counters = {'submitted': 0, 'succeeded': 0, 'failed': 0, 'retried': 0}
+
+    def _ensure_workers(self):
+        # Threads do not survive fork(), so (re)start them lazily in whichever process submits
+        if self._workers_pid == os.getpid() and all(t.is_alive() for t in self._workers):
+            return
+        self._workers = []
+        for n in range(self.worker_count):
+            worker = threading.Thread(target=self._work, name=f"report-worker-{n}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self._workers_pid = os.getpid()
+
+    def submit(self, func, *args, user_id=None):
+        """Queues func(*args) and returns the new job id immediately."""
+        job = ReportJob(uuid.uuid4().hex, user_id, func, args)
+        with self._lock:
+            self._ensure_workers()
+            self._jobs[job.id] = job
+            self._counters['submitted'] += 1
+            # Forget the oldest finished jobs once we track too many
+            for old_id in list(itertools.islice(self._jobs, max(0, len(self._jobs) - self.max_tracked_jobs))):
+                if self._jobs[old_id].status in (DONE, FAILED):
+                    del self._jobs[old_id]
+        self._save(job)
+        if self.store is not None:
+            self.store.maybe_prune()
+        self._queue.put(job)
+        return job.id
+
+    def _save(self, job):
+        if self.store is not None:
+            self.store.save(job)
+
+    def is_local(self, job_id):
+        """True if the job was queued by this process (its finish can be waited on without polling)."""
+        with self._lock:
+            return job_id in self._jobs
+
+    def get(self, job_id):
+        """The job, from this process or else from the shared store; None if unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.store is not None:
+            job = self.store.load(job_id)
+        return job
+
+    def wait(self, job_id, timeout, poll_interval=0.5):
+        """Waits up to timeout seconds for the job to finish and returns its latest state.
+        Jobs of other processes are re-read from the store every poll_interval seconds."""
+        job = self.get(job_id)
+        if job is None or job.finished.is_set() or timeout <= 0:
+            return job
+        if self.is_local(job_id):
+            job.finished.wait(timeout)
+            return job
+        deadline = time.monotonic() + timeout
+        while not job.finished.is_set() and time.monotonic() < deadline:
+            time.sleep(min(poll_interval, max(0.0, deadline - time.monotonic())))
+            job = self.get(job_id) or job
+        return job
+
+    def add_done_callback(self, job_id, callback):
+        """Calls callback(job) from the worker thread when the job finishes, or right away if it
+        already has. Returns False for an unknown job. Lets async servers wait without a thread."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            if not job.finished.is_set():
+                job.callbacks.append(callback)
+                return True
+        callback(job)
+        return True
+
+    def _finish(self, job):
+        self._save(job)
+        with self._lock:
+            callbacks, job.callbacks = job.callbacks, []
+            job.finished.set()
+        for callback in callbacks:
+            try:
+                callback(job)
+            except Exception as e:
+                log_event(logger, logging.WARNING, 'report_job.callback_failed', job_id=job.id, error=str(e))
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            try:
+                self._run(job)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job):
+        job.status = RUNNING
+        job.started_at = time.time()
+        self._save(job)
+        while job.attempts < self.max_attempts:
+            job.attempts += 1
+            try:
+                result = job.func(*job.args)
+                if result:
+                    job.result = result
+                    job.status = DONE
+                    job.finished_at = time.time()
+                    with self._lock:
+                        self._counters['succeeded'] += 1
+                        self._durations.append(job.finished_at - job.started_at)
+                    self._finish(job)
+                    return
+                job.error = "Report generation returned no file."
+            except Exception as e:
+                job.error = str(e)
+                log_event(logger, logging.WARNING, 'report_job.attempt_failed', job_id=job.id, attempt=job.attempts, error=str(e))
+            if job.attempts < self.max_attempts:
+                with self._lock:
+                    self._counters['retried'] += 1
+                time.sleep(self.retry_delay * job.attempts) # Linear backoff between attempts
+        job.status = FAILED
+        job.finished_at = time.time()
+        with self._lock:
+            self._counters['failed'] += 1
+        self._finish(job)
+
+    def stats(self):
+        with self._lock:
+            durations = sorted(self._durations)
+            running = sum(1 for job in self._jobs.values() if job.status == RUNNING)
+            counters = dict(self._counters)
+        return {
+            'queue_depth': self._queue.qsize(),
+            'running': running,
+            'workers': self.worker_count,
+            **counters,
+            'avg_duration_seconds': round(sum(durations) / len(durations), 4) if durations else None,
+            'p95_duration_seconds': round(durations[int(0.95 * (len(durations) - 1))], 4) if durations else None,
+        }
@@ -0,0 +1,132 @@
+# report_renderer.py
+# PDF report rendering with the static layout prepared once per process.
+#
+# Most of FPDF's time goes into line-breaking multi_cell text. The disclaimer and section
+# titles never change and the test/treatment/advice text only varies per disease, so their
+# wrapped lines are computed once and cached; each report only wraps its per-patient text.
+# The cache is keyed on everything that decides the line breaks (text, font family, style,
+# size and cell width), so changing any of them wraps the text again.
+
+import threading
+from datetime import datetime
+from functools import lru_cache
+
+from fpdf import FPDF
+from fpdf.enums import XPos, YPos, MethodReturnValue
+
+FONT = "Helvetica"
+TITLE = "Medical Diagnosis Report"
+DISCLAIMER_TEXT = ("Disclaimer: This system provides potential diagnoses based on symptoms and is not a substitute for professional medical advice. Always consult a qualified healthcare provider for any health concerns.")
+SECTION_TITLES = {
+    'patient': "Patient Information",
+    'symptoms': "Reported Symptoms",
+    'outcome': "Diagnosis Outcome",
+    'treatment': "Suggested Treatment",
+    'advice': "General Advice",
+    'personalized': "Personalized Advice",
+}
+LINE_HEIGHT = 8
+
+
+class ReportRenderer:
+    """Builds diagnosis report PDFs in memory; same layout as the original generate_pdf_report()."""
+
+    def __init__(self, wrap_cache_size=2048, font=FONT):
+        self.font = font
+        # A private document used only to measure and wrap text; FPDF objects are not thread-safe
+        self._measure = FPDF()
+        self._measure.add_page()
+        self._measure_lock = threading.Lock()
+        self._wrap_cached = lru_cache(maxsize=wrap_cache_size)(self._wrap_uncached)
+
+    def _wrap_uncached(self, text, family, style, size, width):
+        with self._measure_lock:
+            self._measure.set_font(family, style, size)
+            lines = self._measure.multi_cell(width, LINE_HEIGHT, text=text, align='L', dry_run=True, output=MethodReturnValue.LINES)
+        return tuple(lines)
+
+    def wrap(self, text, style='', size=12, width=0):
+        """Lines of text as multi_cell would break them (width 0: up to the right margin), cached."""
+        return self._wrap_cached(text, self.font, style, size, width)
+
+    @property
+    def disclaimer_lines(self):
+        return self.wrap(DISCLAIMER_TEXT, 'I', 10)
+
+    def _lines(self, pdf, text, style='', size=12):
+        for line in self.wrap(text, style, size):
+            pdf.cell(0, LINE_HEIGHT, text=line, align='L', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    def _section(self, pdf, key):
+        pdf.set_font(self.font, 'B', 12)
+        pdf.cell(0, 10, text=SECTION_TITLES[key], new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.set_font(self.font, size=12)
+
+    def _line(self, pdf, text):
+        pdf.cell(0, LINE_HEIGHT, text=text, new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    def render(self, user_details, diagnosis_info, report_time=None):
+        """Returns the PDF for one report as bytes."""
+        pdf = FPDF()
+        pdf.add_page()
+
+        pdf.set_font(self.font, 'B', 16)
+        pdf.cell(0, 10, text=TITLE, align='C', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.ln(5)
+
+        pdf.set_font(self.font, size=10)
+        report_time = report_time or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        pdf.cell(0, 10, text=f"Report Generated: {report_time}", align='R', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+        pdf.ln(5)
+
+        self._section(pdf, 'patient')
+        if user_details:
+            weight = user_details['weight']
+            conditions = user_details['medical_conditions']
+            self._line(pdf, f"Name: {user_details['name']}")
+            self._line(pdf, f"Age: {user_details['age'] or 'N/A'}")
+            self._line(pdf, f"Weight: {f'{weight} kg' if weight else 'N/A'}")
+            conditions_display = 'None'
+            if conditions and conditions.strip().lower() == 'normal':
+                conditions_display = 'Normal (No pre-existing)'
+            elif conditions and conditions.strip().lower() != 'none':
+                conditions_display = conditions.strip()
+            self._lines(pdf, f"Reported Conditions: {conditions_display}")
+        else:
+            self._line(pdf, "User details not found.")
+        pdf.ln(5)
+
+        self._section(pdf, 'symptoms')
+        symptoms_list = diagnosis_info.get('symptoms', [])
+        symptoms_str = ", ".join(s.replace("_", " ").title() for s in symptoms_list) if isinstance(symptoms_list, list) else "Symptoms data invalid."
+        self._lines(pdf, symptoms_str)
+        pdf.ln(5)
+
+        self._section(pdf, 'outcome')
+        disease = str(diagnosis_info.get('disease', 'N/A')).replace('_', ' ').title()
+        confidence = diagnosis_info.get('confidence', 0.0)
+        test_rec = str(diagnosis_info.get('test', 'N/A')).replace('_', ' ').title()
+        self._line(pdf, f"Possible Diagnosis: {disease}")
+        self._line(pdf, f"Confidence: {float(confidence):.2f}%")
+        self._line(pdf, f"Recommended Test: {test_rec}")
+        pdf.ln(5)
+
+        self._section(pdf, 'treatment')
+        treatment_list = diagnosis_info.get('treatment', [])
+        treatment_items = [str(item).replace('_', ' ').title() for item in treatment_list] if isinstance(treatment_list, list) else []
+        self._lines(pdf, "- " + "\n- ".join(treatment_items) if treatment_items else "N/A")
+        pdf.ln(5)
+
+        self._section(pdf, 'advice')
+        self._lines(pdf, str(diagnosis_info.get('advice', 'Follow general medical advice.')))
+        pdf.ln(5)
+
+        self._section(pdf, 'personalized')
+        self._lines(pdf, str(diagnosis_info.get('personalized_advice', '').strip()))
+        pdf.ln(10)
+
+        pdf.set_font(self.font, 'I', 10)
+        for line in self.disclaimer_lines:
+            pdf.cell(0, LINE_HEIGHT, text=line, align='L', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+        return bytes(pdf.output())
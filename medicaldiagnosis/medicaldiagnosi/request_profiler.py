@@ -0,0 +1,50 @@
+# request_profiler.py
+# Sampled per-request cProfile capture. Off by default; enable with PROFILE_SAMPLE_RATE
+# (fraction of requests) or force it for one request with an X-Profile: 1 header when
+# PROFILE_ALLOW_HEADER is set. Each profile is written as a .prof file (for snakeviz or
+# pstats) and its top functions are logged.
+
+import cProfile
+import io
+import os
+import pstats
+import random
+import re
+import time
+
+
+class RequestProfiler:
+    def __init__(self, sample_rate=0.0, output_dir=None, allow_header=False, top=20):
+        self.sample_rate = sample_rate
+        self.output_dir = output_dir
+        self.allow_header = allow_header
+        self.top = top
+        self.profiled = 0
+
+    @property
+    def enabled(self):
+        return self.sample_rate > 0 or self.allow_header
+
+    def should_profile(self, headers):
+        if self.allow_header and headers.get('X-Profile') == '1':
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        profile = cProfile.Profile() # Profiles only the calling thread, i.e. this request
+        profile.enable()
+        return profile
+
+    def finish(self, profile, label):
+        """Stops the profile; returns (path of the .prof file or None, text summary of the top functions)."""
+        profile.disable()
+        self.profiled += 1
+        path = None
+        if self.output_dir:
+            os.makedirs(self.output_dir, exist_ok=True)
+            safe_label = re.sub(r'[^A-Za-z0-9_.-]+', '_', label).strip('_') or 'request'
+            path = os.path.join(self.output_dir, f"{safe_label}_{int(time.time() * 1000)}_{os.getpid()}.prof")
+            profile.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(profile, stream=out).sort_stats('cumulative').print_stats(self.top)
+        return path, out.getvalue()
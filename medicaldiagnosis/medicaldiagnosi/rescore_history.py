@@ -0,0 +1,219 @@
+# rescore_history.py
+# Re-scores every `history` row against another version of diagnosis.pl and records the rows
+# whose top diagnosis or confidence would change, so weight edits can be reviewed before (or
+# after) they ship.
+#
+# CLI: python rescore_history.py --kb new_diagnosis.pl [--database diagnosis_history.db]
+#          [--output history_rescore.db] [--baseline diagnosis.pl] [--workers N] [--chunk-size 5000]
+#
+# History keeps only the symptoms (not the risk factors or follow-up answers), so rows are
+# re-scored from their symptoms alone. Without --baseline the new score is compared with the
+# stored diagnosis and confidence; with --baseline both sides are re-scored from the symptoms,
+# which isolates the effect of the rule change.
+#
+# Rows are read in id order, one short keyset query per chunk (no read transaction stays open
+# against the live database), and scored by a process pool with a bounded number of chunks in
+# flight, so memory does not grow with the table. The diff rows and the last finished id are
+# committed together to --output, so an interrupted run resumes where it stopped.
+
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from batch_diagnosis import BatchScorer, DEFAULT_KB_ARTIFACT
+from kb_artifact import load_compiled_knowledge_base
+from vocabulary import SYMPTOMS, Vocabulary
+
+DEFAULT_DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'diagnosis_history.db')
+
+OUTPUT_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS rescore_runs (
+            run_id TEXT PRIMARY KEY,
+            kb_version TEXT NOT NULL,
+            baseline TEXT NOT NULL,
+            last_history_id INTEGER NOT NULL DEFAULT 0,
+            rows_scanned INTEGER NOT NULL DEFAULT 0,
+            rows_changed INTEGER NOT NULL DEFAULT 0,
+            started_at REAL,
+            updated_at REAL,
+            finished_at REAL)''',
+    '''CREATE TABLE IF NOT EXISTS rescore_diff (
+            run_id TEXT NOT NULL,
+            history_id INTEGER NOT NULL,
+            symptoms TEXT,
+            old_diagnosis TEXT,
+            old_confidence REAL,
+            new_diagnosis TEXT,
+            new_confidence REAL,
+            top_changed INTEGER NOT NULL,
+            PRIMARY KEY (run_id, history_id))''',
+]
+
+
+# --- Worker processes: one scorer per process, built once ---
+_worker = {}
+
+
+def _init_worker(kb_path, baseline_path, artifact_path, symptom_atoms):
+    _worker['scorer'] = BatchScorer(load_compiled_knowledge_base(kb_path, artifact_path))
+    _worker['baseline'] = BatchScorer(load_compiled_knowledge_base(baseline_path, artifact_path)) if baseline_path else None
+    _worker['vocabulary'] = Vocabulary(SYMPTOMS, symptom_atoms, symptom_atoms)
+
+
+def row_symptoms(symptoms_text, symptoms_mask, vocabulary):
+    """Symptoms of a history row: vocabulary atoms from the bitset, or the comma-joined labels of older rows."""
+    if symptoms_mask is not None:
+        return vocabulary.atoms_of(Vocabulary.from_bytes(symptoms_mask))
+    return [s for s in (symptoms_text or '').split(',') if s]
+
+
+def score_chunk(rows, tolerance):
+    """Scores one chunk in a worker: (last id, rows scanned, [diff rows]) where diff rows are
+    (history_id, symptoms, old_diagnosis, old_confidence, new_diagnosis, new_confidence, top_changed)."""
+    vocabulary = _worker['vocabulary']
+    scored = [(row_id, row_symptoms(text, mask, vocabulary), diagnosis, confidence)
+              for row_id, text, mask, diagnosis, confidence in rows]
+    scored = [row for row in scored if row[1]] # Rows without symptoms cannot be re-scored
+    diffs = []
+    if scored:
+        symptom_lists = [symptoms for _id, symptoms, _d, _c in scored]
+        no_risks = [[] for _ in scored]
+        new_top = [ranked[0] for ranked in _worker['scorer'].diagnose(symptom_lists, no_risks, 1)]
+        if _worker['baseline'] is not None:
+            old_top = [ranked[0] for ranked in _worker['baseline'].diagnose(symptom_lists, no_risks, 1)]
+        else:
+            old_top = [(diagnosis, confidence) for _id, _s, diagnosis, confidence in scored]
+        for (row_id, symptoms, _d, _c), (old_d, old_c), (new_d, new_c) in zip(scored, old_top, new_top):
+            top_changed = old_d != new_d
+            if top_changed or old_c is None or abs(new_c - old_c) > tolerance:
+                diffs.append((row_id, ','.join(symptoms), old_d, old_c, new_d, round(new_c, 4), int(top_changed)))
+    return rows[-1][0], len(rows), diffs
+
+
+# --- Reading history ---
+def history_chunks(source, start_after, chunk_size):
+    """Yields lists of (id, symptoms, symptoms_mask, diagnosis, confidence) rows in id order, after start_after."""
+    columns = {row[1] for row in source.execute("PRAGMA table_info(history)")}
+    mask_column = 'symptoms_mask' if 'symptoms_mask' in columns else 'NULL' # Databases from before migration 4
+    last_id = start_after
+    while True:
+        rows = source.execute(f"""SELECT id, symptoms, {mask_column}, diagnosis, confidence FROM history
+                                  WHERE id > ? ORDER BY id LIMIT ?""", (last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+
+def symptom_atoms(source):
+    """Atoms of the symptom vocabulary by bit, to decode symptoms_mask ([] before migration 4)."""
+    try:
+        return [atom for (atom,) in source.execute("SELECT atom FROM vocabulary WHERE kind = ? ORDER BY bit", (SYMPTOMS,))]
+    except sqlite3.OperationalError:
+        return []
+
+
+# --- Output database: diff table and checkpoints ---
+def open_output(path):
+    db = sqlite3.connect(path)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    for statement in OUTPUT_SCHEMA:
+        db.execute(statement)
+    db.commit()
+    return db
+
+
+def start_run(output, run_id, kb_version, baseline, restart):
+    """Returns the id to resume after (0 for a fresh run) and the counters so far."""
+    if restart:
+        output.execute("DELETE FROM rescore_diff WHERE run_id = ?", (run_id,))
+        output.execute("DELETE FROM rescore_runs WHERE run_id = ?", (run_id,))
+    output.execute("""INSERT OR IGNORE INTO rescore_runs (run_id, kb_version, baseline, started_at, updated_at)
+                      VALUES (?, ?, ?, ?, ?)""", (run_id, kb_version, baseline, time.time(), time.time()))
+    output.commit()
+    return output.execute("SELECT last_history_id, rows_scanned, rows_changed, finished_at FROM rescore_runs WHERE run_id = ?",
+                          (run_id,)).fetchone()
+
+
+def record_chunk(output, run_id, last_id, scanned, diffs):
+    """Writes a chunk's diff rows and advances the checkpoint in one transaction."""
+    with output:
+        output.executemany("""INSERT OR REPLACE INTO rescore_diff (run_id, history_id, symptoms, old_diagnosis, old_confidence,
+                                                                  new_diagnosis, new_confidence, top_changed)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?)""", [(run_id,) + diff for diff in diffs])
+        output.execute("""UPDATE rescore_runs SET last_history_id = ?, rows_scanned = rows_scanned + ?,
+                              rows_changed = rows_changed + ?, updated_at = ? WHERE run_id = ?""",
+                       (last_id, scanned, len(diffs), time.time(), run_id))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Re-score stored diagnoses against another diagnosis.pl and record what changes.")
+    parser.add_argument('--kb', required=True, help="diagnosis.pl version to re-score with")
+    parser.add_argument('--baseline', help="diagnosis.pl to compare against (default: the stored diagnosis and confidence)")
+    parser.add_argument('--database', default=DEFAULT_DATABASE, help="History database to read (opened read-only)")
+    parser.add_argument('--output', default='history_rescore.db', help="SQLite file for the diff table and checkpoints")
+    parser.add_argument('--artifact', default=DEFAULT_KB_ARTIFACT, help="Compiled knowledge base used when it matches a --kb/--baseline file")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=5000, help="History rows per query and per scoring task")
+    parser.add_argument('--tolerance', type=float, default=0.01, help="Confidence change (percentage points) worth recording")
+    parser.add_argument('--restart', action='store_true', help="Discard this run's checkpoint and diff rows first")
+    args = parser.parse_args(argv)
+
+    kb_version = load_compiled_knowledge_base(args.kb, args.artifact).source_digest[:12]
+    baseline = load_compiled_knowledge_base(args.baseline, args.artifact).source_digest[:12] if args.baseline else 'stored'
+    run_id = f"{kb_version}:{baseline}"
+
+    source = sqlite3.connect(f"file:{os.path.abspath(args.database)}?mode=ro", uri=True)
+    output = open_output(args.output)
+    last_id, scanned, changed, finished_at = start_run(output, run_id, kb_version, baseline, args.restart)
+    if finished_at is not None:
+        print(f"Run {run_id} already finished: {scanned} rows scanned, {changed} changed. Use --restart to run it again.", file=sys.stderr)
+        return 0
+    if last_id:
+        print(f"Resuming run {run_id} after history id {last_id} ({scanned} rows already scanned).", file=sys.stderr)
+
+    started = time.perf_counter()
+    max_in_flight = max(1, args.workers) * 2 # Bounds the rows held in memory to a few chunks per worker
+    with ProcessPoolExecutor(max_workers=max(1, args.workers), initializer=_init_worker,
+                             initargs=(args.kb, args.baseline, args.artifact, symptom_atoms(source))) as pool:
+        pending = deque()
+
+        def finish_oldest():
+            # Chunks are committed in id order so the checkpoint never skips an unfinished chunk
+            nonlocal scanned, changed
+            chunk_last_id, chunk_rows, diffs = pending.popleft().result()
+            record_chunk(output, run_id, chunk_last_id, chunk_rows, diffs)
+            scanned += chunk_rows
+            changed += len(diffs)
+            print(f"  scanned {scanned} rows, {changed} changed (through history id {chunk_last_id})", file=sys.stderr)
+
+        try:
+            for rows in history_chunks(source, last_id, args.chunk_size):
+                pending.append(pool.submit(score_chunk, [tuple(row) for row in rows], args.tolerance))
+                if len(pending) >= max_in_flight:
+                    finish_oldest()
+            while pending:
+                finish_oldest()
+        except KeyboardInterrupt:
+            for future in pending:
+                future.cancel()
+            print(f"Interrupted after {scanned} rows; run the same command again to resume.", file=sys.stderr)
+            return 130
+
+    with output:
+        output.execute("UPDATE rescore_runs SET finished_at = ? WHERE run_id = ?", (time.time(), run_id))
+    top_changed = output.execute("SELECT COUNT(*) FROM rescore_diff WHERE run_id = ? AND top_changed = 1", (run_id,)).fetchone()[0]
+    source.close()
+    output.close()
+    print(f"Run {run_id}: {scanned} rows scanned, {changed} changed ({top_changed} with a new top diagnosis) "
+          f"in {time.perf_counter() - started:.1f} s. Diff table: {args.output} rescore_diff.", file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
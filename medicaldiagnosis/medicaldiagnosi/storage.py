@@ -0,0 +1,219 @@
+# storage.py
+# SQLite access for the app: one tuned connection per thread (WAL journal, relaxed fsync,
+# memory-mapped reads) and schema migrations tracked in PRAGMA user_version.
+
+import logging
+import os
+import sqlite3
+import threading
+
+from app_logging import get_logger, log_event
+
+logger = get_logger('storage')
+
+
+class ConnectionPool:
+    """Hands each thread its own long-lived connection to the database file.
+
+    sqlite3 connections must not be shared between threads, but opening one per request
+    costs a file open plus schema parsing every time. Connections are kept in thread-local
+    storage and are dropped (not reused) after a fork, since SQLite handles must not cross
+    processes.
+    """
+
+    def __init__(self, path, mmap_size=256 * 1024 * 1024, busy_timeout=5.0, cache_size_kib=16384):
+        self.path = path
+        self.mmap_size = mmap_size
+        self.busy_timeout = busy_timeout
+        self.cache_size_kib = cache_size_kib
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.connections_opened = 0
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=self.busy_timeout)
+        db.row_factory = sqlite3.Row # Access columns by name
+        db.execute("PRAGMA journal_mode=WAL") # Readers no longer block on the writer
+        db.execute("PRAGMA synchronous=NORMAL") # Safe with WAL; fsync only at checkpoints
+        db.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        db.execute(f"PRAGMA cache_size=-{int(self.cache_size_kib)}")
+        db.execute("PRAGMA temp_store=MEMORY")
+        with self._lock:
+            self.connections_opened += 1
+        return db
+
+    def connection(self):
+        """Returns this thread's connection, opening it on first use."""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = self._connect()
+            self._local.db = db
+            self._local.pid = os.getpid()
+        return db
+
+    def release(self):
+        """Ends the current thread's unit of work; the connection stays open for reuse."""
+        db = getattr(self._local, 'db', None)
+        if db is not None and self._local.pid == os.getpid() and db.in_transaction:
+            db.rollback() # Never leak an uncommitted transaction into the next request
+
+    def close(self):
+        """Closes the current thread's connection (e.g. when a worker thread exits)."""
+        db = getattr(self._local, 'db', None)
+        if db is not None and self._local.pid == os.getpid():
+            db.close()
+        self._local.db = None
+
+    def stats(self):
+        return {'path': self.path, 'connections_opened': self.connections_opened,
+                'mmap_size': self.mmap_size, 'busy_timeout': self.busy_timeout}
+
+
+# --- Schema migrations ---
+# Each entry is (version, description, statements). They run in order against any database
+# whose user_version is lower, so existing diagnosis_history.db files are upgraded in place.
+MIGRATIONS = [
+    (1, "users and history tables", [
+        '''CREATE TABLE IF NOT EXISTS users (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                email TEXT NOT NULL UNIQUE,
+                password_hash TEXT NOT NULL,
+                age INTEGER,
+                weight INTEGER,
+                medical_conditions TEXT)''',
+        '''CREATE TABLE IF NOT EXISTS history (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER,
+                datetime TEXT,
+                symptoms TEXT,
+                diagnosis TEXT,
+                confidence REAL,
+                report_filename TEXT,
+                FOREIGN KEY(user_id) REFERENCES users(id))''',
+    ]),
+    (2, "history indexes", [
+        # Per-user history listing, newest first (and keyed report lookups by user)
+        "CREATE INDEX IF NOT EXISTS idx_history_user_datetime ON history (user_id, datetime, id)",
+        # Covers the per-diagnosis GROUP BY used to (re)build the statistics summaries
+        "CREATE INDEX IF NOT EXISTS idx_history_diagnosis ON history (diagnosis, confidence)",
+        "ANALYZE",
+    ]),
+    (3, "server-side diagnosis sessions", [
+        '''CREATE TABLE IF NOT EXISTS diagnosis_sessions (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER NOT NULL,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL)''',
+        "CREATE INDEX IF NOT EXISTS idx_diagnosis_sessions_expires ON diagnosis_sessions (expires_at)",
+    ]),
+    (4, "interned symptom/risk factor vocabulary and history symptom bitsets", [
+        # Append-only: a term keeps its bit forever so stored bitsets always decode
+        '''CREATE TABLE IF NOT EXISTS vocabulary (
+                kind TEXT NOT NULL,
+                bit INTEGER NOT NULL,
+                atom TEXT NOT NULL,
+                PRIMARY KEY (kind, bit))''',
+        # New rows store the bitset here and leave the comma-joined symptoms text NULL
+        "ALTER TABLE history ADD COLUMN symptoms_mask BLOB",
+    ]),
+    (5, "knowledge base version of each history row", [
+        "ALTER TABLE history ADD COLUMN kb_version TEXT",
+    ]),
+    (6, "report jobs shared by all worker processes", [
+        '''CREATE TABLE IF NOT EXISTS report_jobs (
+                id TEXT PRIMARY KEY,
+                user_id INTEGER,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                error TEXT,
+                result_path TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL,
+                updated_at REAL NOT NULL)''',
+        "CREATE INDEX IF NOT EXISTS idx_report_jobs_finished ON report_jobs (finished_at)",
+    ]),
+    (7, "diagnosis statistics summary tables kept up to date by triggers on history", [
+        # Summaries created before they were a migration may be from an older layout: rebuild them
+        "DROP TRIGGER IF EXISTS history_counts_insert",
+        "DROP TRIGGER IF EXISTS history_counts_delete",
+        "DROP TRIGGER IF EXISTS history_counts_update",
+        "DROP TABLE IF EXISTS diagnosis_counts",
+        "DROP TABLE IF EXISTS diagnosis_daily_counts",
+        '''CREATE TABLE diagnosis_counts (
+                diagnosis TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0,
+                confidence_total REAL NOT NULL DEFAULT 0)''',
+        '''CREATE TABLE diagnosis_daily_counts (
+                day TEXT PRIMARY KEY,
+                count INTEGER NOT NULL DEFAULT 0)''',
+        '''CREATE TRIGGER history_counts_insert AFTER INSERT ON history
+           BEGIN
+               INSERT INTO diagnosis_counts (diagnosis, count, confidence_total)
+               SELECT NEW.diagnosis, 1, COALESCE(NEW.confidence, 0) WHERE NEW.diagnosis IS NOT NULL AND NEW.diagnosis != ''
+               ON CONFLICT(diagnosis) DO UPDATE SET count = count + 1, confidence_total = confidence_total + excluded.confidence_total;
+               INSERT INTO diagnosis_daily_counts (day, count)
+               SELECT substr(NEW.datetime, 1, 10), 1 WHERE NEW.datetime IS NOT NULL
+               ON CONFLICT(day) DO UPDATE SET count = count + 1;
+           END''',
+        '''CREATE TRIGGER history_counts_delete AFTER DELETE ON history
+           BEGIN
+               UPDATE diagnosis_counts SET count = count - 1, confidence_total = confidence_total - COALESCE(OLD.confidence, 0)
+               WHERE diagnosis = OLD.diagnosis;
+               DELETE FROM diagnosis_counts WHERE diagnosis = OLD.diagnosis AND count <= 0;
+               UPDATE diagnosis_daily_counts SET count = count - 1 WHERE day = substr(OLD.datetime, 1, 10);
+               DELETE FROM diagnosis_daily_counts WHERE day = substr(OLD.datetime, 1, 10) AND count <= 0;
+           END''',
+        '''CREATE TRIGGER history_counts_update AFTER UPDATE OF diagnosis, confidence, datetime ON history
+           BEGIN
+               UPDATE diagnosis_counts SET count = count - 1, confidence_total = confidence_total - COALESCE(OLD.confidence, 0)
+               WHERE diagnosis = OLD.diagnosis;
+               DELETE FROM diagnosis_counts WHERE diagnosis = OLD.diagnosis AND count <= 0;
+               INSERT INTO diagnosis_counts (diagnosis, count, confidence_total)
+               SELECT NEW.diagnosis, 1, COALESCE(NEW.confidence, 0) WHERE NEW.diagnosis IS NOT NULL AND NEW.diagnosis != ''
+               ON CONFLICT(diagnosis) DO UPDATE SET count = count + 1, confidence_total = confidence_total + excluded.confidence_total;
+               UPDATE diagnosis_daily_counts SET count = count - 1 WHERE day = substr(OLD.datetime, 1, 10);
+               DELETE FROM diagnosis_daily_counts WHERE day = substr(OLD.datetime, 1, 10) AND count <= 0;
+               INSERT INTO diagnosis_daily_counts (day, count)
+               SELECT substr(NEW.datetime, 1, 10), 1 WHERE NEW.datetime IS NOT NULL
+               ON CONFLICT(day) DO UPDATE SET count = count + 1;
+           END''',
+        # Backfilled in the same transaction, so the counts start out equal to history
+        '''INSERT INTO diagnosis_counts (diagnosis, count, confidence_total)
+           SELECT diagnosis, COUNT(*), COALESCE(SUM(confidence), 0) FROM history
+           WHERE diagnosis IS NOT NULL AND diagnosis != ''
+           GROUP BY diagnosis''',
+        '''INSERT INTO diagnosis_daily_counts (day, count)
+           SELECT substr(datetime, 1, 10), COUNT(*) FROM history
+           WHERE datetime IS NOT NULL
+           GROUP BY substr(datetime, 1, 10)''',
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def migrate(db):
+    """Applies pending migrations; returns the list of versions applied."""
+    current = db.execute("PRAGMA user_version").fetchone()[0]
+    applied = []
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        try:
+            db.execute("BEGIN IMMEDIATE") # Another worker migrating at the same time waits here
+            # Re-check inside the write lock in case that worker already applied it
+            if db.execute("PRAGMA user_version").fetchone()[0] >= version:
+                db.rollback()
+                continue
+            for statement in statements:
+                db.execute(statement)
+            db.execute(f"PRAGMA user_version = {int(version)}")
+            db.commit()
+        except sqlite3.Error:
+            db.rollback()
+            raise
+        log_event(logger, logging.INFO, 'db.migration_applied', version=version, description=description)
+        applied.append(version)
+    return applied
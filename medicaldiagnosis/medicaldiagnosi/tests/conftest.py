@@ -0,0 +1,54 @@
+# tests/conftest.py
+# Shared fixtures. Tests that need the Flask app import it from a throwaway copy of this
+# directory, so the real database, reports folder and instance/ are never touched.
+
+import os
+import shutil
+import sys
+
+import pytest
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+TEST_PASSWORD = 'test-password'
+APP_ENVIRONMENT = {'SECRET_KEY': 'test-secret', 'API_TOKENS': 'test-token', 'LOG_LEVEL': 'WARNING',
+                   'PASSWORD_PBKDF2_ITERATIONS': '1000', 'WSGI_WARM_UP': '0'}
+
+
+@pytest.fixture(scope='session')
+def kb():
+    """The compiled knowledge base of the shipped diagnosis.pl."""
+    from knowledge_base import load_knowledge_base
+    return load_knowledge_base(os.path.join(APP_DIR, 'diagnosis.pl'))
+
+
+@pytest.fixture(scope='session')
+def web(tmp_path_factory):
+    """The app module, imported from a copy of the app directory with a fresh database."""
+    app_copy = tmp_path_factory.mktemp('app') / 'app'
+    shutil.copytree(APP_DIR, app_copy, ignore=shutil.ignore_patterns(
+        'diagnosis_reports', '__pycache__', 'benchmarks', 'tests', 'instance',
+        'diagnosis_history.db*', 'diagnosis.kb', 'diagnosis.qlf'))
+    sys.path.insert(0, str(app_copy))
+    # The app reads its settings when imported; they are set only for the import, so no other test sees them
+    with pytest.MonkeyPatch.context() as patch:
+        for name, value in APP_ENVIRONMENT.items():
+            patch.setenv(name, value)
+        import app
+    app.app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture
+def login(web):
+    """login(email) registers the user if needed, signs in and returns a test client with a complete profile."""
+    def login(email, medical_conditions='None'):
+        client = web.app.test_client()
+        client.post('/register', data={'name': 'Test User', 'email': email,
+                                       'password': TEST_PASSWORD, 'confirm_password': TEST_PASSWORD})
+        response = client.post('/login', data={'email': email, 'password': TEST_PASSWORD})
+        assert response.status_code == 302, response.data
+        client.post('/profile/complete', data={'age': '40', 'weight': '70', 'medical_conditions': medical_conditions})
+        return client
+    return login
@@ -0,0 +1,73 @@
+# tests/test_advice.py
+# Personalized advice from the precomputed table, and the per-process profile cache that
+# feeds it.
+
+import pytest
+
+from advice import CONDITION_RULES, NO_NOTES, AdviceTable, normalize_conditions
+
+CONDITION_STRINGS = [None, '', 'None', 'NONE', 'normal', 'Diabetes', 'type 2 diabetes', 'prediabetes',
+                     'HYPERTENSION', 'asthma', 'Asthma and hypertension', 'diabetes, hypertension, asthma',
+                     'hypertension; asthma; diabetes', 'seasonal allergies']
+EXTRA_DISEASES = ['high_blood_sugar', 'shortness_of_breath', 'wheezing_bronchitis', 'Breathless_Syndrome']
+
+
+def old_personalized_advice(medical_conditions, diagnosis_atom_str):
+    """personalized_advice() as it was before the advice table, minus the database read."""
+    advice_list = []
+    if medical_conditions and medical_conditions.lower() != 'none':
+        conditions = medical_conditions.lower()
+        diag_lower = str(diagnosis_atom_str).lower()
+        if 'diabetes' in conditions and 'sugar' not in diag_lower: advice_list.append("With diabetes, monitor blood sugar.")
+        if 'hypertension' in conditions: advice_list.append("With hypertension, track blood pressure.")
+        if 'asthma' in conditions and ('breath' in diag_lower or 'wheezing' in diag_lower): advice_list.append("With asthma, keep inhaler handy.")
+    if advice_list: return "\nPersonalized Notes:\n- " + "\n- ".join(advice_list)
+    else: return "\nNo specific personalized notes. Follow general advice."
+
+
+def test_table_matches_the_original_advice(kb):
+    table = AdviceTable(kb.diseases + EXTRA_DISEASES[:2])
+    notes_seen = set()
+    for medical_conditions in CONDITION_STRINGS:
+        conditions = normalize_conditions(medical_conditions)
+        for disease in kb.diseases + EXTRA_DISEASES: # The last two are outside the table
+            advice = table.lookup(conditions, disease)
+            assert advice == old_personalized_advice(medical_conditions, disease), (medical_conditions, disease)
+            notes_seen.update(note for _condition, _applies, note in CONDITION_RULES if note in advice)
+    assert notes_seen == {note for _condition, _applies, note in CONDITION_RULES} # Every rule fired somewhere
+
+
+@pytest.mark.parametrize('medical_conditions, conditions', [
+    (None, ()), ('None', ()), ('normal', ()),
+    ('Asthma, Diabetes', ('diabetes', 'asthma')), # Rule order, whatever the order in the text
+    ('hypertension and hypertension', ('hypertension',)),
+])
+def test_normalize_conditions(medical_conditions, conditions):
+    assert normalize_conditions(medical_conditions) == conditions
+
+
+def test_table_covers_every_condition_combination(kb):
+    assert len(AdviceTable(kb.diseases)) == 2 ** len(CONDITION_RULES) * len(kb.diseases)
+    assert AdviceTable([]).lookup((), 'flu') == NO_NOTES
+
+
+def user_id(web, email):
+    with web.app.app_context():
+        return web.get_db().execute("SELECT id FROM users WHERE email = ?", (email,)).fetchone()[0]
+
+
+def test_profile_edit_is_seen_at_once(web, login):
+    email = 'advice@example.com'
+    client = login(email, medical_conditions='diabetes')
+    uid = user_id(web, email)
+    assert 'value="diabetes"' in client.get('/profile/edit').get_data(as_text=True) # Now cached in this process
+    with web.app.test_request_context():
+        assert web.personalized_advice(uid, 'flu') == "\nPersonalized Notes:\n- With diabetes, monitor blood sugar."
+
+    response = client.post('/profile/edit', data={'age': '41', 'weight': '72', 'medical_conditions': 'asthma, hypertension'})
+    assert response.status_code == 302
+    assert 'value="asthma, hypertension"' in client.get('/profile/edit').get_data(as_text=True)
+    with web.app.test_request_context():
+        profile = web.get_user_profile(uid)
+        assert (profile['age'], profile['weight'], profile['known_conditions']) == (41, 72, ('hypertension', 'asthma'))
+        assert web.personalized_advice(uid, 'flu') == "\nPersonalized Notes:\n- With hypertension, track blood pressure."
@@ -0,0 +1,106 @@
+# tests/test_api.py
+# The token-authenticated JSON diagnosis API: authentication, request validation and batches.
+
+import pytest
+
+AUTH = {'Authorization': 'Bearer test-token'}
+QUESTION = 'Are the body aches severe?'
+
+
+@pytest.fixture
+def api(web):
+    return web.app.test_client()
+
+
+def test_requests_without_a_valid_token_are_refused(api):
+    for headers in ({}, {'Authorization': 'Bearer wrong'}, {'Authorization': 'test-token'}):
+        for path in ('/api/v1/diagnose', '/api/v1/diagnose/batch'):
+            response = api.post(path, json={'symptoms': ['fever']}, headers=headers)
+            assert response.status_code == 401
+            assert response.headers['WWW-Authenticate'] == 'Bearer'
+
+
+def test_diagnose_accepts_labels_atoms_and_answer_objects(api):
+    response = api.post('/api/v1/diagnose', headers=AUTH,
+                        json={'symptoms': ['fever', 'body ache', 'body_ache', 'cough'], 'risk_factors': ['no mask'],
+                              'answers': {QUESTION: 'yes'}, 'top_k': 2})
+    assert response.status_code == 200
+    body = response.get_json()
+    assert len(body['ranked']) == 2 and body['ranked'][0]['disease'] == 'flu'
+    assert body['kb_version'] and body['treatment']
+    as_list = api.post('/api/v1/diagnose', headers=AUTH,
+                       json={'symptoms': ['fever', 'body ache', 'cough'], 'risk_factors': ['no mask'],
+                             'answers': [{'question': QUESTION, 'answer': 'yes'}], 'top_k': 2})
+    assert as_list.get_json() == body
+
+
+def test_every_validation_error_is_listed(api):
+    response = api.post('/api/v1/diagnose', headers=AUTH, json={
+        'symptoms': ['fever', 'green skin'],
+        'risk_factors': ['smoking', 'space travel'],
+        'answers': [{'question': 'Is it Tuesday?', 'answer': 'yes'},
+                    {'question': QUESTION, 'answer': 'maybe'},
+                    {'question': 'Did the symptoms appear suddenly?', 'answer': 'yes'},
+                    {'question': 'Did the symptoms appear suddenly?', 'answer': 'no'},
+                    'not an object'],
+        'top_k': 0})
+    assert response.status_code == 400
+    assert response.get_json()['details'] == [
+        "Each answer needs a 'question' string and an 'answer'.",
+        "Unknown symptoms: green skin.",
+        "Unknown risk factors: space travel.",
+        "Unknown follow-up question: 'Is it Tuesday?'.",
+        f"Answer to {QUESTION!r} must be 'yes' or 'no'.",
+        "Question 'Did the symptoms appear suddenly?' is answered more than once.",
+        "'top_k' must be an integer from 1 to 50.",
+    ]
+
+
+@pytest.mark.parametrize('body, error', [
+    ([], "Request body must be a JSON object."),
+    ({'symptoms': []}, "At least one symptom is required."),
+    ({'symptoms': 'fever'}, "'symptoms' must be a list of strings."),
+    ({'symptoms': ['fever'], 'answers': 'yes'}, "'answers' must be a list of {question, answer} objects or an object of question: answer."),
+    ({'symptoms': ['fever'], 'top_k': True}, "'top_k' must be an integer from 1 to 50."),
+    ({'symptoms': ['fever'], 'top_k': 51}, "'top_k' must be an integer from 1 to 50."),
+    ({'symptoms': ['fever'], 'top_k': 2.0}, "'top_k' must be an integer from 1 to 50."),
+])
+def test_malformed_requests(api, body, error):
+    response = api.post('/api/v1/diagnose', headers=AUTH, json=body)
+    assert response.status_code == 400
+    assert error in response.get_json()['details']
+
+
+def test_top_k_bounds_are_inclusive(api):
+    for top_k in (1, 50):
+        response = api.post('/api/v1/diagnose', headers=AUTH, json={'symptoms': ['fever'], 'top_k': top_k})
+        assert response.status_code == 200
+        assert 1 <= len(response.get_json()['ranked']) <= top_k
+
+
+def test_batch_limit(api, web, monkeypatch):
+    monkeypatch.setitem(web.app.config, 'API_BATCH_LIMIT', 3)
+    items = [{'symptoms': ['fever']}] * 4
+    response = api.post('/api/v1/diagnose/batch', headers=AUTH, json={'requests': items})
+    assert response.status_code == 413
+    assert api.post('/api/v1/diagnose/batch', headers=AUTH, json={'requests': items[:3]}).status_code == 200
+    for body in ({}, {'requests': []}, {'requests': {'symptoms': ['fever']}}):
+        assert api.post('/api/v1/diagnose/batch', headers=AUTH, json=body).status_code == 400
+
+
+def test_mixed_batch_keeps_positions(api):
+    items = [{'id': 'a', 'symptoms': ['fever', 'cough']},
+             {'id': 'b', 'symptoms': ['green skin']},
+             'not an object',
+             {'symptoms': ['rash', 'high fever', 'joint pain'], 'top_k': 1},
+             {'id': 'e', 'symptoms': ['cough', 'fever']}]
+    response = api.post('/api/v1/diagnose/batch', headers=AUTH, json={'requests': items})
+    assert response.status_code == 200
+    results = response.get_json()['results']
+    assert [result['id'] for result in results] == ['a', 'b', 2, 3, 'e']
+    assert results[1]['details'] == ["Unknown symptoms: green skin."]
+    assert results[2]['details'] == ["Request body must be a JSON object."]
+    for position in (0, 3, 4):
+        single = api.post('/api/v1/diagnose', headers=AUTH, json=items[position]).get_json()
+        assert {key: value for key, value in results[position].items() if key != 'id'} == single
+    assert results[3]['ranked'][0]['disease'] == 'dengue' and len(results[3]['ranked']) == 1
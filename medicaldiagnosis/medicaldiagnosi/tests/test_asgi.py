@@ -0,0 +1,82 @@
+# tests/test_asgi.py
+# The ASGI front's report status long-poll, for jobs queued by this or another worker process.
+
+import asyncio
+import threading
+import time
+
+import pytest
+
+from report_jobs import DONE, ReportJobQueue
+
+
+async def asgi_get(front, path, query, cookie):
+    scope = {'type': 'http', 'http_version': '1.1', 'method': 'GET', 'scheme': 'http', 'path': path,
+             'root_path': '', 'query_string': query.encode('latin-1'), 'server': ('test', 80), 'client': ('127.0.0.1', 0),
+             'headers': [(b'cookie', cookie.encode('latin-1'))]}
+    messages = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+    response = {'status': None, 'body': []}
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        else:
+            response['body'].append(message.get('body', b''))
+
+    await front(scope, receive, send)
+    return response['status'], b''.join(response['body'])
+
+
+@pytest.fixture
+def other_worker(web, login, monkeypatch):
+    """(front, session cookie, job queue of another worker, user id): this worker's queue never saw the jobs."""
+    monkeypatch.delenv('REPORT_STATUS_POLL_WAIT', raising=False) # Undoes the default asgi.py sets on import
+    from asgi import AsgiFront
+    client = login('asgi@example.com')
+    with web.app.app_context():
+        user_id = web.get_db().execute("SELECT id FROM users WHERE email = 'asgi@example.com'").fetchone()[0]
+    store = web.report_queue.store
+    this_worker = ReportJobQueue(worker_count=1, store=store)
+    monkeypatch.setattr(web, 'report_queue', this_worker)
+    front = AsgiFront(web.app, report_queue=this_worker)
+    cookie = f"session={client.get_cookie('session').value}"
+    return front, cookie, ReportJobQueue(worker_count=1, store=store), user_id
+
+
+def test_long_poll_sees_a_job_finish_on_another_worker(other_worker, monkeypatch):
+    import asgi
+    monkeypatch.setattr(asgi, 'JOB_POLL_INTERVAL', 0.05)
+    front, cookie, elsewhere, user_id = other_worker
+    release = threading.Event()
+    job_id = elsewhere.submit(lambda: release.wait(5) and '/reports/Report_x.pdf', user_id=user_id)
+    threading.Timer(0.3, release.set).start()
+
+    started = time.perf_counter()
+    status, body = asyncio.run(asgi_get(front, f"/report/status/{job_id}", 'wait=5', cookie))
+    assert status == 200 and b'"status":"done"' in body.replace(b' ', b'')
+    assert time.perf_counter() - started < 3 # Resolved by re-reading the job, not by the timeout
+    assert elsewhere.get(job_id).status == DONE
+
+
+def test_long_poll_on_another_worker_waits_instead_of_returning_at_once(other_worker):
+    front, cookie, elsewhere, user_id = other_worker
+    release = threading.Event()
+    job_id = elsewhere.submit(lambda: release.wait(5) and '/reports/Report_x.pdf', user_id=user_id)
+    try:
+        started = time.perf_counter()
+        status, body = asyncio.run(asgi_get(front, f"/report/status/{job_id}", 'wait=1', cookie))
+        assert status == 200 and (b'running' in body or b'queued' in body)
+        assert time.perf_counter() - started >= 0.9
+    finally:
+        release.set()
+
+
+def test_unknown_job_is_a_404(other_worker):
+    front, cookie, _elsewhere, _user_id = other_worker
+    status, _body = asyncio.run(asgi_get(front, '/report/status/unknown', 'wait=5', cookie))
+    assert status == 404
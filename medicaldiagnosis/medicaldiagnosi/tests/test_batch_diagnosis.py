@@ -0,0 +1,57 @@
+# tests/test_batch_diagnosis.py
+# The vectorized batch scorer against the compiled knowledge base, and its CLI.
+
+import json
+import random
+
+import pytest
+
+import batch_diagnosis
+from batch_diagnosis import BatchScorer
+from knowledge_base import KnowledgeBase, parse_clauses
+
+
+@pytest.fixture(scope='module')
+def scorer(kb):
+    return BatchScorer(kb)
+
+
+def test_batch_scores_match_the_knowledge_base(kb, scorer):
+    rng = random.Random(3)
+    symptoms_pool, risks_pool = sorted(kb.symptom_index), sorted(kb.risk_index)
+    symptom_lists = [rng.sample(symptoms_pool, rng.randint(1, 6)) for _ in range(1000)]
+    risk_lists = [rng.sample(risks_pool, rng.randint(0, 4)) for _ in range(1000)]
+    for symptoms, risks, ranked in zip(symptom_lists, risk_lists, scorer.diagnose(symptom_lists, risk_lists, 5)):
+        expected = kb.diagnosis_bundle(symptoms, risks, [], 0)['ranked'][:5]
+        assert [disease for disease, _score in ranked] == [disease for disease, _score in expected], (symptoms, risks)
+        assert [score for _disease, score in ranked] == pytest.approx([score for _disease, score in expected], abs=1e-9)
+
+
+def test_labels_and_unknown_terms(scorer):
+    by_atom, by_label = scorer.diagnose([['body_ache', 'fever', 'not a symptom'], ['Body Ache', 'fever']], [['no_mask'], ['no mask']])
+    assert by_atom == by_label
+
+
+def test_terms_that_normalize_alike_are_rejected():
+    kb = KnowledgeBase(parse_clauses("disease(flu, [(body_ache, 0.5), ('Body Ache', 0.3)]).\n"))
+    with pytest.raises(ValueError, match="both normalize to 'body_ache'"):
+        BatchScorer(kb)
+
+
+def test_cli_scores_a_csv(kb, scorer, tmp_path, capsys):
+    patients = tmp_path / 'patients.csv'
+    patients.write_text("id,symptoms,risk_factors\n"
+                        "p1,fever;cough;body ache,no mask\n"
+                        ",rash;high fever;joint pain,\n"
+                        "p3,,\n", encoding='utf-8')
+    output = tmp_path / 'results.jsonl'
+    assert batch_diagnosis.main([str(patients), '-o', str(output), '--top-k', '2', '--chunk-size', '2',
+                                 '--artifact', str(tmp_path / 'missing.kb')]) == 0
+    assert 'Scored 3 patients.' in capsys.readouterr().err
+    results = [json.loads(line) for line in output.read_text(encoding='utf-8').splitlines()]
+    assert [result['id'] for result in results] == ['p1', 2, 'p3']
+    expected = scorer.diagnose([['fever', 'cough', 'body ache'], ['rash', 'high fever', 'joint pain']], [['no mask'], []], 2)
+    for result, ranked in zip(results, expected):
+        assert result['results'] == [{'disease': d, 'confidence': round(c, 4)} for d, c in ranked]
+    assert results[0]['results'][0]['disease'] == 'flu' and results[1]['results'][0]['disease'] == 'dengue'
+    assert len(results[2]['results']) == 2 # No symptoms: every disease at 0, in knowledge base order
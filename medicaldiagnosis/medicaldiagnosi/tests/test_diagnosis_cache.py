@@ -0,0 +1,73 @@
+# tests/test_diagnosis_cache.py
+
+import diagnosis_cache
+from diagnosis_cache import DiagnosisCache, SourceFingerprint, normalize_diagnosis_key
+
+
+def test_key_ignores_order_and_duplicate_answers():
+    assert normalize_diagnosis_key(0b101, 0b10, [('q2', 'no'), ('q1', 'yes'), ('q1', 'yes')]) == \
+        normalize_diagnosis_key(5, 2, [('q1', 'yes'), ('q2', 'no')])
+    assert normalize_diagnosis_key(5, 2, [('q1', 'yes')]) != normalize_diagnosis_key(5, 2, [('q1', 'no')])
+
+
+def test_lru_eviction():
+    cache = DiagnosisCache(max_entries=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == (True, 1) # 'a' is now the most recently used
+    cache.set('c', 3)
+    assert cache.get('b') == (False, None)
+    assert cache.get('a') == (True, 1) and cache.get('c') == (True, 3)
+    assert cache.stats()['evictions'] == 1
+
+
+def test_entries_expire(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(diagnosis_cache.time, 'monotonic', lambda: now[0])
+    cache = DiagnosisCache(ttl_seconds=10)
+    cache.set('a', 1)
+    now[0] += 10
+    assert cache.get('a') == (True, 1)
+    now[0] += 0.001
+    assert cache.get('a') == (False, None)
+    assert cache.stats()['expirations'] == 1
+
+
+def test_source_change_drops_every_entry(tmp_path):
+    source = tmp_path / 'diagnosis.pl'
+    source.write_text('disease(a, [(x, 1)]).\n')
+    cache = DiagnosisCache(fingerprint=SourceFingerprint(str(source)))
+    cache.set('a', 1)
+    assert cache.get('a') == (True, 1)
+    source.write_text('disease(a, [(x, 2)]).\n') # Different size, so the stat changes too
+    assert cache.get('a') == (False, None)
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_fingerprint_follows_content_not_only_mtime(tmp_path):
+    source = tmp_path / 'diagnosis.pl'
+    source.write_text('one')
+    fingerprint = SourceFingerprint(str(source))
+    first = fingerprint.current()
+    source.write_text('one')
+    assert fingerprint.current() == first
+    source.write_text('two')
+    assert fingerprint.current() != first
+
+
+def test_get_or_compute_caches_only_results():
+    cache = DiagnosisCache()
+    calls = []
+    assert cache.get_or_compute('k', lambda: calls.append(1)) is None # None is not cached
+    assert cache.get_or_compute('k', lambda: calls.append(2) or 'value') == 'value'
+    assert cache.get_or_compute('k', lambda: calls.append(3) or 'other') == 'value'
+    assert calls == [1, 2]
+
+
+def test_discard_drops_one_entry():
+    cache = DiagnosisCache()
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.discard('a')
+    cache.discard('missing')
+    assert cache.get('a') == (False, None) and cache.get('b') == (True, 2)
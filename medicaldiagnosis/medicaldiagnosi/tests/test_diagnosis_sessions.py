@@ -0,0 +1,61 @@
+# tests/test_diagnosis_sessions.py
+
+import os
+import sqlite3
+
+import pytest
+
+import diagnosis_sessions
+from diagnosis_sessions import DiagnosisStateStore, load_secret_key
+from storage import migrate
+
+
+@pytest.fixture
+def store(tmp_path):
+    db = sqlite3.connect(tmp_path / 'app.db')
+    migrate(db)
+    return DiagnosisStateStore(lambda: db, ttl_seconds=60)
+
+
+def test_state_round_trip_per_user(store):
+    store.save('s1', 1, {'symptoms_mask': 5, 'answers': [['q', 'yes']]})
+    assert store.load('s1', 1) == {'symptoms_mask': 5, 'answers': [['q', 'yes']]}
+    assert store.load('s1', 2) is None
+    assert store.load(None, 1) is None
+
+
+def test_another_user_cannot_overwrite_a_state(store):
+    store.save('s1', 1, {'owner': 1})
+    store.save('s1', 2, {'owner': 2})
+    assert store.load('s1', 1) == {'owner': 1}
+
+
+def test_states_expire_and_are_swept(store, monkeypatch):
+    store.save('s1', 1, {})
+    now = diagnosis_sessions.time.time()
+    monkeypatch.setattr(diagnosis_sessions.time, 'time', lambda: now + 61)
+    assert store.load('s1', 1) is None
+    assert store.sweep() == 1
+
+
+def test_delete(store):
+    store.save('s1', 1, {})
+    store.delete('s1')
+    store.delete(None)
+    assert store.load('s1', 1) is None
+
+
+def test_secret_key_is_created_once(tmp_path):
+    path = str(tmp_path / 'instance' / 'secret_key')
+    key = load_secret_key(path)
+    assert len(key) == 32
+    assert os.stat(path).st_mode & 0o777 == 0o600
+    assert load_secret_key(path) == key
+    assert load_secret_key(path, create=False) == key
+
+
+def test_secret_key_is_not_generated_when_creation_is_off(tmp_path):
+    path = tmp_path / 'instance' / 'secret_key'
+    with pytest.raises(RuntimeError):
+        load_secret_key(str(path), create=False)
+    assert not path.exists()
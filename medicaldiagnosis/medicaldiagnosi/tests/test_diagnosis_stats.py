@@ -0,0 +1,100 @@
+# tests/test_diagnosis_stats.py
+# The statistics summary tables: built from history by their migration, then kept equal to
+# history by the triggers.
+
+import sqlite3
+import threading
+
+from diagnosis_stats import get_diagnosis_counts, get_statistics_summary
+from storage import MIGRATIONS, migrate
+
+STATISTICS_MIGRATION = 7
+
+
+def migrate_to(db, target):
+    for version, _description, statements in MIGRATIONS:
+        if version <= target:
+            for statement in statements:
+                db.execute(statement)
+    db.execute(f"PRAGMA user_version = {target}")
+    db.commit()
+
+
+def add_history(db, rows):
+    db.executemany("INSERT INTO history (user_id, datetime, symptoms, diagnosis, confidence) VALUES (1, ?, 'fever', ?, ?)", rows)
+    db.commit()
+
+
+def assert_counts_match_history(db):
+    assert db.execute("SELECT diagnosis, count, round(confidence_total, 6) FROM diagnosis_counts ORDER BY diagnosis").fetchall() == \
+        db.execute("""SELECT diagnosis, COUNT(*), round(COALESCE(SUM(confidence), 0), 6) FROM history
+                      WHERE diagnosis IS NOT NULL AND diagnosis != '' GROUP BY diagnosis ORDER BY diagnosis""").fetchall()
+    assert db.execute("SELECT day, count FROM diagnosis_daily_counts ORDER BY day").fetchall() == \
+        db.execute("""SELECT substr(datetime, 1, 10), COUNT(*) FROM history WHERE datetime IS NOT NULL
+                      GROUP BY substr(datetime, 1, 10) ORDER BY 1""").fetchall()
+
+
+def history_database(path):
+    """A database from before the statistics migration, with history and an outdated summary table."""
+    db = sqlite3.connect(path)
+    migrate_to(db, STATISTICS_MIGRATION - 1)
+    db.execute("INSERT INTO users (name, email, password_hash) VALUES ('A', 'a@example.com', 'x')")
+    add_history(db, [('2024-01-01 09:00:00', 'flu', 40.0), ('2024-01-01 10:00:00', 'flu', 60.0),
+                     ('2024-01-02 09:00:00', 'common_cold', 30.5), ('2024-01-03 09:00:00', None, None)])
+    db.execute("CREATE TABLE diagnosis_counts (diagnosis TEXT PRIMARY KEY, count INTEGER)") # Layout without confidence_total
+    db.execute("INSERT INTO diagnosis_counts VALUES ('flu', 99)")
+    db.commit()
+    return db
+
+
+def test_migration_builds_the_summaries_from_history(tmp_path):
+    db = history_database(tmp_path / 'app.db')
+    assert migrate(db) == [STATISTICS_MIGRATION]
+    assert_counts_match_history(db)
+    assert get_diagnosis_counts(db) == [('flu', 2), ('common_cold', 1)]
+
+
+def test_triggers_keep_the_summaries_equal_to_history(tmp_path):
+    db = history_database(tmp_path / 'app.db')
+    migrate(db)
+    add_history(db, [('2024-01-02 11:00:00', 'flu', 10.0), ('2024-01-04 09:00:00', 'dengue', 70.25)])
+    assert_counts_match_history(db)
+    db.execute("DELETE FROM history WHERE diagnosis = 'common_cold'")
+    db.execute("UPDATE history SET diagnosis = 'dengue', confidence = 55.0, datetime = '2024-01-05 09:00:00' WHERE id = 1")
+    db.commit()
+    assert_counts_match_history(db)
+    db.execute("DELETE FROM history")
+    db.commit()
+    assert db.execute("SELECT COUNT(*) FROM diagnosis_counts").fetchone()[0] == 0
+    assert db.execute("SELECT COUNT(*) FROM diagnosis_daily_counts").fetchone()[0] == 0
+
+
+def test_concurrent_migrations_backfill_once(tmp_path):
+    path = tmp_path / 'app.db'
+    history_database(path).close()
+    errors = []
+
+    def run():
+        try:
+            migrate(sqlite3.connect(path, timeout=10))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert_counts_match_history(sqlite3.connect(path))
+
+
+def test_statistics_summary(tmp_path):
+    db = history_database(tmp_path / 'app.db')
+    migrate(db)
+    summary = get_statistics_summary(db, days=100000)
+    assert summary['total'] == 3
+    assert summary['distribution'][0] == {'diagnosis': 'flu', 'label': 'Flu', 'count': 2, 'avg_confidence': 50.0}
+    assert summary['avg_confidence'] == round((40.0 + 60.0 + 30.5) / 3, 2)
+    assert summary['daily'] == [{'day': '2024-01-01', 'count': 2}, {'day': '2024-01-02', 'count': 1},
+                                {'day': '2024-01-03', 'count': 1}]
@@ -0,0 +1,96 @@
+# tests/test_history.py
+# Keyset pagination of /history and the streamed CSV/JSONL exports.
+
+import csv
+import io
+import json
+import sqlite3
+
+import pytest
+
+from history_export import decode_cursor, encode_cursor, iter_history
+
+
+def test_cursor_round_trip():
+    token = encode_cursor({'datetime': '2024-05-01 10:00:00', 'id': 42})
+    assert decode_cursor(token) == ('2024-05-01 10:00:00', 42)
+    assert '=' not in token
+
+
+@pytest.mark.parametrize('token', [None, '', 'not-base64!', encode_cursor({'datetime': 'x', 'id': 'y'})])
+def test_bad_cursor_is_ignored(token):
+    assert decode_cursor(token) is None
+
+
+def test_iter_history_walks_batches():
+    rows = [{'datetime': f"2024-01-{day:02d}", 'id': day} for day in range(10, 0, -1)]
+    calls = []
+
+    def fetch_page(before, limit):
+        calls.append(before)
+        older = [row for row in rows if before is None or (row['datetime'], row['id']) < before]
+        return older[:limit]
+
+    assert list(iter_history(fetch_page, batch_size=4)) == rows
+    assert calls == [None, ('2024-01-07', 7), ('2024-01-03', 3)]
+
+
+@pytest.fixture
+def history_user(web, login):
+    """A signed-in client and user id with 7 history rows; rows 3-5 share one timestamp."""
+    client = login('history@example.com')
+    with web.app.app_context():
+        db = web.get_db()
+        user_id = db.execute("SELECT id FROM users WHERE email = 'history@example.com'").fetchone()[0]
+        db.execute("DELETE FROM history WHERE user_id = ?", (user_id,))
+        stamps = ['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-03', '2024-01-03', '2024-01-04', '2024-01-05']
+        db.executemany("INSERT INTO history (user_id, datetime, symptoms, diagnosis, confidence) VALUES (?, ?, 'fever', 'flu', ?)",
+                       [(user_id, stamp, float(n)) for n, stamp in enumerate(stamps)])
+        db.commit()
+        expected = [row[0] for row in db.execute("SELECT id FROM history WHERE user_id = ? ORDER BY datetime DESC, id DESC", (user_id,))]
+    return client, user_id, expected
+
+
+def test_pages_cover_history_once_in_both_directions(web, history_user):
+    _client, user_id, expected = history_user
+    with web.app.app_context():
+        pages, before = [], None
+        while True:
+            page = web.get_user_history_page_db(user_id, before=before, limit=3)
+            if not page:
+                break
+            pages.append([row['id'] for row in page])
+            before = (page[-1]['datetime'], page[-1]['id'])
+        assert [row_id for page in pages for row_id in page] == expected
+        assert [len(page) for page in pages] == [3, 3, 1]
+
+        # Paging back from the last page returns the same pages, newest first within each
+        last = web.get_user_history_page_db(user_id, limit=100)[-1]
+        newer = web.get_user_history_page_db(user_id, after=(last['datetime'], last['id']), limit=3)
+        assert [row['id'] for row in newer] == expected[-4:-1]
+
+
+def test_page_links_keep_the_page_size(history_user):
+    client, _user_id, _expected = history_user
+    first = client.get('/history?limit=3').get_data(as_text=True)
+    assert 'Older' in first and 'limit=3' in first
+    older_link = first.split('before=', 1)[1].split('"', 1)[0].replace('&amp;', '&')
+    second = client.get(f"/history?before={older_link}").get_data(as_text=True)
+    assert second.count('limit=3') == 3 # Newest, Newer and Older all keep ?limit=
+
+
+def test_exports_stream_every_row(history_user):
+    client, _user_id, expected = history_user
+    rows = list(csv.DictReader(io.StringIO(client.get('/history/export.csv').get_data(as_text=True))))
+    assert [int(row['id']) for row in rows] == expected
+    lines = client.get('/history/export.jsonl').get_data(as_text=True).splitlines()
+    assert [json.loads(line)['id'] for line in lines] == expected
+
+
+def test_export_aborts_on_a_database_error(web, history_user, monkeypatch):
+    client, _user_id, _expected = history_user
+    monkeypatch.setattr(web, 'HISTORY_COLUMNS', 'no_such_column')
+    with pytest.raises(sqlite3.OperationalError):
+        client.get('/history/export.csv').get_data()
+    # The page view still degrades to an empty page
+    assert client.get('/history').status_code == 200
@@ -0,0 +1,74 @@
+# tests/test_kb_artifact.py
+# The ahead-of-time compiled diagnosis.kb: identical tables, and rejection of anything stale,
+# corrupt or written by another interpreter.
+
+import os
+import shutil
+
+import pytest
+
+import kb_artifact
+from conftest import APP_DIR
+from kb_artifact import HEADER, ArtifactError, build_artifact, load_artifact, load_compiled_knowledge_base, read_header
+from knowledge_base import read_source
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'diagnosis.pl'
+    shutil.copy(os.path.join(APP_DIR, 'diagnosis.pl'), path)
+    return str(path)
+
+
+@pytest.fixture
+def artifact(source, tmp_path):
+    path = str(tmp_path / 'diagnosis.kb')
+    build_artifact(source, path)
+    return path
+
+
+def test_artifact_loads_the_same_tables(kb, source, artifact):
+    loaded = load_artifact(artifact, read_source(source)[1])
+    assert loaded.tables() == kb.tables()
+    assert loaded.symptom_match(['fever', 'cough'], ['no mask'], []) == kb.symptom_match(['fever', 'cough'], ['no mask'], [])
+
+
+def test_artifact_of_another_source_is_rejected(source, artifact):
+    with open(source, 'a', encoding='utf-8') as f:
+        f.write("\n% edited\n")
+    with pytest.raises(ArtifactError, match='different diagnosis.pl'):
+        load_artifact(artifact, read_source(source)[1])
+
+
+def test_corrupt_or_truncated_artifact_is_rejected(source, artifact):
+    digest = read_source(source)[1]
+    with open(artifact, 'r+b') as f:
+        f.seek(HEADER.size + 10)
+        byte = f.read(1)
+        f.seek(HEADER.size + 10)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    with pytest.raises(ArtifactError, match='corrupt'):
+        load_artifact(artifact, digest)
+    with open(artifact, 'r+b') as f:
+        f.truncate(HEADER.size + 5)
+    with pytest.raises(ArtifactError, match='wrong length'):
+        load_artifact(artifact, digest)
+    with open(artifact, 'r+b') as f:
+        f.truncate(10)
+    with pytest.raises(ArtifactError, match='truncated'):
+        read_header(artifact)
+
+
+def test_artifact_of_another_python_is_rejected(source, artifact, monkeypatch):
+    monkeypatch.setattr(kb_artifact, '_interpreter_tag', lambda: b'other-python'.ljust(16, b'\0'))
+    with pytest.raises(ArtifactError, match='another Python version'):
+        load_artifact(artifact, read_source(source)[1])
+
+
+def test_falls_back_to_the_source(kb, source, artifact, tmp_path):
+    assert load_compiled_knowledge_base(source, str(tmp_path / 'missing.kb')).tables() == kb.tables()
+    with open(source, 'a', encoding='utf-8') as f:
+        f.write("\n% edited\n")
+    fallback = load_compiled_knowledge_base(source, artifact)
+    assert fallback.source_digest == read_source(source)[1]
+    assert fallback.diseases == kb.diseases
@@ -0,0 +1,134 @@
+# tests/test_kb_manager.py
+# Hot reload of diagnosis.pl: valid edits are published, invalid ones leave the running
+# version serving.
+
+import os
+import re
+import shutil
+
+import pytest
+
+from conftest import APP_DIR
+from kb_manager import KnowledgeBaseManager, validate_knowledge_base
+from knowledge_base import KnowledgeBase, load_knowledge_base, parse_clauses
+from prolog_engine import PrologEngine
+
+
+def compile_source(source):
+    return KnowledgeBase(parse_clauses(source))
+
+
+def test_shipped_knowledge_base_is_valid(kb):
+    assert validate_knowledge_base(kb) == []
+
+
+def test_validation_reports_every_problem():
+    errors = validate_knowledge_base(compile_source(
+        "test_consult_marker(broken).\n"
+        "disease(flu, [(fever, 0.5)]).\n"
+        "follow_up_question(measles, 'Any rash?').\n"
+        "answer_impact(flu, 'Sudden onset?', maybe, 5).\n"
+        "answer_impact(mumps, 'Swollen glands?', yes, 5).\n"))
+    assert len(errors) == 4
+    assert any('test_consult_marker' in error for error in errors)
+    assert any("unknown disease 'measles'" in error for error in errors)
+    assert any("answer 'maybe'" in error for error in errors)
+    assert any("unknown disease 'mumps'" in error for error in errors)
+
+
+def test_validation_requires_a_positive_weight():
+    errors = validate_knowledge_base(compile_source(
+        "test_consult_marker(loaded_successfully).\n"
+        "disease(flu, [(fever, 0)]).\n"))
+    assert errors == ["No disease/2 fact has symptoms with a positive weight."]
+
+
+@pytest.fixture
+def manager(tmp_path):
+    path = tmp_path / 'diagnosis.pl'
+    shutil.copy(os.path.join(APP_DIR, 'diagnosis.pl'), path)
+    manager = KnowledgeBaseManager(str(path), load_knowledge_base, lambda kb: {'prepared': len(kb.diseases)})
+    manager.load_initial()
+    return manager
+
+
+def edit(manager, text):
+    with open(manager.prolog_file_path, 'a', encoding='utf-8') as f:
+        f.write(text)
+
+
+def test_unchanged_source_keeps_the_version(manager):
+    current = manager.current
+    assert manager.reload() == (current, [])
+
+
+def test_valid_edit_is_published(manager):
+    previous = manager.current
+    edit(manager, "\ndisease(test_disease, [(fever, 0.5), (rash, 0.5)]).\n")
+    version, errors = manager.reload()
+    assert errors == []
+    assert version is manager.current and version.version != previous.version
+    assert 'test_disease' in version.kb.diseases
+    assert version.prepared == previous.prepared + 1
+    assert 'test_disease' not in previous.kb.diseases # Requests holding the old version are unaffected
+
+
+def test_invalid_edit_keeps_serving_the_old_version(manager):
+    previous = manager.current
+    edit(manager, "\nfollow_up_question(measles, 'Any rash?').\n")
+    version, errors = manager.reload()
+    assert version is previous and manager.current is previous
+    assert errors == ["follow_up_question/2 refers to unknown disease 'measles'."]
+    assert manager.status()['last_error'] == errors
+
+
+def test_unparseable_edit_keeps_serving_the_old_version(manager):
+    previous = manager.current
+    edit(manager, "\ndisease(broken, [(fever, 0.5)\n")
+    version, errors = manager.reload()
+    assert version is previous and errors
+    edit(manager, "]).\n") # Fixing the file publishes it and clears the error
+    version, errors = manager.reload()
+    assert errors == [] and 'broken' in version.kb.diseases
+    assert manager.status()['last_error'] is None
+
+
+class RecordingProlog:
+    """Stands in for pyswip's Prolog: records goals and returns no solutions."""
+
+    def __init__(self):
+        self.goals = []
+
+    def query(self, goal):
+        self.goals.append(goal)
+        return iter(())
+
+
+def test_prolog_engine_consults_only_published_versions(tmp_path):
+    path = tmp_path / 'diagnosis.pl'
+    shutil.copy(os.path.join(APP_DIR, 'diagnosis.pl'), path)
+    manager = KnowledgeBaseManager(str(path), load_knowledge_base, lambda kb: {}, snapshot_dir=str(tmp_path / 'kb_versions'))
+    manager.load_initial()
+    engine = PrologEngine(str(path), published=lambda: manager.current)
+    engine._prolog = prolog = RecordingProlog()
+
+    def consulted():
+        engine.query('true.')
+        consults = [goal for goal in prolog.goals if goal.startswith('setup_call_cleanup(open(')]
+        snapshot = re.search(r"open\('([^']+)'", consults[-1]).group(1)
+        with open(snapshot, encoding='utf-8') as f:
+            return f.read()
+
+    published_source = consulted()
+    assert published_source == path.read_text(encoding='utf-8')
+
+    edit(manager, "\nfollow_up_question(measles, 'Any rash?').\n")
+    assert manager.reload()[1] # Rejected
+    engine.query('true.')
+    assert engine.consult_count == 1 # The invalid edit is never consulted
+    assert 'measles' not in consulted()
+
+    edit(manager, "\ndisease(measles, [(rash, 0.5)]).\n")
+    assert manager.reload()[1] == []
+    assert 'disease(measles' in consulted()
+    assert engine.consult_count == 2
@@ -0,0 +1,84 @@
+# tests/test_knowledge_base.py
+# Pins the compiled Python engine to the symptom_match/5 and diagnosis_bundle/9 rules of
+# diagnosis.pl. The comparison against SWI-Prolog itself runs when swipl is installed.
+
+import shutil
+
+import pytest
+
+LOSS_OF_TASTE = 'Have you experienced a recent loss of smell or taste?'
+
+
+def scores(kb, symptoms, risk_factors=(), answers=()):
+    return dict(kb.symptom_match(list(symptoms), list(risk_factors), list(answers)))
+
+
+def test_symptom_percent_of_total_weight(kb):
+    result = scores(kb, ['fever', 'cough'])
+    assert result['flu'] == pytest.approx((0.8 + 0.7) / 3.9 * 100)
+    assert result['covid19'] == pytest.approx((0.9 + 0.9) / 4.2 * 100)
+    assert result['pneumonia'] == pytest.approx((0.8 + 0.9) / 3.9 * 100)
+    assert result['migraine'] == 0.0
+
+
+def test_every_scored_disease_in_findall_order(kb):
+    diseases = [disease for disease, _score in kb.symptom_match(['fever'], [], [])]
+    assert diseases == [d for d, total in zip(kb.diseases, kb.total_weights) if total > 0]
+
+
+def test_risk_factor_bonus_counts_duplicates_and_is_capped(kb):
+    assert scores(kb, ['frequent_urination'], ['obesity'])['diabetes'] == pytest.approx(0.8 / 2.7 * 100 + 5)
+    assert scores(kb, [], ['obesity'])['hypertension'] == pytest.approx(5)
+    # intersection/3 keeps the user's duplicates
+    assert scores(kb, [], ['obesity', 'obesity'])['diabetes'] == pytest.approx(10)
+    all_four = ['obesity', 'family_history', 'sedentary lifestyle', 'poor diet']
+    assert scores(kb, [], all_four)['diabetes'] == pytest.approx(15) # max_risk_factor_bonus
+
+
+def test_answer_impacts_adjust_and_clamp(kb):
+    result = scores(kb, ['fever', 'cough'], answers=[(LOSS_OF_TASTE, 'yes')])
+    assert result['covid19'] == pytest.approx((0.9 + 0.9) / 4.2 * 100 + 20)
+    assert result['flu'] == pytest.approx((0.8 + 0.7) / 3.9 * 100 - 10)
+    assert result['common_cold'] == pytest.approx(0.6 / 3.2 * 100 - 10)
+    # A negative adjustment never takes a score below zero
+    assert scores(kb, ['rash'], answers=[(LOSS_OF_TASTE, 'yes')])['flu'] == 0.0
+    # 'no' has no impact for this question
+    assert scores(kb, ['fever', 'cough'], answers=[(LOSS_OF_TASTE, 'no')]) == scores(kb, ['fever', 'cough'])
+
+
+def test_rescore_from_base_scores_matches_full_match(kb):
+    answers = [(LOSS_OF_TASTE, 'yes')]
+    base = kb.base_scores(['fever', 'cough'], ['no mask'])
+    assert kb.rescore(base, answers) == kb.symptom_match(['fever', 'cough'], ['no mask'], answers)
+
+
+def test_bundle_ranks_and_details_the_leader(kb):
+    bundle = kb.diagnosis_bundle(['fever', 'cough'], [], [], 3)
+    assert [disease for disease, _score in bundle['ranked'][:3]] == ['pneumonia', 'covid19', 'flu']
+    expected_questions = sorted({q for d in ('pneumonia', 'covid19', 'flu') for q in kb.follow_ups_for(d)})
+    assert bundle['follow_up_questions'] == expected_questions
+    assert bundle['advice'].startswith('Take the full course of any prescribed antibiotics.')
+    assert isinstance(bundle['treatment'], list)
+
+
+def test_unknown_disease_details_fall_back(kb):
+    bundle = kb.diagnosis_bundle([], [], [], 3)
+    assert all(score == 0.0 for _disease, score in bundle['ranked'])
+    assert kb.test_for('no_such_disease') is None
+    assert kb.advice_for('no_such_disease') == kb.default_advice
+
+
+def swipl_available():
+    if shutil.which('swipl') is None:
+        return False
+    try:
+        import pyswip # noqa: F401
+    except Exception: # ImportError, or pyswip failing to locate libswipl
+        return False
+    return True
+
+
+@pytest.mark.skipif(not swipl_available(), reason="SWI-Prolog and pyswip are not installed")
+def test_matches_prolog(web):
+    import check_parity
+    assert check_parity.main(['--samples', '200']) == 0
@@ -0,0 +1,91 @@
+# tests/test_metrics.py
+# Prometheus rendering of the metrics registry, the /metrics endpoint, structured logging
+# and the request profiler.
+
+import json
+import logging
+import pstats
+
+from app_logging import JsonFormatter, RateLimitFilter
+from metrics import MetricsRegistry
+from request_profiler import RequestProfiler
+
+
+def test_registry_renders_prometheus_text():
+    registry = MetricsRegistry()
+    requests = registry.counter('requests_total', "Requests.", ('path',))
+    requests.inc(path='/a')
+    requests.inc(2, path='/b "quoted"')
+    latency = registry.histogram('latency_seconds', "Latency.", buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        latency.observe(value)
+    registry.gauge_callback('queue_depth', "Depth.", lambda: {'high': 2, 'low': 1}, 'priority')
+    registry.gauge_callback('broken', "Raises.", lambda: 1 / 0)
+    assert registry.counter('requests_total', "Registered again.") is requests
+
+    assert registry.render().splitlines() == [
+        '# HELP requests_total Requests.',
+        '# TYPE requests_total counter',
+        'requests_total{path="/a"} 1',
+        'requests_total{path="/b \\"quoted\\""} 2',
+        '# HELP latency_seconds Latency.',
+        '# TYPE latency_seconds histogram',
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1.0"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        'latency_seconds_sum 4.05',
+        'latency_seconds_count 4',
+        '# HELP queue_depth Depth.',
+        '# TYPE queue_depth gauge',
+        'queue_depth{priority="high"} 2',
+        'queue_depth{priority="low"} 1',
+    ]
+
+
+def test_metrics_endpoint_requires_the_token(web, monkeypatch):
+    client = web.app.test_client()
+    assert client.get('/metrics').status_code == 200
+    monkeypatch.setitem(web.app.config, 'METRICS_TOKEN', 'scrape-token')
+    for headers in ({}, {'Authorization': 'Bearer wrong'}, {'Authorization': 'Basic scrape-token'}):
+        response = client.get('/metrics', headers=headers)
+        assert response.status_code == 401
+        assert response.headers['WWW-Authenticate'] == 'Bearer'
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scrape-token'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
+    assert '# TYPE http_request_duration_seconds histogram' in response.get_data(as_text=True)
+
+
+def record(event, **fields):
+    record = logging.LogRecord('medicaldiagnosis.test', logging.WARNING, __file__, 1, event, None, None)
+    record.fields = fields
+    return record
+
+
+def test_log_records_are_json_lines():
+    entry = json.loads(JsonFormatter().format(record('prolog.query_failed', goal='x', error='boom')))
+    assert entry['event'] == 'prolog.query_failed' and entry['level'] == 'warning'
+    assert (entry['goal'], entry['error']) == ('x', 'boom')
+
+
+def test_rate_limit_counts_suppressed_records(monkeypatch):
+    now = [0.0]
+    monkeypatch.setattr('app_logging.time.monotonic', lambda: now[0])
+    limit = RateLimitFilter(burst=2, interval=10)
+    assert [limit.filter(record('a')) for _ in range(4)] == [True, True, False, False]
+    assert limit.filter(record('b')) # Limited per event
+    now[0] = 10.0
+    resumed = record('a')
+    assert limit.filter(resumed)
+    assert resumed.fields['suppressed_since_last'] == 2
+
+
+def test_profiler_writes_a_profile(tmp_path):
+    profiler = RequestProfiler(output_dir=str(tmp_path), allow_header=True, top=5)
+    assert profiler.should_profile({'X-Profile': '1'}) and not profiler.should_profile({})
+    profile = profiler.start()
+    sorted(range(1000), key=lambda n: -n)
+    path, summary = profiler.finish(profile, '/diagnose/follow-up POST')
+    assert path.startswith(str(tmp_path)) and 'diagnose_follow-up_POST_' in path
+    assert pstats.Stats(path).total_calls > 0
+    assert 'function calls' in summary and profiler.profiled == 1
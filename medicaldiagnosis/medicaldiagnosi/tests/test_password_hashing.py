@@ -0,0 +1,118 @@
+# tests/test_password_hashing.py
+# Password hashes: verification, upgrades to the configured hasher on login, and the KDF
+# executor's concurrency limits.
+
+import hashlib
+import threading
+import time
+
+import pytest
+
+from conftest import TEST_PASSWORD
+from password_hashing import KdfBusyError, KdfExecutor, LegacySHA256Hasher, PasswordHashers, PBKDF2Hasher, ScryptHasher
+
+FAST_PBKDF2 = PBKDF2Hasher(iterations=1000)
+FAST_SCRYPT = ScryptHasher(n=2 ** 8)
+
+
+@pytest.mark.parametrize('hasher', [FAST_PBKDF2, FAST_SCRYPT], ids=lambda hasher: hasher.algorithm)
+def test_hash_and_verify(hasher):
+    hashers = PasswordHashers(hasher)
+    encoded = hashers.hash('secret')
+    assert encoded.startswith(hasher.algorithm + '$')
+    assert encoded != hashers.hash('secret') # Salted
+    assert hashers.check(encoded, 'secret') == (True, None)
+    assert hashers.check(encoded, 'wrong') == (False, None)
+
+
+def test_legacy_hashes_are_verify_only():
+    with pytest.raises(ValueError, match='verify-only'):
+        LegacySHA256Hasher().encode('secret')
+
+
+@pytest.mark.parametrize('preferred', [FAST_PBKDF2, FAST_SCRYPT], ids=lambda hasher: hasher.algorithm)
+def test_legacy_hash_is_replaced_by_the_configured_hasher(preferred):
+    legacy = hashlib.sha256(b'secret').hexdigest()
+    hashers = PasswordHashers(preferred)
+    matches, replacement = hashers.check(legacy, 'secret')
+    assert matches and replacement.startswith(preferred.algorithm + '$')
+    assert hashers.check(replacement, 'secret') == (True, None)
+    assert hashers.check(legacy.upper(), 'wrong') == (False, None)
+
+
+def test_outdated_cost_or_algorithm_is_rehashed():
+    old = PasswordHashers(PBKDF2Hasher(iterations=500)).hash('secret')
+    matches, replacement = PasswordHashers(FAST_PBKDF2).check(old, 'secret')
+    assert matches and replacement.startswith('pbkdf2_sha256$1000$')
+    matches, replacement = PasswordHashers(FAST_SCRYPT).check(old, 'secret')
+    assert matches and replacement.startswith('scrypt$256$8$1$')
+
+
+def test_unknown_user_and_unknown_algorithm():
+    hashers = PasswordHashers(FAST_PBKDF2)
+    assert hashers.check(None, 'secret') == (False, None)
+    with pytest.raises(ValueError, match='Unknown password hash algorithm'):
+        hashers.check('bcrypt$12$abc$def', 'secret')
+
+
+def hold(executor, keys):
+    """Occupies one executor slot for `keys` until the returned event is set."""
+    release = threading.Event()
+    thread = threading.Thread(target=executor.run, args=(release.wait,), kwargs={'keys': keys})
+    in_flight = executor.in_flight
+    thread.start()
+    while executor.in_flight == in_flight:
+        time.sleep(0.001)
+    return release, thread
+
+
+def test_executor_limits_per_key_and_in_total():
+    executor = KdfExecutor(threads=2, max_pending=0, per_key={'email': 1})
+    release, thread = hold(executor, [('email', 'a@example.com')])
+    with pytest.raises(KdfBusyError) as e:
+        executor.run(lambda: None, keys=[('email', 'a@example.com')])
+    assert e.value.limit == 'email'
+    assert executor.run(lambda: 'ok', keys=[('email', 'b@example.com')]) == 'ok'
+
+    other_release, other_thread = hold(executor, [('email', 'b@example.com')])
+    with pytest.raises(KdfBusyError) as e:
+        executor.run(lambda: None, keys=[('email', 'c@example.com')])
+    assert e.value.limit == 'total'
+    for event, worker in ((release, thread), (other_release, other_thread)):
+        event.set()
+        worker.join()
+    assert executor.in_flight == 0
+    assert executor.run(lambda: 'ok', keys=[('email', 'a@example.com')]) == 'ok'
+
+
+def test_login_upgrades_a_legacy_hash(web):
+    email = 'legacy@example.com'
+    with web.app.app_context():
+        db = web.get_db()
+        db.execute("INSERT INTO users (name, email, password_hash, age, weight) VALUES (?, ?, ?, 40, 70)",
+                   ('Legacy User', email, hashlib.sha256(TEST_PASSWORD.encode('utf-8')).hexdigest()))
+        db.commit()
+    client = web.app.test_client()
+    response = client.post('/login', data={'email': email, 'password': TEST_PASSWORD})
+    assert response.status_code == 302 and '/login' not in response.headers['Location']
+    with web.app.app_context():
+        stored = web.get_db().execute("SELECT password_hash FROM users WHERE email = ?", (email,)).fetchone()[0]
+    assert stored.startswith('pbkdf2_sha256$1000$')
+    response = web.app.test_client().post('/login', data={'email': email, 'password': TEST_PASSWORD})
+    assert response.status_code == 302 and '/login' not in response.headers['Location']
+
+
+def test_concurrent_logins_for_one_account_are_turned_away(web, login):
+    email = 'busy@example.com'
+    login(email)
+    held = [hold(web.kdf_executor, [('email', email)]) for _ in range(web.app.config['AUTH_PER_EMAIL'])]
+    try:
+        response = web.app.test_client().post('/login', data={'email': email, 'password': TEST_PASSWORD})
+        assert response.status_code == 429
+        assert response.headers['Retry-After'] == '1'
+    finally:
+        for release, thread in held:
+            release.set()
+            thread.join()
+    response = web.app.test_client().post('/login', data={'email': email, 'password': TEST_PASSWORD})
+    assert response.status_code == 302
@@ -0,0 +1,93 @@
+# tests/test_report_jobs.py
+# The report job queue, and job state shared between worker processes through report_jobs.
+
+import threading
+import time
+
+import pytest
+
+from report_jobs import DONE, FAILED, RUNNING, ReportJobQueue, ReportJobStore
+from storage import ConnectionPool, migrate
+
+
+@pytest.fixture
+def store(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'app.db'))
+    migrate(pool.connection())
+    return ReportJobStore(pool.connection)
+
+
+def test_job_runs_and_reports_its_file(store, tmp_path):
+    queue = ReportJobQueue(worker_count=1, store=store)
+    job_id = queue.submit(lambda: str(tmp_path / 'report.pdf'), user_id=7)
+    job = queue.wait(job_id, 5)
+    assert job.status == DONE and job.user_id == 7
+    assert job.to_dict()['filename'] == 'report.pdf'
+
+
+def test_failed_attempts_are_retried(store):
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise OSError("disk full")
+        return '/reports/report.pdf'
+
+    queue = ReportJobQueue(worker_count=1, max_attempts=3, retry_delay=0, store=store)
+    assert queue.wait(queue.submit(flaky), 5).status == DONE
+    assert len(attempts) == 3
+
+    job = queue.wait(queue.submit(lambda: None), 5)
+    assert job.status == FAILED and job.attempts == 3
+    assert store.load(job.id).status == FAILED # The final state reaches the store
+
+
+def test_other_processes_see_the_job_through_the_store(store):
+    release = threading.Event()
+    worker = ReportJobQueue(worker_count=1, store=store)
+    job_id = worker.submit(lambda: release.wait(5) and '/reports/report.pdf', user_id=3)
+
+    other = ReportJobQueue(worker_count=1, store=store) # Another worker process: it never ran the job
+    assert not other.is_local(job_id)
+    assert other.get(job_id).status in ('queued', RUNNING)
+    assert other.get('unknown') is None
+
+    threading.Timer(0.2, release.set).start()
+    job = other.wait(job_id, 5, poll_interval=0.05)
+    assert job.status == DONE and job.user_id == 3
+    assert job.to_dict()['filename'] == 'report.pdf'
+
+
+def test_jobs_left_running_by_a_dead_worker_fail(store):
+    queue = ReportJobQueue(worker_count=1, store=store)
+    job_id = queue.submit(lambda: '/reports/report.pdf')
+    queue.wait(job_id, 5)
+    db = store.connection()
+    db.execute("UPDATE report_jobs SET status = ?, finished_at = NULL, updated_at = ? WHERE id = ?",
+               (RUNNING, time.time() - store.stale_after - 1, job_id))
+    db.commit()
+    job = store.load(job_id)
+    assert job.status == FAILED and job.finished.is_set()
+
+
+def test_status_and_download_from_another_worker(web, login, monkeypatch, tmp_path):
+    client = login('reports@example.com')
+    with web.app.app_context():
+        user_id = web.get_db().execute("SELECT id FROM users WHERE email = 'reports@example.com'").fetchone()[0]
+    pdf = tmp_path / 'Report_test.pdf'
+    pdf.write_bytes(b'%PDF-1.4 test')
+    job_id = web.report_queue.submit(lambda: str(pdf), user_id=user_id)
+    web.report_queue.wait(job_id, 5)
+    with client.session_transaction() as session:
+        session['last_report_job'] = job_id
+
+    # Requests now reach a worker whose own queue never saw the job
+    monkeypatch.setattr(web, 'report_queue', ReportJobQueue(worker_count=1, store=web.report_queue.store))
+    response = client.get(f"/report/status/{job_id}?wait=1")
+    assert response.status_code == 200 and response.get_json()['status'] == DONE
+    download = client.get('/report/download/last')
+    assert download.status_code == 200 and download.data == b'%PDF-1.4 test'
+
+    assert login('someone-else@example.com').get(f"/report/status/{job_id}").status_code == 404
+    assert client.get('/report/status/unknown').status_code == 404
@@ -0,0 +1,67 @@
+# tests/test_report_renderer.py
+# The PDF renderer's wrapped-line cache must never change the output.
+
+from datetime import datetime, timezone
+
+import pytest
+from fpdf import FPDF
+
+import report_renderer
+from report_renderer import DISCLAIMER_TEXT, ReportRenderer
+
+USER = {'name': "Test User", 'age': 40, 'weight': 70, 'medical_conditions': 'asthma, diabetes'}
+DIAGNOSIS = {'symptoms': ['fever', 'cough', 'body_ache'], 'disease': 'flu', 'confidence': 61.5, 'test': 'rapid_flu_test',
+             'treatment': ['rest', 'fluids', 'antivirals'], 'advice': "Stay home and rest. " * 12,
+             'personalized_advice': "With asthma, keep your inhaler close and watch for shortness of breath. " * 3}
+
+
+class FixedDateFPDF(FPDF):
+    """FPDF whose creation date (written into the file and its /ID) does not depend on the clock."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.creation_date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture(autouse=True)
+def fixed_date(monkeypatch):
+    monkeypatch.setattr(report_renderer, 'FPDF', FixedDateFPDF)
+
+
+def render(renderer):
+    return renderer.render(USER, DIAGNOSIS, report_time="2024-01-01 09:00:00")
+
+
+def test_cached_and_uncached_renders_are_identical():
+    renderer = ReportRenderer()
+    first = render(renderer)
+    hits = renderer._wrap_cached.cache_info().hits
+    assert render(renderer) == first
+    assert renderer._wrap_cached.cache_info().hits > hits # The second render was served from the cache
+    assert render(ReportRenderer(wrap_cache_size=0)) == first
+    assert first.startswith(b'%PDF')
+
+
+def test_cached_lines_match_a_fresh_wrap():
+    renderer = ReportRenderer()
+    text = DIAGNOSIS['advice']
+    assert renderer.wrap(text) == renderer.wrap(text) == ReportRenderer(wrap_cache_size=0).wrap(text)
+    assert len(renderer.wrap(text)) > 1
+
+
+def test_width_and_font_are_part_of_the_cache_key():
+    renderer = ReportRenderer()
+    text = DISCLAIMER_TEXT
+    full_width = renderer.wrap(text, 'I', 10)
+    narrow = renderer.wrap(text, 'I', 10, width=60)
+    assert len(narrow) > len(full_width)
+    assert renderer.wrap(text, 'I', 14) != full_width
+    assert renderer.disclaimer_lines == full_width
+
+    renderer.font = 'Courier' # Wider glyphs: the cached Helvetica lines must not be reused
+    courier = renderer.wrap(text, 'I', 10)
+    assert courier != full_width
+    assert courier == ReportRenderer(wrap_cache_size=0, font='Courier').wrap(text, 'I', 10)
+    assert renderer.disclaimer_lines == courier
+    assert render(renderer) == render(ReportRenderer(font='Courier'))
+    assert render(renderer) != render(ReportRenderer())
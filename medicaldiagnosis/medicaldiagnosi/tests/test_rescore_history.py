@@ -0,0 +1,106 @@
+# tests/test_rescore_history.py
+# The history re-scoring pipeline against a small history database: the diff table, resuming
+# from a checkpoint, and --restart.
+
+import os
+import shutil
+import sqlite3
+
+import pytest
+
+import rescore_history
+from batch_diagnosis import BatchScorer
+from conftest import APP_DIR
+from knowledge_base import load_knowledge_base
+from storage import migrate
+from vocabulary import SYMPTOMS
+
+# (symptoms, stored as a bitset?) per history row, ids 1..6
+ROWS = [(['fever', 'cough'], True), (['rash', 'headache'], True), (['sneezing', 'runny_nose'], False),
+        (['rash', 'joint_pain'], False), (['wheezing'], True), (['rash'], True)]
+VOCABULARY = ['fever', 'cough', 'rash', 'headache', 'sneezing', 'runny_nose', 'joint_pain', 'wheezing']
+
+
+@pytest.fixture
+def files(tmp_path, kb):
+    baseline = tmp_path / 'diagnosis.pl'
+    shutil.copy(os.path.join(APP_DIR, 'diagnosis.pl'), baseline)
+    edited = tmp_path / 'new_diagnosis.pl'
+    shutil.copy(baseline, edited)
+    with open(edited, 'a', encoding='utf-8') as f:
+        f.write("\ndisease(test_rash, [(rash, 5.0)]).\n") # Takes the top spot for every row with a rash
+
+    database = tmp_path / 'history.db'
+    db = sqlite3.connect(database)
+    migrate(db)
+    db.execute("INSERT INTO users (name, email, password_hash) VALUES ('A', 'a@example.com', 'x')")
+    db.executemany("INSERT INTO vocabulary (kind, bit, atom) VALUES (?, ?, ?)",
+                   [(SYMPTOMS, bit, atom) for bit, atom in enumerate(VOCABULARY)])
+    scorer = BatchScorer(kb)
+    for symptoms, as_mask in ROWS:
+        diagnosis, confidence = scorer.diagnose([symptoms], [[]], 1)[0][0]
+        mask = sum(1 << VOCABULARY.index(s) for s in symptoms)
+        db.execute("""INSERT INTO history (user_id, datetime, symptoms, symptoms_mask, diagnosis, confidence)
+                      VALUES (1, '2024-01-01', ?, ?, ?, ?)""",
+                   (None if as_mask else ','.join(symptoms), mask.to_bytes(1, 'little') if as_mask else None,
+                    diagnosis, round(confidence, 2)))
+    db.commit()
+    db.close()
+    return {'baseline': str(baseline), 'kb': str(edited), 'database': str(database),
+            'output': str(tmp_path / 'rescore.db'), 'artifact': str(tmp_path / 'missing.kb')}
+
+
+def rescore(files, *extra):
+    return rescore_history.main(['--kb', files['kb'], '--baseline', files['baseline'], '--database', files['database'],
+                                 '--output', files['output'], '--artifact', files['artifact'],
+                                 '--workers', '1', '--chunk-size', '2', *extra])
+
+
+def run_id(files):
+    return f"{load_knowledge_base(files['kb']).source_digest[:12]}:{load_knowledge_base(files['baseline']).source_digest[:12]}"
+
+
+def diff_rows(files):
+    with sqlite3.connect(files['output']) as db:
+        return db.execute("""SELECT history_id, symptoms, new_diagnosis, top_changed FROM rescore_diff
+                             WHERE run_id = ? ORDER BY history_id""", (run_id(files),)).fetchall()
+
+
+def run_row(files):
+    with sqlite3.connect(files['output']) as db:
+        return db.execute("SELECT last_history_id, rows_scanned, rows_changed, finished_at FROM rescore_runs WHERE run_id = ?",
+                          (run_id(files),)).fetchone()
+
+
+def test_rows_whose_top_diagnosis_changes_are_recorded(files):
+    assert rescore(files) == 0
+    assert diff_rows(files) == [(2, 'rash,headache', 'test_rash', 1), (4, 'rash,joint_pain', 'test_rash', 1),
+                                (6, 'rash', 'test_rash', 1)]
+    last_id, scanned, changed, finished_at = run_row(files)
+    assert (last_id, scanned, changed) == (6, 6, 3) and finished_at is not None
+
+
+def test_finished_run_is_not_repeated(files, capsys):
+    rescore(files)
+    capsys.readouterr()
+    assert rescore(files) == 0
+    assert 'already finished' in capsys.readouterr().err
+    assert run_row(files)[1] == 6
+
+
+def test_interrupted_run_resumes_after_the_checkpoint(files, capsys):
+    # A run that stopped after committing the chunk ending at history id 3
+    output = rescore_history.open_output(files['output'])
+    kb_version, baseline = run_id(files).split(':')
+    rescore_history.start_run(output, run_id(files), kb_version, baseline, restart=False)
+    rescore_history.record_chunk(output, run_id(files), 3, 3, [])
+    output.close()
+
+    assert rescore(files) == 0
+    assert 'Resuming run' in capsys.readouterr().err
+    assert [row[0] for row in diff_rows(files)] == [4, 6] # Rows up to the checkpoint are not scored again
+    assert run_row(files)[:3] == (6, 6, 2)
+
+    assert rescore(files, '--restart') == 0
+    assert [row[0] for row in diff_rows(files)] == [2, 4, 6]
+    assert run_row(files)[:3] == (6, 6, 3)
@@ -0,0 +1,77 @@
+# tests/test_storage.py
+
+import sqlite3
+import threading
+
+from storage import MIGRATIONS, SCHEMA_VERSION, ConnectionPool, migrate
+
+
+def columns(db, table):
+    return {row[1] for row in db.execute(f"PRAGMA table_info({table})")}
+
+
+def test_fresh_database_gets_every_migration(tmp_path):
+    db = sqlite3.connect(tmp_path / 'app.db')
+    assert migrate(db) == [version for version, _description, _statements in MIGRATIONS]
+    assert db.execute("PRAGMA user_version").fetchone()[0] == SCHEMA_VERSION
+    assert {'symptoms_mask', 'kb_version'} <= columns(db, 'history')
+    assert migrate(db) == [] # Already up to date
+
+
+def test_existing_database_is_upgraded_in_place(tmp_path):
+    db = sqlite3.connect(tmp_path / 'app.db')
+    # The original schema, as created before migrations existed (user_version 0)
+    for statement in MIGRATIONS[0][2]:
+        db.execute(statement)
+    db.execute("INSERT INTO users (name, email, password_hash) VALUES ('A', 'a@example.com', 'x')")
+    db.execute("INSERT INTO history (user_id, datetime, symptoms, diagnosis, confidence) VALUES (1, '2024-01-01', 'fever', 'flu', 20.5)")
+    db.commit()
+
+    migrate(db)
+    assert db.execute("SELECT symptoms, diagnosis, confidence, symptoms_mask, kb_version FROM history").fetchall() == \
+        [('fever', 'flu', 20.5, None, None)]
+    indexes = {row[1] for row in db.execute("PRAGMA index_list(history)")}
+    assert {'idx_history_user_datetime', 'idx_history_diagnosis'} <= indexes
+
+
+def test_concurrent_migrations_apply_once(tmp_path):
+    path = tmp_path / 'app.db'
+    applied, errors = [], []
+
+    def run():
+        try:
+            applied.extend(migrate(sqlite3.connect(path, timeout=10)))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert sorted(applied) == [version for version, _description, _statements in MIGRATIONS]
+
+
+def test_pool_keeps_one_tuned_connection_per_thread(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'app.db'))
+    db = pool.connection()
+    assert pool.connection() is db
+    assert db.execute("PRAGMA journal_mode").fetchone()[0] == 'wal'
+    other = []
+    thread = threading.Thread(target=lambda: other.append(pool.connection()))
+    thread.start()
+    thread.join()
+    assert other[0] is not db
+    assert pool.connections_opened == 2
+
+
+def test_release_rolls_back_an_unfinished_transaction(tmp_path):
+    pool = ConnectionPool(str(tmp_path / 'app.db'))
+    db = pool.connection()
+    db.execute("CREATE TABLE t (x INTEGER)")
+    db.commit()
+    db.execute("INSERT INTO t VALUES (1)")
+    pool.release()
+    assert not db.in_transaction
+    assert db.execute("SELECT COUNT(*) FROM t").fetchone()[0] == 0
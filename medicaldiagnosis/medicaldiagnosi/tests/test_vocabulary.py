@@ -0,0 +1,77 @@
+# tests/test_vocabulary.py
+# Symptom/risk factor interning: permanent bits, spelling-insensitive encoding, and bitset
+# scoring that matches the list-based engine.
+
+import sqlite3
+
+import pytest
+
+from storage import migrate
+from vocabulary import RISK_FACTORS, SYMPTOMS, Vocabulary, load_vocabulary, normalize_term
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = sqlite3.connect(tmp_path / 'app.db', isolation_level=None)
+    migrate(db)
+    return db
+
+
+@pytest.mark.parametrize('text, key', [('body ache', 'body_ache'), ('Body_Ache', 'body_ache'),
+                                       ('cold hands/feet', 'cold_hands_feet'), ('  Fever ', 'fever')])
+def test_normalize_term(text, key):
+    assert normalize_term(text) == key
+
+
+def test_labels_and_atoms_share_a_bit(db):
+    vocabulary = load_vocabulary(db, SYMPTOMS, ['body_ache', 'fever'], ['body ache', 'Fever', 'itching'])
+    assert vocabulary.bit('body ache') == vocabulary.bit('body_ache') == vocabulary.bit('BODY ACHE')
+    mask = vocabulary.encode(['body ache', 'fever', 'not a symptom'])
+    assert sorted(vocabulary.atoms_of(mask)) == ['body_ache', 'fever']
+    assert 'itching' in vocabulary.labels_of(vocabulary.encode(['itching']))
+    assert {'body ache', 'body_ache', 'itching'} <= vocabulary.offered_terms
+
+
+def test_bits_are_permanent_and_only_appended(db):
+    first = load_vocabulary(db, SYMPTOMS, ['fever', 'cough'], [])
+    stored_mask = first.encode(['cough'])
+    stored_blob = first.to_bytes(stored_mask)
+
+    # A later diagnosis.pl drops cough and adds rash: cough keeps its bit, rash gets a new one
+    second = load_vocabulary(db, SYMPTOMS, ['fever', 'rash'], [])
+    assert second.bit('fever') == first.bit('fever')
+    assert second.atoms_of(Vocabulary.from_bytes(stored_blob)) == ['cough']
+    assert second.bit('rash') == len(first)
+
+
+def test_byte_encoding_round_trip():
+    vocabulary = Vocabulary(SYMPTOMS, [f"s{n}" for n in range(20)], [f"s {n}" for n in range(20)])
+    mask = vocabulary.encode(['s0', 's9', 's19'])
+    blob = vocabulary.to_bytes(mask)
+    assert len(blob) == vocabulary.byte_width == 3
+    assert Vocabulary.from_bytes(blob) == mask
+    assert vocabulary.bits(mask) == [0, 9, 19]
+
+
+def test_bitset_scoring_matches_list_scoring(kb, db):
+    symptoms = load_vocabulary(db, SYMPTOMS, kb.symptom_index, [])
+    risks = load_vocabulary(db, RISK_FACTORS, kb.risk_index, [])
+    kb.index_vocabulary(symptoms.atoms, risks.atoms)
+    for chosen, chosen_risks in ((['fever', 'cough'], []), (['rash', 'fever', 'headache'], ['obesity', 'no mask']),
+                                 (['fatigue'], ['iron deficiency', 'blood loss'])):
+        symptom_mask, risk_mask = symptoms.encode(chosen), risks.encode(chosen_risks)
+        expected = kb.symptom_match(symptoms.atoms_of(symptom_mask), risks.atoms_of(risk_mask), [])
+        assert kb.rescore(kb.mask_base_scores(symptom_mask, risk_mask), []) == expected
+
+
+def test_history_rows_store_the_bitset(web, login):
+    client = login('bitsets@example.com')
+    with web.app.app_context():
+        kbv = web.active_kb()
+        mask = kbv.symptom_vocabulary.encode(['fever', 'cough'])
+        user_id = web.get_db().execute("SELECT id FROM users WHERE email = 'bitsets@example.com'").fetchone()[0]
+        assert web.add_diagnosis_db(user_id, mask, 'flu', 40.0, None, kbv.version)
+        row = web.get_db().execute("SELECT symptoms, symptoms_mask FROM history WHERE user_id = ?", (user_id,)).fetchone()
+    assert row['symptoms'] is None
+    assert kbv.symptom_vocabulary.from_bytes(row['symptoms_mask']) == mask
+    assert client.get('/history').get_data(as_text=True).count('fever') >= 1
@@ -0,0 +1,44 @@
+# tests/test_wsgi.py
+# The pre-fork warm-up: it must never start the (fork-unsafe) SWI-Prolog runtime in the
+# gunicorn master; workers consult diagnosis.pl after the fork instead.
+
+import pytest
+
+from prolog_engine import KnowledgeBaseLoadError
+
+
+@pytest.fixture
+def wsgi(web, monkeypatch):
+    monkeypatch.setenv('WSGI_WARM_UP', '0') # Importing wsgi builds the application; the tests warm up explicitly
+    import wsgi
+    return wsgi
+
+
+def refuse(*args, **kwargs):
+    raise AssertionError("SWI-Prolog was used during the warm-up")
+
+
+def test_warm_up_fills_the_cache_with_the_python_engine(web, wsgi):
+    web.diagnosis_cache.clear()
+    assert wsgi.warm_up(web.app) > 0
+    assert web.diagnosis_cache.stats()['entries'] == 2
+
+
+def test_prolog_warm_up_does_not_consult_before_the_fork(web, wsgi, monkeypatch):
+    monkeypatch.setitem(web.app.config, 'DIAGNOSIS_ENGINE', 'prolog')
+    monkeypatch.setattr(web.prolog_engine, 'ensure_loaded', refuse)
+    monkeypatch.setattr(web.prolog_engine, 'query', refuse)
+    web.diagnosis_cache.clear()
+    assert wsgi.warm_up(web.app) > 0
+    assert web.diagnosis_cache.stats()['entries'] == 0 # Python results must not be served as Prolog ones
+
+
+def test_workers_consult_after_the_fork(web, wsgi, monkeypatch):
+    consults = []
+    monkeypatch.setattr(web.prolog_engine, 'ensure_loaded', lambda: consults.append(1))
+    assert wsgi.warm_up_prolog() >= 0 and consults == [1]
+
+    def broken():
+        raise KnowledgeBaseLoadError("pyswip is not installed")
+    monkeypatch.setattr(web.prolog_engine, 'ensure_loaded', broken)
+    assert wsgi.warm_up_prolog() is None # Logged; the worker still starts
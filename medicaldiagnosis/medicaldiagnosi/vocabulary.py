@@ -0,0 +1,120 @@
+# vocabulary.py
+# Interned symptom and risk factor vocabularies. Every term gets a permanent bit, and a patient's
+# selection is one int bitset over those bits, used in diagnosis state, cache keys, history rows
+# and the scoring engine instead of lists of free-text strings.
+#
+# Terms are matched by normalize_term(), which is the single mapping between the form labels
+# ('body ache', 'cold hands/feet') and the diagnosis.pl atoms (body_ache, cold_hands_feet).
+# Bits are persisted in the `vocabulary` table and only ever appended, so stored bitsets stay
+# readable when diagnosis.pl or the forms gain new terms.
+
+import re
+import sqlite3
+
+SYMPTOMS = 'symptom'
+RISK_FACTORS = 'risk_factor'
+
+_NON_WORD_RE = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_term(text):
+    """Canonical key of a term: lower case, any run of other characters collapsed to '_'."""
+    return _NON_WORD_RE.sub('_', str(text).lower()).strip('_')
+
+
+class Vocabulary:
+    """Bit <-> term mapping for one kind of term (symptoms or risk factors)."""
+
+    def __init__(self, kind, atoms, labels, offered=()):
+        self.kind = kind
+        self.atoms = list(atoms) # bit -> diagnosis.pl atom
+        self.labels = list(labels) # bit -> label shown to users
+        self._bits = {}
+        for bit, (atom, label) in enumerate(zip(self.atoms, self.labels)):
+            self._bits.setdefault(normalize_term(atom), bit)
+            self._bits.setdefault(normalize_term(label), bit)
+        offered_bits = {self._bits[normalize_term(term)] for term in offered}
+        # Spellings accepted from clients: the label and the atom of every term the forms offer
+        self.offered_terms = frozenset(self.labels[bit] for bit in offered_bits) | frozenset(self.atoms[bit] for bit in offered_bits)
+
+    def __len__(self):
+        return len(self.atoms)
+
+    def __contains__(self, term):
+        return normalize_term(term) in self._bits
+
+    @property
+    def byte_width(self):
+        return max(1, (len(self.atoms) + 7) // 8)
+
+    def bit(self, term):
+        """Bit of a term in any spelling, or None if unknown."""
+        return self._bits.get(normalize_term(term))
+
+    def encode(self, terms):
+        """Bitset of the known terms; unknown ones are ignored."""
+        mask = 0
+        for term in terms:
+            bit = self._bits.get(normalize_term(term))
+            if bit is not None:
+                mask |= 1 << bit
+        return mask
+
+    def bits(self, mask):
+        """Set bits in ascending order."""
+        bits = []
+        while mask:
+            low = mask & -mask
+            bits.append(low.bit_length() - 1)
+            mask ^= low
+        return bits
+
+    def atoms_of(self, mask):
+        return [self.atoms[bit] for bit in self.bits(mask)]
+
+    def labels_of(self, mask):
+        return [self.labels[bit] for bit in self.bits(mask)]
+
+    def to_bytes(self, mask):
+        """Fixed-width little-endian encoding for the database (width grows with the vocabulary)."""
+        return mask.to_bytes(self.byte_width, 'little')
+
+    @staticmethod
+    def from_bytes(blob):
+        return int.from_bytes(blob, 'little')
+
+
+def build_entries(kb_atoms, labels):
+    """Merges diagnosis.pl atoms and form labels into {normalized key: (atom, label)}.
+
+    Terms known to the knowledge base keep its atom; form-only terms get their normalized key.
+    """
+    entries = {}
+    for atom in kb_atoms:
+        entries[normalize_term(atom)] = (atom, str(atom).replace('_', ' '))
+    for label in labels:
+        key = normalize_term(label)
+        atom = entries[key][0] if key in entries else key
+        entries[key] = (atom, label)
+    return entries
+
+
+def load_vocabulary(db, kind, kb_atoms, labels):
+    """Returns the Vocabulary for `kind`, appending bits for terms the vocabulary table lacks."""
+    entries = build_entries(kb_atoms, labels)
+    try:
+        db.execute("BEGIN IMMEDIATE") # Workers starting together agree on one bit per term
+        stored = [atom for (atom,) in db.execute("SELECT atom FROM vocabulary WHERE kind = ? ORDER BY bit", (kind,))]
+        known = {normalize_term(atom) for atom in stored}
+        new_keys = sorted(key for key in entries if key not in known)
+        for offset, key in enumerate(new_keys):
+            db.execute("INSERT INTO vocabulary (kind, bit, atom) VALUES (?, ?, ?)", (kind, len(stored) + offset, entries[key][0]))
+        db.commit()
+    except sqlite3.Error:
+        db.rollback()
+        raise
+    atoms = stored + [entries[key][0] for key in new_keys]
+    # Terms dropped from diagnosis.pl keep their bit so old bitsets still decode
+    labels_by_key = {key: label for key, (_atom, label) in entries.items()}
+    return Vocabulary(kind, atoms, [labels_by_key.get(normalize_term(atom), str(atom).replace('_', ' ')) for atom in atoms],
+                      offered=labels)
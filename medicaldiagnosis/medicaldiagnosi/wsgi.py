@@ -0,0 +1,99 @@
+# wsgi.py
+# Production entry point: `gunicorn -c gunicorn.conf.py wsgi:application`
+#
+# Importing this module builds the app (schema migrations, compiled knowledge base, symptom
+# and risk factor tables), compiles every template and runs one canonical diagnosis and
+# report render, so the first real request does not pay for any of it. With gunicorn's
+# preload_app the work happens once in the master and the forked workers share the result
+# copy-on-write; gc.freeze() keeps the garbage collector from touching (and so copying)
+# those pages in every worker.
+#
+# The embedded SWI-Prolog runtime is not fork-safe, so with DIAGNOSIS_ENGINE=prolog the master
+# warms up through the compiled Python knowledge base only, and each worker consults
+# diagnosis.pl after the fork (gunicorn.conf.py calls warm_up_prolog from post_fork).
+
+import gc
+import logging
+import os
+import time
+
+from app_logging import get_logger, log_event
+
+logger = get_logger('wsgi')
+
+WARM_UP_SYMPTOMS = ["fever", "cough", "headache"]
+WARM_UP_RISK_FACTORS = ["smoking"]
+
+
+def _warm_up_bundle(web, symptom_mask, risk_mask, answers, follow_up_k=3, base_scores=None):
+    if web.app.config['DIAGNOSIS_ENGINE'] == 'python':
+        # Fills the knowledge base and bundle caches
+        return web.diagnosis_bundle(symptom_mask, risk_mask, answers, follow_up_k, base_scores)
+    # Never start SWI-Prolog before the fork: score with the compiled knowledge base, and bypass the
+    # bundle cache, which must only hold the configured engine's results
+    return web._score_bundle('python', symptom_mask, risk_mask, answers, follow_up_k, base_scores)
+
+
+def warm_up(flask_app):
+    """Exercises the diagnosis, report and template paths once; returns the seconds it took."""
+    import app as web
+
+    started = time.perf_counter()
+    with flask_app.test_request_context():
+        kbv = web.active_kb()
+        symptom_mask = kbv.symptom_vocabulary.encode(WARM_UP_SYMPTOMS)
+        risk_mask = kbv.risk_vocabulary.encode(WARM_UP_RISK_FACTORS)
+        bundle = _warm_up_bundle(web, symptom_mask, risk_mask, [])
+        if not bundle or not bundle['ranked']:
+            raise RuntimeError("Warm-up diagnosis returned no results; check the knowledge base.")
+        follow_up_answers = [(question, 'yes') for question in bundle['follow_up_questions']]
+        _warm_up_bundle(web, symptom_mask, risk_mask, follow_up_answers, follow_up_k=0,
+                        base_scores=bundle.get('base_scores'))
+        # Loads FPDF fonts and the renderer's wrapped-text cache
+        disease = bundle['ranked'][0][0]
+        web.report_renderer.render(
+            {'name': "Warm-up", 'age': 40, 'weight': 70, 'medical_conditions': 'none'},
+            {'symptoms': WARM_UP_SYMPTOMS, 'disease': disease, 'confidence': bundle['ranked'][0][1],
+             'test': bundle['test'], 'treatment': list(bundle['treatment']), 'advice': bundle['advice'],
+             'personalized_advice': ''})
+    for name in flask_app.jinja_env.list_templates():
+        flask_app.jinja_env.get_template(name)
+    # Workers open their own connections; don't carry this one across the fork
+    web.db_pool.close()
+    return time.perf_counter() - started
+
+
+def warm_up_prolog():
+    """Consults diagnosis.pl in this (forked worker) process; returns the seconds it took, or None on failure.
+
+    A failure is logged rather than raised so the worker still starts; requests then report the
+    knowledge base error as usual.
+    """
+    import app as web
+    from prolog_engine import KnowledgeBaseLoadError
+
+    started = time.perf_counter()
+    try:
+        web.prolog_engine.ensure_loaded()
+    except KnowledgeBaseLoadError as e:
+        log_event(logger, logging.ERROR, 'wsgi.prolog_warm_up_failed', error=str(e), pid=os.getpid())
+        return None
+    return time.perf_counter() - started
+
+
+def warm_up_enabled():
+    return os.environ.get('WSGI_WARM_UP', '1') not in ('0', 'false', 'no')
+
+
+def create_app(warm=True):
+    """Returns the configured Flask app, warmed up unless WSGI_WARM_UP=0."""
+    from app import app as flask_app
+
+    if warm and warm_up_enabled():
+        log_event(logger, logging.INFO, 'wsgi.warm_up_done', ms=round(warm_up(flask_app) * 1000, 1), pid=os.getpid())
+    gc.collect()
+    gc.freeze() # Everything allocated so far is long-lived; keep it out of future collections
+    return flask_app
+
+
+application = create_app()